@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Generates deterministic synthetic corpora for the benchmarks.
+
+The following fixtures are written to the output directory:
+
+- `mono.en`: Monolingual corpus.
+- `para.en`, `para.ja`: Parallel corpus.
+- `corpus.jsonl`: JSONL corpus whose `text` field is `mono.en`.
+- `align.src`, `align.tgt`, `align.align`: Word alignments in the Pharaoh format.
+- `ref.txt`, `sys1.txt`, `sys2.txt`: A reference and two system outputs.
+
+Words follow a Zipfian distribution and sentence lengths a log-normal
+distribution, and `--dup-rate` of the lines repeat earlier lines. The same
+arguments always produce the same files.
+"""
+
+import argparse
+import json
+import os
+from typing import List
+
+import numpy as np
+
+LATIN = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+# Hiragana, katakana and some full-width characters normalized by `z2h`.
+CJK = np.array(
+    [chr(c) for c in range(0x3041, 0x3097)]
+    + [chr(c) for c in range(0x30A1, 0x30FB)]
+    + list("０１２３ＡＢＣａｂｃ，．（）")
+)
+ALIGN_MAX_LINES = 1000
+SYSOUT_MAX_LINES = 2000
+
+
+def make_vocab(rng: np.random.Generator, chars: np.ndarray, size: int) -> np.ndarray:
+    lengths = rng.integers(1, 9, size=size)
+    return np.array(["".join(rng.choice(chars, size=n)) for n in lengths])
+
+
+def make_sentences(
+    rng: np.random.Generator,
+    vocab: np.ndarray,
+    lengths: np.ndarray,
+    zipf: float = 1.2,
+) -> List[str]:
+    ranks = rng.zipf(zipf, size=int(lengths.sum())) % len(vocab)
+    words = vocab[ranks]
+    ends = np.cumsum(lengths)
+    return [" ".join(words[e - n : e]) for e, n in zip(ends.tolist(), lengths.tolist())]
+
+
+def sentence_lengths(rng: np.random.Generator, num_lines: int) -> np.ndarray:
+    return np.clip(rng.lognormal(2.5, 0.6, size=num_lines).astype(np.int64), 1, 250)
+
+
+def duplicate(rng: np.random.Generator, num_lines: int, dup_rate: float) -> np.ndarray:
+    """Returns the source line ID of each line, which repeats an earlier line
+    with the probability `dup_rate`."""
+    ids = np.arange(num_lines)
+    is_dup = rng.random(num_lines) < dup_rate
+    is_dup[0] = False
+    dup_ids = np.flatnonzero(is_dup)
+    ids[dup_ids] = (rng.random(len(dup_ids)) * dup_ids).astype(np.int64)
+    # Resolves the chains of duplicates.
+    return ids[ids]
+
+
+def write_lines(path: str, lines: List[str]):
+    with open(path, mode="w") as f:
+        f.writelines(line + "\n" for line in lines)
+
+
+def perturb(rng: np.random.Generator, vocab: np.ndarray, line: str, rate: float) -> str:
+    words = line.split()
+    mask = rng.random(len(words)) < rate
+    for i in np.flatnonzero(mask).tolist():
+        words[i] = vocab[rng.integers(len(vocab))]
+    return " ".join(words)
+
+
+def generate(output_dir: str, num_lines: int, dup_rate: float = 0.1, seed: int = 0):
+    """Writes the fixtures to `output_dir`."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    en_vocab = make_vocab(rng, LATIN, 50000)
+    ja_vocab = make_vocab(rng, CJK, 50000)
+    lengths = sentence_lengths(rng, num_lines)
+    ids = duplicate(rng, num_lines, dup_rate)
+    en = make_sentences(rng, en_vocab, lengths)
+    ja_lengths = np.maximum(1, lengths + rng.integers(-3, 4, size=num_lines))
+    ja = make_sentences(rng, ja_vocab, ja_lengths)
+    en = [en[i] for i in ids.tolist()]
+    ja = [ja[i] for i in ids.tolist()]
+
+    write_lines(os.path.join(output_dir, "mono.en"), en)
+    write_lines(os.path.join(output_dir, "para.en"), en)
+    write_lines(os.path.join(output_dir, "para.ja"), ja)
+    with open(os.path.join(output_dir, "corpus.jsonl"), mode="w") as f:
+        for i, line in enumerate(en):
+            f.write(json.dumps({"id": i, "text": line}, ensure_ascii=False) + "\n")
+
+    num_aligns = min(num_lines, ALIGN_MAX_LINES)
+    src = make_sentences(rng, en_vocab, rng.integers(3, 16, size=num_aligns))
+    tgt = make_sentences(rng, ja_vocab, rng.integers(3, 16, size=num_aligns))
+    aligns = []
+    for s, t in zip(src, tgt):
+        src_len, tgt_len = len(s.split()), len(t.split())
+        pairs = sorted(
+            {(i, min(tgt_len - 1, i * tgt_len // src_len)) for i in range(src_len)}
+        )
+        aligns.append(" ".join("{}-{}".format(i, j) for i, j in pairs))
+    write_lines(os.path.join(output_dir, "align.src"), src)
+    write_lines(os.path.join(output_dir, "align.tgt"), tgt)
+    write_lines(os.path.join(output_dir, "align.align"), aligns)
+
+    ref = en[:SYSOUT_MAX_LINES]
+    write_lines(os.path.join(output_dir, "ref.txt"), ref)
+    for k, rate in enumerate([0.1, 0.3], start=1):
+        write_lines(
+            os.path.join(output_dir, "sys{}.txt".format(k)),
+            [perturb(rng, en_vocab, line, rate) for line in ref],
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output_dir", metavar="DIR", help="Output directory.")
+    parser.add_argument("--num-lines", "-n", type=int, default=100000,
+                        help="The number of lines of the corpora.")
+    parser.add_argument("--dup-rate", type=float, default=0.1,
+                        help="Rate of the lines that repeat earlier lines.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    generate(args.output_dir, args.num_lines, dup_rate=args.dup_rate, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
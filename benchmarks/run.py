@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Runs the benchmarks and compares them against the stored baselines.
+
+Every subcommand is run in a subprocess, and its wall time and peak RSS are
+taken from `nlpack --stats-json`. The peak RSS is `VmHWM` of the command on
+Linux, which does not include the memory of this process. The fixtures are
+generated in a subprocess as well. `serve` is timed while a client sends
+the corpus in requests. The core functions are timed in this process, and
+their peak memory is measured by `tracemalloc` in a separate run. Each
+benchmark is repeated and the fastest run is reported.
+
+A benchmark regresses if it is slower or uses more memory than its baseline
+by more than the thresholds. The exit status is 1 if any benchmark regresses
+or the startup time of `nlpack normalizer --help` exceeds its budget.
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINES = os.path.join(BENCHMARK_DIR, "baselines.json")
+SIZES = {"small": 20000, "medium": 200000, "large": 2000000}
+NLPACK = [sys.executable, "-m", "nlpack.main", "--no-progress"]
+
+
+@dataclass
+class Result:
+    seconds: float
+    lines_per_sec: float
+    peak_mib: float
+
+    def to_dict(self) -> dict:
+        return {k: round(v, 4) for k, v in asdict(self).items()}
+
+
+@dataclass
+class Command:
+    """A subcommand benchmark.
+
+    `args`, `stdin` and `setup` may contain `{data}` and `{work}`, which are
+    replaced with the data and work directories. `setup` lists the commands
+    run before each untimed run, e.g., to build inputs. If `client` is given,
+    the command is a server: `client(data_dir, work_dir)` is timed while the
+    command runs, and then the command is stopped by SIGTERM.
+    """
+
+    name: str
+    args: List[str]
+    lines: int
+    stdin: Optional[str] = None
+    available: Callable[[], bool] = lambda: True
+    setup: List[List[str]] = field(default_factory=list)
+    client: Optional[Callable[[str, str], None]] = None
+
+
+@dataclass
+class Function:
+    """A core function benchmark. `setup(data_dir)` returns the function
+    to be timed."""
+
+    name: str
+    setup: Callable[[str], Callable[[], object]]
+    lines: int
+
+
+def lid_model_exists() -> bool:
+    from nlpack.locations import cache_dir
+    from nlpack.preprocessor.filter_by_lid import LID_FILENAME
+
+    return os.path.exists(os.path.join(cache_dir("fasttext"), LID_FILENAME))
+
+
+def read_lines(path: str) -> List[str]:
+    with open(path) as f:
+        return [line.rstrip("\n") for line in f]
+
+
+def serve_client(data_dir: str, work_dir: str, timeout: float = 60.0):
+    """Sends the lines of `mono.en` to `serve` in requests of 256 lines."""
+    from nlpack.server import Client
+
+    path = os.path.join(work_dir, "nlpack.sock")
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise TimeoutError("`serve' did not start in {} s.".format(timeout))
+        time.sleep(0.01)
+    lines = read_lines(os.path.join(data_dir, "mono.en"))
+    client = Client(unix_socket=path)
+    try:
+        for begin in range(0, len(lines), 256):
+            batch = lines[begin : begin + 256]
+            client.tokenize(client.normalize(batch, types=["nfkc", "space"]))
+    finally:
+        client.close()
+
+
+def commands(num_lines: int) -> List[Command]:
+    para = ["-i", "{data}/para", "-s", "en", "-s", "ja"]
+    build_index = [
+        ["preprocessor", "build-index", "-o", "{work}/index1", "{data}/para.en"],
+        ["preprocessor", "build-index", "-o", "{work}/index2", "{data}/mono.en"],
+    ]
+    return [
+        Command("normalizer", ["normalizer", "-t", "nfkc", "-t", "space"], num_lines,
+                stdin="{data}/mono.en"),
+        Command("tokenizer", ["tokenizer"], num_lines, stdin="{data}/mono.en"),
+        Command("corpus-stats", ["analyzer", "corpus-stats", "-q", "{data}/mono.en"],
+                num_lines),
+        Command("corpus-stats-jsonl", ["analyzer", "corpus-stats", "-q", "--jsonl-key",
+                "text", "{data}/corpus.jsonl"], num_lines),
+        Command("corpus-stats-no-vocab", ["analyzer", "corpus-stats", "-q",
+                "--no-vocab", "{data}/mono.en"], num_lines),
+        Command("show-aligns", ["analyzer", "show-aligns", "{data}/align.src",
+                "{data}/align.tgt", "{data}/align.align"],
+                min(num_lines, 1000)),
+        Command("compare-sysouts", ["analyzer", "compare-sysouts", "-t", "{data}/ref.txt",
+                "-o", "{data}/sys1.txt", "-o", "{data}/sys2.txt", "-f", "plain"],
+                min(num_lines, 2000)),
+        Command("parallel-cleaner", ["preprocessor", "parallel-cleaner", "-i",
+                "{data}/para", "-o", "{work}/out", "-s", "en", "-t", "ja"], num_lines),
+        Command("mono-cleaner", ["preprocessor", "mono-cleaner", "-i", "{data}/mono",
+                "-o", "{work}/out", "-s", "en"], num_lines),
+        Command("filter-by-lid", ["preprocessor", "filter-by-lid", *para, "-o",
+                "{work}/out", "-l", "en", "-l", "ja"], num_lines,
+                available=lid_model_exists),
+        Command("sampling-corpus", ["preprocessor", "sampling-corpus", *para, "-o",
+                "{work}/out", "-n", str(num_lines // 10)], num_lines),
+        Command("sampling-corpus-reservoir", ["preprocessor", "sampling-corpus", *para,
+                "-o", "{work}/out", "-n", str(num_lines // 10), "-r"], num_lines),
+        Command("shuffle", ["preprocessor", "shuffle", *para, "-o", "{work}/out"],
+                num_lines),
+        Command("length-bucket", ["preprocessor", "length-bucket", *para, "-o",
+                "{work}/out"], num_lines),
+        Command("split-corpus", ["preprocessor", "split-corpus", *para, "-o",
+                "{work}/out", "-S", "dev:0.01", "-S", "test:0.01"], num_lines),
+        Command("dedup-memory", ["preprocessor", "dedup", *para, "-o", "{work}/out",
+                "-m", "memory"], num_lines),
+        Command("dedup-hash", ["preprocessor", "dedup", *para, "-o", "{work}/out",
+                "-m", "hash"], num_lines),
+        Command("dedup-external", ["preprocessor", "dedup", *para, "-o", "{work}/out",
+                "-m", "external", "--tmp-dir", "{work}"], num_lines),
+        Command("build-index", ["preprocessor", "build-index", "-o", "{work}/index",
+                "{data}/para.en"], num_lines),
+        Command("merge-index", ["preprocessor", "merge-index", "-o", "{work}/index",
+                "{work}/index1", "{work}/index2"], 2 * num_lines, setup=build_index),
+        Command("filter-by-index", ["preprocessor", "filter-by-index", *para, "-o",
+                "{work}/out", "-x", "{work}/index2", "-c", "en"], num_lines,
+                setup=build_index[1:]),
+        Command("near-dedup", ["preprocessor", "near-dedup", *para, "-o", "{work}/out"],
+                num_lines),
+        Command("pipeline", ["pipeline", "{work}/pipeline.json"], num_lines),
+        Command("serve", ["serve", "--no-lid", "--unix-socket", "{work}/nlpack.sock"],
+                num_lines, client=serve_client),
+    ]
+
+
+def functions(num_lines: int) -> List[Function]:
+    def buffer_lines(data_dir: str):
+        from nlpack import utils
+
+        path = os.path.join(data_dir, "mono.en")
+
+        def run():
+            with open(path) as f:
+                for _ in utils.buffer_lines(f):
+                    pass
+
+        return run
+
+    def normalizer(data_dir: str):
+        from nlpack.normalizer import Normalizer
+
+        lines = read_lines(os.path.join(data_dir, "para.ja"))
+        norms = [Normalizer.nfkc, Normalizer.z2h, Normalizer.space]
+
+        def run():
+            for line in lines:
+                for norm in norms:
+                    line = norm(line)
+
+        return run
+
+    def tokenizer(data_dir: str):
+        from nlpack.tokenizer import Tokenizer
+
+        lines = read_lines(os.path.join(data_dir, "mono.en"))
+        tokenizer = Tokenizer("space")
+        return lambda: tokenizer(lines)
+
+    def corpus_stats(data_dir: str, no_vocab: bool = False):
+        from nlpack.analyzer.corpus_stats import CorpusStats
+        from nlpack.utils import SentenceBatch
+
+        lines = read_lines(os.path.join(data_dir, "mono.en"))
+        batch = SentenceBatch(list(range(1, len(lines) + 1)), lines)
+        return lambda: CorpusStats.get_stats_batch(batch, 10, no_vocab=no_vocab)
+
+    def scorer(data_dir: str):
+        from nlpack.analyzer.compare_sysouts import SentenceWiseScorer
+
+        hypos = read_lines(os.path.join(data_dir, "sys1.txt"))
+        scorer = SentenceWiseScorer("bleu", os.path.join(data_dir, "ref.txt"))
+        return lambda: scorer.score_sentences(hypos)
+
+    return [
+        Function("buffer_lines", buffer_lines, num_lines),
+        Function("Normalizer", normalizer, num_lines),
+        Function("Tokenizer", tokenizer, num_lines),
+        Function("CorpusStats.get_stats_batch", corpus_stats, num_lines),
+        Function("CorpusStats.get_stats_batch-no-vocab",
+                 lambda d: corpus_stats(d, no_vocab=True), num_lines),
+        Function("SentenceWiseScorer", scorer, min(num_lines, 2000)),
+    ]
+
+
+def run_command(command: Command, data_dir: str, repeat: int) -> Result:
+    best, peak = float("inf"), 0.0
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="nlpack-bench-") as work_dir:
+            with open(os.path.join(work_dir, "pipeline.json"), mode="w") as f:
+                json.dump(
+                    {
+                        "input_prefix": os.path.join(data_dir, "para"),
+                        "output_prefix": os.path.join(work_dir, "pipeline"),
+                        "suffixes": ["en", "ja"],
+                        "stages": [
+                            {"stage": "normalize", "type": ["nfkc", "space"]},
+                            {"stage": "clean"},
+                            {"stage": "dedup"},
+                        ],
+                    },
+                    f,
+                )
+            for setup_args in command.setup:
+                subprocess.run(
+                    NLPACK + [a.format(data=data_dir, work=work_dir) for a in setup_args],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                    check=True,
+                )
+            stats_path = os.path.join(work_dir, "stats.json")
+            args = NLPACK + ["--stats-json", stats_path] + [
+                a.format(data=data_dir, work=work_dir) for a in command.args
+            ]
+            stdin = (
+                open(command.stdin.format(data=data_dir, work=work_dir), mode="rb")
+                if command.stdin is not None
+                else subprocess.DEVNULL
+            )
+            start = time.perf_counter()
+            proc = subprocess.Popen(
+                args, stdin=stdin, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+            if command.client is not None:
+                try:
+                    start = time.perf_counter()
+                    command.client(data_dir, work_dir)
+                    elapsed = time.perf_counter() - start
+                finally:
+                    proc.send_signal(signal.SIGTERM)
+                _, stderr = proc.communicate()
+            else:
+                _, stderr = proc.communicate()
+                elapsed = time.perf_counter() - start
+            if stdin is not subprocess.DEVNULL:
+                stdin.close()
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, args, stderr=stderr)
+            best = min(best, elapsed)
+            with open(stats_path) as f:
+                stats = json.load(f)
+            peak = max(peak, stats["peak_rss"], stats["peak_rss_children"])
+    return Result(best, command.lines / best, peak / (1 << 20))
+
+
+def run_function(function: Function, data_dir: str, repeat: int) -> Result:
+    func = function.setup(data_dir)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return Result(best, function.lines / best, peak / (1 << 20))
+
+
+def measure_startup(repeat: int) -> float:
+    best = float("inf")
+    for _ in range(max(repeat, 5)):
+        start = time.perf_counter()
+        subprocess.run(
+            NLPACK + ["normalizer", "--help"], stdout=subprocess.DEVNULL, check=True
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def compare(
+    results: Dict[str, Result],
+    baselines: Dict[str, dict],
+    threshold: float,
+    memory_threshold: float,
+) -> List[str]:
+    """Prints the results with their changes from the baselines, and returns
+    the names of the regressed benchmarks."""
+    regressions = []
+    print("{:40} {:>10} {:>14} {:>10} {:>9} {:>9}".format(
+        "benchmark", "seconds", "lines/s", "peak MiB", "time", "memory"))
+    for name, result in results.items():
+        time_change = memory_change = ""
+        base = baselines.get(name)
+        if base is not None:
+            time_ratio = result.seconds / base["seconds"] - 1
+            time_change = "{:+.1%}".format(time_ratio)
+            memory_ratio = None
+            if base["peak_mib"] > 0:
+                memory_ratio = result.peak_mib / base["peak_mib"] - 1
+                memory_change = "{:+.1%}".format(memory_ratio)
+            if time_ratio > threshold or (
+                memory_ratio is not None and memory_ratio > memory_threshold
+            ):
+                regressions.append(name)
+        print("{:40} {:10.3f} {:14,.0f} {:10.1f} {:>9} {:>9}{}".format(
+            name, result.seconds, result.lines_per_sec, result.peak_mib,
+            time_change, memory_change, "  REGRESSION" if name in regressions else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=list(SIZES), default="small",
+                        help="Size of the synthetic corpora.")
+    parser.add_argument("--dup-rate", type=float, default=0.1,
+                        help="Rate of the duplicated lines.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument("--data-dir", default=None,
+                        help="Directory of the fixtures, which are generated if missing.")
+    parser.add_argument("--only", nargs="+", default=None, metavar="NAME",
+                        help="Run only the benchmarks whose names contain NAME.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="The number of runs of each benchmark.")
+    parser.add_argument("--baselines", default=BASELINES, help="Baseline file.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed slowdown from the baselines.")
+    parser.add_argument("--memory-threshold", type=float, default=0.2,
+                        help="Allowed increase of the peak memory from the baselines.")
+    parser.add_argument("--startup-budget", type=float, default=0.5,
+                        help="Budget of the startup time in seconds.")
+    parser.add_argument("--update-baselines", action="store_true",
+                        help="Save the results as the baselines of the size.")
+    parser.add_argument("--output", default=None, help="Save the results as JSON.")
+    args = parser.parse_args()
+
+    num_lines = SIZES[args.size]
+    data_dir = args.data_dir or os.path.join(
+        tempfile.gettempdir(),
+        "nlpack-bench-{}-{}-{}".format(args.size, args.dup_rate, args.seed),
+    )
+    if not os.path.exists(os.path.join(data_dir, "sys2.txt")):
+        print("Generating {:,} lines to {}".format(num_lines, data_dir), file=sys.stderr)
+        # The fixtures are generated in a subprocess to keep this process small.
+        subprocess.run(
+            [sys.executable, os.path.join(BENCHMARK_DIR, "generate.py"), data_dir,
+             "--num-lines", str(num_lines), "--dup-rate", str(args.dup_rate),
+             "--seed", str(args.seed)],
+            check=True,
+        )
+
+    def selected(name: str) -> bool:
+        return args.only is None or any(pattern in name for pattern in args.only)
+
+    results: Dict[str, Result] = {}
+    if selected("startup"):
+        seconds = measure_startup(args.repeat)
+        results["startup"] = Result(seconds, 0.0, 0.0)
+    for command in commands(num_lines):
+        name = "cli:" + command.name
+        if not selected(name):
+            continue
+        if not command.available():
+            print("Skipped {}".format(name), file=sys.stderr)
+            continue
+        try:
+            results[name] = run_command(command, data_dir, args.repeat)
+        except subprocess.CalledProcessError as e:
+            sys.stderr.write(e.stderr.decode("utf-8", errors="replace"))
+            sys.exit("{} failed.".format(name))
+    for function in functions(num_lines):
+        name = "func:" + function.name
+        if selected(name):
+            results[name] = run_function(function, data_dir, args.repeat)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    regressions = compare(
+        results, baselines.get(args.size, {}), args.threshold, args.memory_threshold
+    )
+    if args.output is not None:
+        with open(args.output, mode="w") as f:
+            json.dump({name: r.to_dict() for name, r in results.items()}, f, indent=2)
+    if args.update_baselines:
+        baselines.setdefault(args.size, {}).update(
+            {name: r.to_dict() for name, r in results.items()}
+        )
+        with open(args.baselines, mode="w") as f:
+            json.dump(baselines, f, indent=2)
+            f.write("\n")
+        return
+
+    failed = False
+    if "startup" in results and results["startup"].seconds > args.startup_budget:
+        print("Startup time {:.3f} s exceeds the budget {:.3f} s.".format(
+            results["startup"].seconds, args.startup_budget), file=sys.stderr)
+        failed = True
+    if len(regressions) > 0:
+        print("Regressed: {}".format(", ".join(regressions)), file=sys.stderr)
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
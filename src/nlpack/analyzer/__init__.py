@@ -4,6 +4,17 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-from .alignments import show_aligns
-from .compare_sysouts import compare_sysouts
-from .corpus_stats import corpus_stats
+import sys
+
+from nlpack import cli
+
+# Maps command names to `MODULE:FUNCTION`. The modules are imported when
+# the commands are used to keep the CLI startup fast, and the commands are
+# exported as the attributes of the package.
+SUBCOMMANDS = {
+    "show-aligns": "nlpack.analyzer.alignments:show_aligns",
+    "compare-sysouts": "nlpack.analyzer.compare_sysouts:compare_sysouts",
+    "corpus-stats": "nlpack.analyzer.corpus_stats:corpus_stats",
+}
+
+sys.modules[__name__].__class__ = cli.LazyCommandPackage
@@ -9,7 +9,7 @@ from typing import List
 import numpy as np
 import wcwidth
 
-from nlpack import cli
+from nlpack import cli, utils
 
 
 def str_width(string: str) -> int:
@@ -99,11 +99,11 @@ def show_aligns_one(
 def show_aligns(src_path, tgt_path, align_path, transpose):
     """Show the alignment matrices."""
 
-    with open(src_path) as src_file:
+    with utils.open_file(src_path) as src_file:
         src_lines = src_file.readlines()
-    with open(tgt_path) as tgt_file:
+    with utils.open_file(tgt_path) as tgt_file:
         tgt_lines = tgt_file.readlines()
-    with open(align_path) as align_file:
+    with utils.open_file(align_path) as align_file:
         align_lines = align_file.readlines()
 
     i = 0
@@ -15,7 +15,7 @@ from sacrebleu.dataset import DATASETS
 from sacrebleu.metrics import BLEU, CHRF, TER
 from sacrebleu.utils import get_reference_files, smart_open
 
-from nlpack import cli
+from nlpack import cli, profiling, utils
 
 
 class SentenceWiseScorer:
@@ -33,7 +33,8 @@ class SentenceWiseScorer:
         source_file: Optional[str] = None,
     ):
         self.metric = metric
-        self.ref = self.read_reference(test_set)
+        with profiling.timer("read"):
+            self.ref = self.read_reference(test_set)
         self.langpair = langpair
         self.scorer = self.build_scorer(metric, lowercase=lowercase, tokenize=tokenize)
         self.minimize_metric = metric in self.MINIMIZE_METRICS
@@ -43,7 +44,7 @@ class SentenceWiseScorer:
 
         self.source = []
         if source_file is not None:
-            with open(source_file) as f:
+            with utils.open_file(source_file) as f:
                 for line in f:
                     self.source.append(line.strip())
 
@@ -73,7 +74,7 @@ class SentenceWiseScorer:
     def read_reference(self, test_set: str) -> List[str]:
         ref = []
         if os.path.exists(test_set):
-            with open(test_set) as f:
+            with utils.open_file(test_set) as f:
                 for line in f:
                     ref.append([line.strip()])
         elif DATASETS.get(test_set, None) is not None:
@@ -88,7 +89,9 @@ class SentenceWiseScorer:
             return list(executor.map(self.scorer.sentence_score, lines, self.ref))
 
     def add_hypo(self, hypos: List[str]):
-        self.scores.append(self.score_sentences(hypos))
+        with profiling.timer("score"):
+            self.scores.append(self.score_sentences(hypos))
+        profiling.add("score", lines=len(hypos))
         self.sysouts.append(hypos)
 
     def compare_systems(
@@ -114,12 +117,13 @@ class SentenceWiseScorer:
         else:
             sort_indices = np.arange(len(self.ref))
 
-        if format_style == "plain":
-            self.format_plain(sort_indices)
-        elif format_style == "pretty":
-            self.format_pretty(sort_indices)
-        else:
-            raise NotImplementedError
+        with profiling.timer("format"):
+            if format_style == "plain":
+                self.format_plain(sort_indices)
+            elif format_style == "pretty":
+                self.format_pretty(sort_indices)
+            else:
+                raise NotImplementedError
 
     def format_pretty(self, sort_indices: np.ndarray):
         greaters = [{} for _ in self.sysouts]
@@ -318,7 +322,7 @@ def compare_sysouts(
         source_file=source,
     )
     for hypo_file in sysout:
-        with open(hypo_file, mode="r") as f:
+        with utils.open_file(hypo_file, mode="r") as f:
             scorer.add_hypo(f.readlines())
     scorer.compare_systems(
         sort_score=sort_score,
@@ -4,14 +4,16 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-import concurrent.futures
-import fileinput
 import os
 import sys
 from collections import Counter, defaultdict
 from dataclasses import dataclass, field
 
+import numpy as np
+
 from nlpack import cli, utils
+from nlpack.progress import Progress
+from nlpack.tokenizer import count_space_tokens
 from nlpack.utils import SentenceBatch
 
 
@@ -50,9 +52,49 @@ class CorpusStats:
         elif seq_len == self.min_len:
             self.min_len_ids.append(sent_id)
 
+    def get_length_stats(
+        self, sent_ids: list[int], lengths: np.ndarray, histogram_width: int = 50
+    ):
+        """Updates the statistics except the vocabulary from sentence lengths."""
+        if len(lengths) == 0:
+            return
+
+        self.num_sentences += len(lengths)
+        self.num_tokens += int(lengths.sum())
+        self.sqrd_num_tokens += int((lengths**2).sum())
+        bins, counts = np.unique(lengths // histogram_width, return_counts=True)
+        for b, count in zip(bins.tolist(), counts.tolist()):
+            self.histogram[b] += count
+
+        max_len = int(lengths.max())
+        max_len_ids = [sent_ids[i] for i in np.flatnonzero(lengths == max_len)]
+        if max_len > self.max_len:
+            self.max_len_ids = max_len_ids
+            self.max_len = max_len
+        elif max_len == self.max_len:
+            self.max_len_ids.extend(max_len_ids)
+
+        min_len = int(lengths.min())
+        min_len_ids = [sent_ids[i] for i in np.flatnonzero(lengths == min_len)]
+        if min_len < self.min_len:
+            self.min_len_ids = min_len_ids
+            self.min_len = min_len
+        elif min_len == self.min_len:
+            self.min_len_ids.extend(min_len_ids)
+
     @classmethod
-    def get_stats_batch(cls, batch: SentenceBatch, histogram_width: int):
+    def get_stats_batch(
+        cls, batch: SentenceBatch, histogram_width: int, no_vocab: bool = False
+    ):
         self = cls()
+        if no_vocab:
+            lines = [
+                line.encode("utf-8") if isinstance(line, str) else line
+                for line in batch.lines
+            ]
+            self.get_length_stats(batch.ids, count_space_tokens(lines), histogram_width)
+            return self
+
         for sent_id, line in zip(batch.ids, batch.lines):
             self.get_stats(sent_id, line, histogram_width)
         return self
@@ -90,24 +132,30 @@ class CorpusStats:
             help="No verbose.")
 @cli.option("--jsonl-key", type=str, default=None, metavar="KEY",
             help="Read lines as JSONL.")
+@cli.option("--no-vocab", is_flag=True,
+            help="Do not count the vocabulary. Sentence lengths are counted on raw bytes.")
 # fmt: on
-def corpus_stats(input: str, histogram_width: int, buffer_size: int, quiet: bool, jsonl_key: str | None):
+def corpus_stats(input: str, histogram_width: int, buffer_size: int, quiet: bool, jsonl_key: str | None, no_vocab: bool):
     """Show the corpus statistics.
 
     If FILE is not given, read from standard input.
     """
 
-    results = []
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        with fileinput.input(files=[input]) as f:
+    from nlpack import api
+
+    mode = "rb" if no_vocab and jsonl_key is None else "r"
+    with utils.open_file(input, mode=mode) as f:
+        progress = Progress("corpus-stats", [f])
+
+        def read_batches():
             for batch in utils.buffer_lines(f, buffer_size=buffer_size, jsonl_key=jsonl_key):
-                results.append(
-                    executor.submit(CorpusStats.get_stats_batch, batch, histogram_width)
-                )
+                yield batch
+                progress.update(len(batch))
 
-    stats = CorpusStats()
-    for res in results:
-        stats.merge(res.result())
+        stats = api.corpus_stats(
+            read_batches(), histogram_width, no_vocab=no_vocab, num_workers=None
+        )
+        progress.close()
 
     assert stats.num_sentences > 0, "No input."
 
@@ -135,7 +183,8 @@ def corpus_stats(input: str, histogram_width: int, buffer_size: int, quiet: bool
     stats_table.add_row("# of tokens", f"{stats.num_tokens}")
     stats_table.add_row("# of tokens (mean)", f"{num_tokens_mean:.2f}")
     stats_table.add_row("# of tokens (SD)", f"{num_tokens_sd:.2f}")
-    stats_table.add_row("# of vocabulary", f"{len(stats.vocab)}")
+    if not no_vocab:
+        stats_table.add_row("# of vocabulary", f"{len(stats.vocab)}")
     if quiet:
         stats_table.add_row("max length", f"{stats.max_len}")
         stats_table.add_row("min length", f"{stats.min_len}")
@@ -0,0 +1,266 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Streaming Python API.
+
+The functions process lines in memory, without files or subprocesses. A row
+is a line (`str`) or a tuple of aligned lines, e.g., `(src, tgt)`; streaming
+functions yield rows of the same kind as their input. The `*_batch`
+functions take `SentenceBatch` objects, one per column, and return new ones.
+
+Example:
+    >>> from nlpack import api
+    >>> list(api.normalize(["Ｈｅｌｌｏ　 world"], types=["nfkc", "space"]))
+    ['Hello world']
+    >>> list(api.dedup([("a", "x"), ("b", "y"), ("a", "x")]))
+    [('a', 'x'), ('b', 'y')]
+"""
+
+import functools
+import itertools
+import os
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Union
+
+from nlpack import profiling, utils
+from nlpack.analyzer.corpus_stats import CorpusStats
+from nlpack.hashing import HashSet
+from nlpack.normalizer import NORMALIZATION_TYPES, Normalizer
+from nlpack.stages import CleanStage, DedupStage, LidStage, NormalizeStage, Stage
+from nlpack.tokenizer import Tokenizer
+from nlpack.utils import SentenceBatch
+
+Row = Union[str, Sequence[str]]
+
+
+def iter_batches(
+    rows: Iterable[Row], batch_size: int = 10000
+) -> Iterator[List[SentenceBatch]]:
+    """Groups rows into lists of aligned batches, one batch per column.
+
+    Sentence ids start from 1.
+    """
+    rows = iter(rows)
+    begin = 1
+    while True:
+        chunk = [
+            (row,) if isinstance(row, str) else row
+            for row in itertools.islice(rows, batch_size)
+        ]
+        if len(chunk) == 0:
+            return
+        columns = [list(c) for c in zip(*chunk)]
+        ids = list(range(begin, begin + len(chunk)))
+        yield [SentenceBatch(ids, lines) for lines in columns]
+        begin += len(chunk)
+
+
+def run_stage(stage: Stage, rows: Iterable[Row], batch_size: int) -> Iterator[Row]:
+    """Applies a stage to rows batch by batch."""
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    is_mono = isinstance(first, str)
+    stage.setup()
+    for batches in iter_batches(itertools.chain([first], rows), batch_size):
+        batches = stage(batches)
+        if is_mono:
+            yield from batches[0].lines
+        else:
+            yield from zip(*(batch.lines for batch in batches))
+
+
+def column_names(num_columns: int) -> List[str]:
+    return [str(c) for c in range(num_columns)]
+
+
+def normalize(lines: Iterable[str], types: Sequence[str] = ("space",)) -> Iterator[str]:
+    """Normalizes lines by the `Normalizer` methods in `types` in order."""
+    if any(t not in NORMALIZATION_TYPES for t in types):
+        raise ValueError("unknown normalization types: {}".format(list(types)))
+    normalizers = [getattr(Normalizer, t) for t in types]
+    for line in lines:
+        for norm in normalizers:
+            line = norm(line)
+        yield line
+
+
+def normalize_batch(
+    batch: SentenceBatch, types: Sequence[str] = ("space",)
+) -> SentenceBatch:
+    return NormalizeStage(["0"], type=types)([batch])[0]
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(type: str = "space", lang: str = "en", hyphen_split: bool = False):
+    """Returns a tokenizer, which is created once per arguments."""
+    return Tokenizer(type, lang=lang, hyphen_split=hyphen_split)
+
+
+def tokenize(
+    lines: Iterable[str],
+    type: str = "space",
+    lang: str = "en",
+    hyphen_split: bool = False,
+    batch_size: int = 10000,
+) -> Iterator[List[str]]:
+    """Tokenizes lines and yields the tokens of each line."""
+    tokenizer = get_tokenizer(type, lang, hyphen_split)
+    for batch in iter_batches(lines, batch_size):
+        yield from tokenizer(batch[0].lines)
+
+
+def tokenize_batch(
+    batch: SentenceBatch, type: str = "space", lang: str = "en", hyphen_split: bool = False
+) -> List[List[str]]:
+    return get_tokenizer(type, lang, hyphen_split)(batch.lines)
+
+
+def clean(
+    rows: Iterable[Row],
+    min_len: int = 1,
+    max_len: int = 10000,
+    ratio: Optional[float] = 9,
+    char_ratio: Optional[float] = None,
+    max_token_len: Optional[int] = None,
+    max_digit_ratio: Optional[float] = None,
+    blacklist: Sequence[str] = (),
+    batch_size: int = 10000,
+) -> Iterator[Row]:
+    """Keeps the rows that pass the filters of `parallel-cleaner`, or
+    `mono-cleaner` for lines.
+
+    `ratio` and `char_ratio` only apply to rows of two lines.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    stage = CleanStage(
+        column_names(1 if isinstance(first, str) else len(first)),
+        min_len=min_len,
+        max_len=max_len,
+        ratio=ratio,
+        char_ratio=char_ratio,
+        max_token_len=max_token_len,
+        max_digit_ratio=max_digit_ratio,
+        blacklist=blacklist,
+    )
+    yield from run_stage(stage, itertools.chain([first], rows), batch_size)
+
+
+def clean_batch(batches: Sequence[SentenceBatch], **kwargs) -> List[SentenceBatch]:
+    """Keeps the line tuples of aligned batches that pass the filters. The
+    keyword arguments are the same as `clean()`."""
+    return CleanStage(column_names(len(batches)), **kwargs)(list(batches))
+
+
+def filter_by_lid(
+    rows: Iterable[Row],
+    langs: Sequence[str],
+    min_prob: float = 0.0,
+    model: Optional[str] = None,
+    batch_size: int = 10000,
+) -> Iterator[Row]:
+    """Keeps the rows whose lines are identified as `langs` by fastText.
+
+    `langs` has one language per line of a row, and `__` skips the line.
+    The model is downloaded on first use unless `model` is given.
+    """
+    stage = LidStage(column_names(len(langs)), langs, min_prob=min_prob, model=model)
+    yield from run_stage(stage, rows, batch_size)
+
+
+def lid_batch(
+    batches: Sequence[SentenceBatch],
+    langs: Sequence[str],
+    min_prob: float = 0.0,
+    model: Optional[str] = None,
+) -> List[SentenceBatch]:
+    stage = LidStage(column_names(len(batches)), langs, min_prob=min_prob, model=model)
+    stage.setup()
+    return stage(list(batches))
+
+
+def identify_language(
+    lines: Sequence[str], k: int = 1, model: Optional[str] = None
+) -> List[List[tuple[str, float]]]:
+    """Returns the top-k languages and probabilities of each line."""
+    from nlpack.preprocessor.filter_by_lid import (
+        get_lid_model_path,
+        init_lid_model,
+        predict_languages,
+    )
+
+    init_lid_model(model or get_lid_model_path())
+    return predict_languages(lines, k=k)
+
+
+def dedup(
+    rows: Iterable[Row],
+    hash_bits: int = 64,
+    hash_set: Optional[HashSet] = None,
+    batch_size: int = 10000,
+) -> Iterator[Row]:
+    """Keeps the first occurrence of each row.
+
+    Pass the same `hash_set` to deduplicate across calls.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    stage = DedupStage(
+        column_names(1 if isinstance(first, str) else len(first)), hash_bits=hash_bits
+    )
+    if hash_set is not None:
+        stage.hash_set = hash_set
+    yield from run_stage(stage, itertools.chain([first], rows), batch_size)
+
+
+def dedup_batch(
+    batches: Sequence[SentenceBatch], hash_set: HashSet, hash_bits: int = 64
+) -> List[SentenceBatch]:
+    """Keeps the line tuples that are not in `hash_set`, and adds them to it."""
+    stage = DedupStage(column_names(len(batches)), hash_bits=hash_bits)
+    stage.hash_set = hash_set
+    return stage(list(batches))
+
+
+def corpus_stats(
+    lines: Union[Iterable[str], Iterable[SentenceBatch]],
+    histogram_width: int = 10,
+    no_vocab: bool = False,
+    batch_size: int = 1000000,
+    num_workers: Optional[int] = 1,
+) -> CorpusStats:
+    """Computes the statistics of lines or `SentenceBatch` objects.
+
+    Batches are processed in `num_workers` processes; `None` uses all CPUs.
+    """
+    items: Iterator[Any] = iter(lines)
+    first = next(items, None)
+    if first is None:
+        return CorpusStats()
+    items = itertools.chain([first], items)
+    batches: Iterable[SentenceBatch] = (
+        items
+        if isinstance(first, SentenceBatch)
+        else (batch[0] for batch in iter_batches(items, batch_size))
+    )
+
+    stats = CorpusStats()
+    for _, batch_stats in utils.imap_ordered(
+        functools.partial(
+            CorpusStats.get_stats_batch,
+            histogram_width=histogram_width,
+            no_vocab=no_vocab,
+        ),
+        batches,
+        num_workers=num_workers or os.cpu_count() or 1,
+    ):
+        with profiling.timer("merge"):
+            stats.merge(batch_stats)
+    return stats
@@ -0,0 +1,171 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+import os
+import time
+from typing import IO, Any, Dict, List, Optional, Sequence
+
+from nlpack import cli, utils
+
+VERSION = 1
+
+
+def fsync_dir(path: str):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: str, data: Dict[str, Any]):
+    """Writes JSON to a temporary file and renames it to `path`."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode="w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(path)
+
+
+class Checkpoint:
+    """Saves the progress of a streaming command so that it can be resumed.
+
+    A checkpoint records the byte offsets of the input and output files
+    after the last written chunk, and the counters of the command. It is
+    saved at most every `interval` seconds, after the outputs are flushed
+    and synced, and replaces the previous one atomically. If the checkpoint
+    file exists, the run resumes: the outputs are truncated to the recorded
+    offsets and the inputs are read from the recorded offsets.
+
+    Example:
+        >>> checkpoint = Checkpoint(path, params)
+        >>> input_files = checkpoint.open_inputs(input_paths)
+        >>> output_files = checkpoint.open_outputs(output_paths)
+        >>> for columns in utils.buffer_aligned_lines(input_files):
+        ...     write(output_files, columns)
+        ...     checkpoint.update(columns, num_lines=...)
+        >>> checkpoint.finish()
+
+    Args:
+        path (str, optional): Checkpoint file. `None` disables checkpointing.
+        params (Dict[str, Any]): Options that affect the outputs. A checkpoint
+          saved with other options is refused.
+        interval (float): Minimum seconds between saves.
+    """
+
+    def __init__(
+        self, path: Optional[str], params: Dict[str, Any], interval: float = 60.0
+    ):
+        self.path = path
+        self.params = json.loads(json.dumps(params))
+        self.interval = interval
+        self.state: Optional[Dict[str, Any]] = None
+        self.input_files: List[IO] = []
+        self.output_files: List[IO] = []
+        self.input_offsets: List[int] = []
+        self.next_save = time.monotonic() + interval
+        if path is not None and os.path.exists(path):
+            with open(path, mode="r") as f:
+                self.state = json.load(f)
+            if self.state.get("version") != VERSION or self.state["params"] != self.params:
+                cli.abort(
+                    "{} was saved with other options. Remove it to start over.".format(path)
+                )
+
+    @property
+    def resumed(self) -> bool:
+        return self.state is not None
+
+    @property
+    def counters(self) -> Dict[str, Any]:
+        """Counters of the resumed run, or an empty dictionary."""
+        return self.state["counters"] if self.state is not None else {}
+
+    def check_paths(self, paths: Sequence[str], key: str):
+        if self.path is None:
+            return
+        if any(utils.is_compressed(path) for path in paths):
+            cli.abort("`--checkpoint' does not support compressed files.")
+        if self.state is not None and self.state[key]["paths"] != list(paths):
+            cli.abort("{} was saved for other files.".format(self.path))
+
+    def open_inputs(self, paths: Sequence[str]) -> List[IO]:
+        """Opens the input files, which are positioned at the recorded offsets
+        on resume."""
+        self.check_paths(paths, "inputs")
+        self.input_files = [utils.open_file(path, mode="rb") for path in paths]
+        self.input_offsets = [0] * len(paths)
+        if self.state is not None:
+            self.input_offsets = list(self.state["inputs"]["offsets"])
+            for f, path, offset in zip(self.input_files, paths, self.input_offsets):
+                if os.path.getsize(path) < offset:
+                    cli.abort("{} is shorter than the checkpoint.".format(path))
+                f.seek(offset)
+        return self.input_files
+
+    def open_outputs(self, paths: Sequence[str]) -> List[IO]:
+        """Opens the output files, which are truncated to the recorded offsets
+        on resume."""
+        self.check_paths(paths, "outputs")
+        if self.state is None:
+            self.output_files = [utils.open_file(path, mode="wb") for path in paths]
+            return self.output_files
+
+        self.output_files = []
+        for path, offset in zip(paths, self.state["outputs"]["offsets"]):
+            if not os.path.exists(path) or os.path.getsize(path) < offset:
+                cli.abort("{} is shorter than the checkpoint.".format(path))
+            f = open(path, mode="r+b")
+            f.truncate(offset)
+            f.seek(offset)
+            self.output_files.append(f)
+        cli.echo(
+            "Resume from {} at {:,} lines.".format(
+                self.path, self.counters.get("total_lines", 0)
+            ),
+            err=True,
+        )
+        return self.output_files
+
+    def update(self, columns: Sequence[List[bytes]], **counters: Any):
+        """Advances the input offsets by a chunk whose outputs have been
+        written, and saves a checkpoint if `interval` seconds have passed."""
+        if self.path is None:
+            return
+        for i, lines in enumerate(columns):
+            self.input_offsets[i] += sum(map(len, lines))
+        if time.monotonic() >= self.next_save:
+            self.save(counters)
+
+    def save(self, counters: Dict[str, Any]):
+        assert self.path is not None
+        for f in self.output_files:
+            f.flush()
+            os.fsync(f.fileno())
+        write_atomic(
+            self.path,
+            {
+                "version": VERSION,
+                "params": self.params,
+                "inputs": {
+                    "paths": [f.name for f in self.input_files],
+                    "offsets": self.input_offsets,
+                },
+                "outputs": {
+                    "paths": [f.name for f in self.output_files],
+                    "offsets": [f.tell() for f in self.output_files],
+                },
+                "counters": counters,
+            },
+        )
+        self.next_save = time.monotonic() + self.interval
+
+    def finish(self):
+        """Removes the checkpoint after the run has completed."""
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
@@ -3,18 +3,14 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import importlib
 import sys
-from typing import IO, Any, Optional
+import types
+from typing import IO, Any, Dict, List, NoReturn, Optional
 
 import click
 from click import File, confirm, pass_context, style
 from click_help_colors import HelpColorsCommand, HelpColorsGroup
-import rich
-from rich.bar import Bar
-from rich.box import HORIZONTALS, ROUNDED, SQUARE
-from rich.console import Console
-from rich.table import Table
-from rich.theme import Theme
 
 from nlpack import __version__
 
@@ -22,12 +18,90 @@ CONTEXT = {
     "help_option_names": ["--help", "-h"],
 }
 
+# rich is slow to import, so its members are imported on first access, e.g.,
+# `cli.Table`.
+RICH_MEMBERS = {
+    "Bar": "rich.bar",
+    "HORIZONTALS": "rich.box",
+    "ROUNDED": "rich.box",
+    "SQUARE": "rich.box",
+    "Console": "rich.console",
+    "Table": "rich.table",
+    "Theme": "rich.theme",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in RICH_MEMBERS:
+        return getattr(importlib.import_module(RICH_MEMBERS[name]), name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+class LazyGroup(HelpColorsGroup):
+    """A command group that imports subcommands when they are used.
+
+    Args:
+        lazy_subcommands (Dict[str, str], optional): Maps command names to
+          `MODULE:ATTRIBUTE` import paths of the commands.
+    """
+
+    def __init__(self, *args, lazy_subcommands: Optional[Dict[str, str]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
 
-def command(*args, **kwargs):
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> Optional[click.Command]:
+        if cmd_name in self.lazy_subcommands and cmd_name not in self.commands:
+            module_name, attr = self.lazy_subcommands[cmd_name].split(":")
+            self.add_command(
+                getattr(importlib.import_module(module_name), attr), name=cmd_name
+            )
+        return super().get_command(ctx, cmd_name)
+
+
+class LazyCommandPackage(types.ModuleType):
+    """A package that exports the commands of its `SUBCOMMANDS` lazily.
+
+    `from PACKAGE import NAME` returns the command `NAME`, which is imported on
+    first access. A command named as its submodule shadows the submodule, as
+    the eager `from .NAME import NAME` did, whether or not the submodule has
+    already been imported.
+    """
+
+    def commands(self) -> Dict[str, str]:
+        """Maps command attribute names to `MODULE:ATTRIBUTE` import paths."""
+        paths = self.__dict__["SUBCOMMANDS"].values()
+        return {path.split(":")[1]: path for path in paths}
+
+    def __getattr__(self, name: str) -> Any:
+        path = self.commands().get(name)
+        if path is None:
+            raise AttributeError(
+                "module {!r} has no attribute {!r}".format(self.__name__, name)
+            )
+        module_name, attr = path.split(":")
+        command = getattr(importlib.import_module(module_name), attr)
+        setattr(self, name, command)
+        return command
+
+    def __setattr__(self, name: str, value: Any):
+        # The import system binds a submodule to the package after loading it.
+        path = self.commands().get(name)
+        if path is not None and isinstance(value, types.ModuleType):
+            module_name, attr = path.split(":")
+            if value.__name__ == module_name:
+                value = getattr(value, attr)
+        super().__setattr__(name, value)
+
+
+def command(*args, lazy_subcommands: Optional[Dict[str, str]] = None, **kwargs):
     return click.group(
         *args,
         **kwargs,
-        cls=HelpColorsGroup,
+        cls=LazyGroup,
+        lazy_subcommands=lazy_subcommands,
         help_headers_color="green",
         help_options_color="cyan",
         context_settings=CONTEXT,
@@ -68,15 +142,6 @@ def version_option(*args, **kwargs):
     return click.version_option(__version__, "--version", "-V", message="%(version)s")
 
 
-def add_subcommands(parent, module):
-    for member_name in dir(module):
-        if member_name.startswith("__"):
-            continue
-        member = getattr(module, member_name)
-        if isinstance(member, click.Command):
-            parent.add_command(member)
-
-
 def highlight(strings: str):
     return style(strings, fg="cyan")
 
@@ -96,12 +161,15 @@ def echo(
     return click.secho(msg, nl=nl, err=err, fg=fg)
 
 
-def abort(msg: str, exit_code: int = 1):
+def abort(msg: str, exit_code: int = 1) -> NoReturn:
     echo(msg, failed=True, err=True)
     sys.exit(exit_code)
 
 
 def print_box(s: str):
+    from rich.box import ROUNDED
+    from rich.table import Table
+
     _box = Table(box=ROUNDED, show_header=False)
     _box.add_row(s)
     rprint(_box)
@@ -125,25 +193,77 @@ def rprint(
         flush (bool, optional): Has no effect as Rich always flushes output. Defaults to False.
 
     """
+    from rich.console import Console
+    from rich.theme import Theme
+
     write_console = Console(theme=Theme(inherit=False)) if file is None else Console(file=file)
     return write_console.print(*objects, sep=sep, end=end)
 
 
 def print_no_crop(*args, **kwargs):
+    from rich.console import Console
+
     console = Console(width=sys.maxsize)
     console.print(*args, **kwargs)
 
 
 def print_table(*args, **kwargs):
+    from rich.console import Console
+
     console = Console()
     console.print(*args, **kwargs)
 
 
-def option_num_workers(short_option: Optional[str] = None):
+class SizeParamType(click.ParamType):
+    """A human readable size such as `512M` or `4G`, converted into bytes."""
+
+    name = "size"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        from nlpack import utils
+
+        try:
+            return utils.parse_size(value)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+
+SIZE = SizeParamType()
+
+
+def option_num_workers(short_option: Optional[str] = None, default: int = 8):
     argument_strs = ["--num-workers"]
     if short_option is not None:
         argument_strs.append(short_option)
 
     return option(
-        *argument_strs, type=int, metavar="N", default=8, help="Number of workers."
+        *argument_strs, type=int, metavar="N", default=default, help="Number of workers."
     )
+
+
+def option_checkpoint():
+    def decorator(f):
+        f = option("--checkpoint-interval", type=float, metavar="SEC", default=60.0,
+                   help="Seconds between checkpoints.")(f)
+        return option("--checkpoint", type=str, metavar="FILE", default=None,
+                      help="Save the progress to FILE periodically, and resume from "
+                      "FILE if it exists. It is removed when the run completes.")(f)
+
+    return decorator
+
+
+def option_shards():
+    def decorator(f):
+        f = option("--shard-seed", type=int, metavar="N", default=0,
+                   help="Seed of the `hash' shard assignment.")(f)
+        f = option("--shard-by", choice=["hash", "round-robin"], default="hash",
+                   help="`hash' assigns identical line tuples to the same shard. "
+                   "`round-robin' balances the number of lines.")(f)
+        return option("--num-shards", type=int, metavar="N", default=1,
+                      help="Write the outputs to N shards `OUTPUT_PREFIX.shardK.SUFFIX', "
+                      "and the line and byte counts of the shards to "
+                      "`OUTPUT_PREFIX.manifest.json'.")(f)
+
+    return decorator
@@ -0,0 +1,140 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+from typing import List, Sequence
+
+import numpy as np
+
+
+def hash_line_tuples(columns: Sequence[List[bytes]], bits: int = 64) -> np.ndarray:
+    """Hashes aligned line tuples.
+
+    Unlike `hash()`, the values are stable across processes and runs.
+
+    Args:
+        columns (Sequence[List[bytes]]): Columns of lines. The `i`-th tuple
+          consists of the `i`-th line of each column.
+        bits (int): Hash size, 64 or 128.
+
+    Returns:
+        np.ndarray: Hash values of shape `(num_lines, bits // 64)`.
+    """
+    assert bits in (64, 128)
+    digest_size = bits // 8
+    digests = b"".join(
+        hashlib.blake2b(b"\0".join(lines), digest_size=digest_size).digest()
+        for lines in zip(*columns)
+    )
+    return np.frombuffer(digests, dtype=np.uint64).reshape(-1, bits // 64)
+
+
+def mix64(x: np.ndarray) -> np.ndarray:
+    """The finalizer of SplitMix64, which spreads bits of uint64 values."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def collision_probability(num_keys: int, bits: int) -> float:
+    """Returns the birthday bound of the probability of any hash collision."""
+    return min(1.0, num_keys * (num_keys - 1) / 2 ** (bits + 1))
+
+
+class HashSet:
+    """A compact set of fixed-size hash values.
+
+    The values are stored in a numpy array with open addressing and linear
+    probing, so each key costs only a few words regardless of the size of the
+    original data. Insertions are vectorized over a batch of keys.
+
+    Args:
+        words (int): The number of uint64 words of a key.
+        capacity (int): Initial number of slots. It is rounded up to a power
+          of two.
+        max_load (float): The table is doubled when the load factor exceeds it.
+    """
+
+    def __init__(self, words: int = 1, capacity: int = 1 << 16, max_load: float = 0.5):
+        self.words = words
+        self.max_load = max_load
+        self.size = 0
+        self.table = np.zeros((1 << max(capacity - 1, 1).bit_length(), words), dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def capacity(self) -> int:
+        return len(self.table)
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
+
+    def add(self, keys: np.ndarray) -> np.ndarray:
+        """Inserts keys.
+
+        Args:
+            keys (np.ndarray): Keys of shape `(num_keys, words)`.
+
+        Returns:
+            np.ndarray: `True` for the first occurrence of each key that was
+              not in the set, considering duplicates within `keys` as well.
+        """
+        keys = np.array(keys, dtype=np.uint64).reshape(-1, self.words)
+        # The all-zero key marks an empty slot.
+        keys[~keys.any(axis=1), 0] = 1
+
+        row_view = keys.view(np.dtype((np.void, 8 * self.words))).ravel()
+        _, first = np.unique(row_view, return_index=True)
+        first.sort()
+
+        self._reserve(self.size + len(first))
+        is_new = np.zeros(len(keys), dtype=bool)
+        is_new[first[self._insert(keys[first])]] = True
+        return is_new
+
+    def _reserve(self, num_keys: int):
+        capacity = self.capacity
+        while num_keys > capacity * self.max_load:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+
+        old_keys = self.table[self.table.any(axis=1)]
+        self.table = np.zeros((capacity, self.words), dtype=np.uint64)
+        self.size = 0
+        self._insert(old_keys)
+
+    def _insert(self, keys: np.ndarray) -> np.ndarray:
+        """Inserts distinct non-zero keys and returns which ones are new."""
+        is_new = np.zeros(len(keys), dtype=bool)
+        mask = np.uint64(self.capacity - 1)
+        pending = np.arange(len(keys))
+        slots = keys[:, 0] & mask
+        while len(pending) > 0:
+            occupants = self.table[slots]
+            is_empty = ~occupants.any(axis=1)
+            is_done = (occupants == keys[pending]).all(axis=1)
+
+            # Several keys may claim the same empty slot; the first one wins
+            # and the others probe again in the next round.
+            claims = np.flatnonzero(is_empty)
+            if len(claims) > 0:
+                _, winners = np.unique(slots[claims], return_index=True)
+                winners = claims[winners]
+                self.table[slots[winners]] = keys[pending[winners]]
+                is_new[pending[winners]] = True
+                is_done[winners] = True
+                self.size += len(winners)
+
+            is_occupied = ~is_empty & ~is_done
+            slots[is_occupied] = (slots[is_occupied] + np.uint64(1)) & mask
+            pending = pending[~is_done]
+            slots = slots[~is_done]
+        return is_new
@@ -0,0 +1,102 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+from typing import Optional
+
+import numpy as np
+
+from nlpack import cli, utils
+
+LINE_INDEX_SUFFIX = ".offsets.npy"
+
+
+def line_index_path(path: str) -> str:
+    return path + LINE_INDEX_SUFFIX
+
+
+def check_seekable(path: str):
+    """Compressed files cannot be read at line offsets.
+
+    Raises:
+        ValueError: If the file is compressed.
+    """
+    if utils.is_compressed(path):
+        raise ValueError("{} is compressed and cannot be indexed by lines.".format(path))
+
+
+def build_line_offsets(path: str, chunk_size: int = 1 << 26) -> np.ndarray:
+    """Scans a file and returns the byte offset of the beginning of each line.
+
+    Args:
+        path (str): File path.
+        chunk_size (int): The number of bytes read at once.
+
+    Returns:
+        np.ndarray: Line offsets of shape `(num_lines,)`.
+
+    Raises:
+        ValueError: If the file is compressed.
+    """
+    check_seekable(path)
+    offsets = [np.zeros(1, dtype=np.uint64)]
+    position = 0
+    with open(path, mode="rb") as f:
+        while True:
+            buf = f.read(chunk_size)
+            if len(buf) == 0:
+                break
+            newlines = np.flatnonzero(np.frombuffer(buf, dtype=np.uint8) == 0x0A)
+            offsets.append((newlines + position + 1).astype(np.uint64))
+            position += len(buf)
+    starts = np.concatenate(offsets)
+    # The offset after the last newline is the end of the file, not a line.
+    return starts[starts < position]
+
+
+def read_line_index(path: str) -> Optional[np.ndarray]:
+    """Returns the offsets saved in `PATH.offsets.npy`, or `None` if the index
+    does not exist or is older than the file, or the file is compressed."""
+    if utils.is_compressed(path):
+        return None
+    index_path = line_index_path(path)
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(
+        path
+    ):
+        return np.load(index_path, mmap_mode="r")
+    return None
+
+
+def load_line_offsets(path: str, save: bool = False) -> np.ndarray:
+    """Loads the line offsets of a file, building them if there is no
+    up-to-date index.
+
+    Args:
+        path (str): File path.
+        save (bool): Save the built offsets as `PATH.offsets.npy` for later
+          runs. A failure to save, e.g., in a read-only directory, is reported
+          as a warning.
+
+    Returns:
+        np.ndarray: Line offsets of shape `(num_lines,)`.
+
+    Raises:
+        ValueError: If the file is compressed.
+    """
+    check_seekable(path)
+    offsets = read_line_index(path)
+    if offsets is not None:
+        return offsets
+
+    offsets = build_line_offsets(path)
+    if save:
+        index_path = line_index_path(path)
+        try:
+            with open(index_path + ".tmp", mode="wb") as f:
+                np.save(f, offsets)
+            os.replace(index_path + ".tmp", index_path)
+        except OSError as e:
+            cli.echo("Warning: cannot save {}: {}".format(index_path, e), err=True)
+    return offsets
@@ -5,19 +5,69 @@
 # LICENSE file in the root directory of this source tree.
 
 import sys
+from typing import Optional
 
-from nlpack import analyzer, cli, normalizer, preprocessor, tokenizer
+from nlpack import analyzer, cli, preprocessor
 
 
-@cli.command("main")
+@cli.command(
+    "main",
+    lazy_subcommands={
+        "normalizer": "nlpack.normalizer:normalizer",
+        "pipeline": "nlpack.pipeline:pipeline",
+        "serve": "nlpack.server:serve",
+        "tokenizer": "nlpack.tokenizer:tokenize",
+    },
+)
 @cli.version_option()
+# fmt: off
+@cli.option("--profile", is_flag=True,
+            help="Print the time and throughput of each stage to the standard error.")
+@cli.option("--stats-json", type=str, metavar="FILE", default=None,
+            help="Save the profile statistics as JSON.")
+@cli.option("--cprofile", type=str, metavar="FILE", default=None,
+            help="Save the cProfile statistics of the main process to FILE and "
+            "those aggregated over workers to FILE.workers.")
+@cli.option("--progress/--no-progress", "show_progress", default=True,
+            help="Show the progress of long-running commands on the standard error.")
+@cli.option("--compress-threads", type=int, metavar="N", default=None,
+            help="Number of threads that compress .gz, .bz2 and .xz outputs. "
+            "1 compresses them in a single stream.  [default: min(4, CPUs)]")
+# fmt: on
 @cli.pass_context
-def main(ctx):
+def main(
+    ctx,
+    profile: bool,
+    stats_json: Optional[str],
+    cprofile: Optional[str],
+    show_progress: bool,
+    compress_threads: Optional[int],
+):
     """
     nlpack v0.0.1
 
     Collections of natural language processing tools.
     """
+    if not show_progress:
+        from nlpack import progress
+
+        progress.disable()
+    if compress_threads is not None:
+        from nlpack import utils
+
+        utils.COMPRESS_THREADS = compress_threads
+    if profile or stats_json is not None or cprofile is not None:
+        from nlpack import profiling
+
+        profiling.enable(cprofile=cprofile is not None)
+        ctx.call_on_close(
+            lambda: profiling.report(
+                profiling.disable(),
+                print_summary=profile,
+                stats_json=stats_json,
+                cprofile_path=cprofile,
+            )
+        )
 
 
 @main.command("help")
@@ -42,7 +92,7 @@ def help(ctx, command):
     sys.exit(0)
 
 
-@main.group("analyzer")
+@main.group("analyzer", cls=cli.LazyGroup, lazy_subcommands=analyzer.SUBCOMMANDS)
 @cli.pass_context
 def _analyzer(ctx):
     """
@@ -51,7 +101,9 @@ def _analyzer(ctx):
     pass
 
 
-@main.group("preprocessor")
+@main.group(
+    "preprocessor", cls=cli.LazyGroup, lazy_subcommands=preprocessor.SUBCOMMANDS
+)
 @cli.pass_context
 def _preprocessor(ctx):
     """
@@ -60,11 +112,5 @@ def _preprocessor(ctx):
     pass
 
 
-cli.add_subcommands(main, normalizer)
-cli.add_subcommands(main, tokenizer)
-cli.add_subcommands(_analyzer, analyzer)
-cli.add_subcommands(_preprocessor, preprocessor)
-
-
 if __name__ == "__main__":
     main()
@@ -5,10 +5,9 @@
 # LICENSE file in the root directory of this source tree.
 
 import re
-import sys
 import unicodedata
 
-from nlpack import cli
+from nlpack import cli, utils
 
 SPACE_NORM = re.compile(r"\s+")
 Z2H_TABLE = {
@@ -123,6 +122,9 @@ Z2H_TABLE = {
 }
 
 
+NORMALIZATION_TYPES = ["space", "nfkc", "z2h", "lower", "upper"]
+
+
 class Normalizer:
     @staticmethod
     def space(line: str):
@@ -148,13 +150,13 @@ class Normalizer:
 # fmt: off
 @cli.subcommand("normalizer")
 @cli.option("--type", "-t", "type", multiple=True, default=["space"],
-            choice=["space", "nfkc", "z2h", "lower", "upper"],
+            choice=NORMALIZATION_TYPES,
             help="Normalization type")
 # fmt: on
 def normalizer(type):
     """Text normalizer
 
-    Text is read from standard input.
+    Text is read from standard input, which may be compressed.
 
     If `--type' is given multiple times, the text will be normalized by
     pipeline.
@@ -164,7 +166,7 @@ def normalizer(type):
         type: (List[str]): Normalization types.
     """
     normalizer = [getattr(Normalizer, t) for t in type]
-    for line in sys.stdin:
+    for line in utils.open_file("-"):
         line = line.strip()
         for norm in normalizer:
             line = norm(line)
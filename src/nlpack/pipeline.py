@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from nlpack import cli, profiling, utils
+from nlpack.progress import Progress
+from nlpack.stages import STAGES, Stage
+from nlpack.utils import SentenceBatch
+
+# Stages run in each worker.
+_STAGES: List[Stage] = []
+
+
+def load_spec(path: str) -> Dict[str, Any]:
+    """Loads a pipeline spec from a JSON or YAML file."""
+    with open(path, mode="r") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                cli.abort("Please install PyYAML with: pip install nlpack[yaml]")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def build_stages(stage_specs: Sequence[Dict[str, Any]], suffixes: Sequence[str]) -> List[Stage]:
+    stages = []
+    for i, stage_spec in enumerate(stage_specs):
+        kwargs = dict(stage_spec)
+        name = kwargs.pop("stage", None)
+        if name not in STAGES:
+            cli.abort(
+                "stages[{}]: `stage' must be one of {}.".format(i, ", ".join(STAGES))
+            )
+        try:
+            stages.append(STAGES[name](suffixes, **kwargs))
+        except (TypeError, ValueError) as e:
+            cli.abort("stages[{}] ({}): {}".format(i, name, e))
+    return stages
+
+
+def init_worker(stages: Sequence[Stage]):
+    global _STAGES
+    _STAGES = list(stages)
+    for stage in _STAGES:
+        stage.setup()
+
+
+def run_stages(
+    item: tuple[int, List[List[bytes]]],
+) -> tuple[List[SentenceBatch], List[int]]:
+    """Runs the worker stages on a chunk.
+
+    Args:
+        item (tuple[int, List[List[bytes]]]): The id of the first line tuple
+          and the columns of the chunk.
+
+    Returns:
+        tuple[List[SentenceBatch], List[int]]: The output batches and the
+          number of line tuples after each stage.
+    """
+    begin, columns = item
+    ids = list(range(begin, begin + len(columns[0])))
+    # Invalid UTF-8 bytes are kept as surrogates and written back unchanged.
+    batches = [
+        SentenceBatch(
+            ids,
+            [line.decode("utf-8", errors="surrogateescape").rstrip("\n") for line in lines],
+        )
+        for lines in columns
+    ]
+    num_lines = []
+    for stage in _STAGES:
+        batches = stage(batches)
+        num_lines.append(len(batches[0]))
+    return batches, num_lines
+
+
+def numbered_chunks(chunks):
+    begin = 1
+    for columns in chunks:
+        yield begin, columns
+        begin += len(columns[0])
+
+
+# fmt: off
+@cli.subcommand("pipeline")
+@cli.argument("spec", metavar="SPEC")
+@cli.option("--input-prefix", "-i", type=str, metavar="PREFIX", default=None,
+            help="Input files prefix. It overrides the spec.")
+@cli.option("--output-prefix", "-o", type=str, metavar="PREFIX", default=None,
+            help="Output files prefix. It overrides the spec.")
+@cli.option("--num-workers", type=int, metavar="N", default=None,
+            help="Number of workers. It overrides the spec.")
+@cli.option("--buffer-size", "-b", type=int, metavar="N", default=None,
+            help="The number of lines processed by a worker at once. It overrides the spec.")
+# fmt: on
+def pipeline(
+    spec: str,
+    input_prefix: Optional[str],
+    output_prefix: Optional[str],
+    num_workers: Optional[int],
+    buffer_size: Optional[int],
+):
+    """Run preprocessing stages in a single pass.
+
+    The corpus is read once, processed by the stages in memory, and written
+    once. SPEC is a JSON or YAML (requires PyYAML) file, e.g.:
+
+    \b
+    {
+      "input_prefix": "corpus", "output_prefix": "clean",
+      "suffixes": ["en", "ja"], "num_workers": 8,
+      "stages": [
+        {"stage": "normalize", "type": ["nfkc", "space"]},
+        {"stage": "tokenize", "suffixes": ["en"]},
+        {"stage": "clean", "max_len": 250, "ratio": 9},
+        {"stage": "lid", "langs": ["en", "ja"], "min_prob": 0.5},
+        {"stage": "dedup"}
+      ]
+    }
+
+    Stages are `normalize', `tokenize', `clean', `lid', and `dedup', and
+    take the options of the corresponding commands. `suffixes' of a stage
+    limits the files it processes. The stages before the first stateful
+    stage, i.e., `dedup', run in worker processes, and the rest run in the
+    main process.
+    """
+
+    config = load_spec(spec)
+    input_prefix = input_prefix or config.get("input_prefix")
+    output_prefix = output_prefix or config.get("output_prefix")
+    suffixes = config.get("suffixes", [])
+    if input_prefix is None or output_prefix is None or len(suffixes) == 0:
+        cli.abort("`input_prefix', `output_prefix', and `suffixes' are required.")
+    if num_workers is None:
+        num_workers = config.get("num_workers", 1)
+    if buffer_size is None:
+        buffer_size = config.get("buffer_size", 10000)
+
+    stages = build_stages(config.get("stages", []), suffixes)
+    num_parallel = next(
+        (i for i, stage in enumerate(stages) if stage.stateful), len(stages)
+    )
+    # Loads the resources before forking so that workers share them.
+    for stage in stages:
+        stage.setup()
+
+    input_files = [
+        utils.open_file(input_prefix + "." + suffix, mode="rb") for suffix in suffixes
+    ]
+    output_files = [
+        utils.open_file(output_prefix + "." + suffix, mode="wb") for suffix in suffixes
+    ]
+
+    total_lines = 0
+    remaining = np.zeros(len(stages), dtype=np.int64)
+    progress = Progress("pipeline", input_files)
+    for (_, columns), (batches, num_lines) in utils.imap_ordered(
+        run_stages,
+        numbered_chunks(utils.buffer_aligned_lines(input_files, buffer_size=buffer_size)),
+        num_workers=num_workers,
+        initializer=init_worker,
+        initargs=(stages[:num_parallel],),
+    ):
+        for stage in stages[num_parallel:]:
+            with profiling.timer(stage.name):
+                batches = stage(batches)
+            num_lines.append(len(batches[0]))
+        with profiling.timer("write"):
+            for f, batch in zip(output_files, batches):
+                f.write(
+                    "".join(line + "\n" for line in batch.lines).encode(
+                        "utf-8", errors="surrogateescape"
+                    )
+                )
+        total_lines += len(columns[0])
+        remaining += num_lines
+        progress.update(len(columns[0]), kept=len(batches[0]))
+    progress.close()
+
+    for f in input_files:
+        f.close()
+    for f in output_files:
+        f.close()
+
+    num_output = int(remaining[-1]) if len(stages) > 0 else total_lines
+    cli.echo(
+        "input sentences: {:,}, output sentences: {:,}".format(total_lines, num_output),
+        err=True,
+    )
+    num_before = total_lines
+    for stage, n in zip(stages, remaining.tolist()):
+        cli.echo("  {}: removed {:,}".format(stage.name, num_before - n), err=True)
+        num_before = n
+
+
+if __name__ == "__main__":
+    pipeline()
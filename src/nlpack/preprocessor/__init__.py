@@ -4,8 +4,26 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-from .clean_parallel_corpus import clean_parallel_corpus
-from .clean_mono_corpus import clean_mono_corpus
-from .filter_by_lid import filter_by_lid
-from .sampling_corpus import sampling_corpus
-from .dedup import dedup
+import sys
+
+from nlpack import cli
+
+# Maps command names to `MODULE:FUNCTION`. The modules are imported when
+# the commands are used to keep the CLI startup fast, and the commands are
+# exported as the attributes of the package.
+SUBCOMMANDS = {
+    "parallel-cleaner": "nlpack.preprocessor.clean_parallel_corpus:clean_parallel_corpus",
+    "mono-cleaner": "nlpack.preprocessor.clean_mono_corpus:clean_mono_corpus",
+    "filter-by-lid": "nlpack.preprocessor.filter_by_lid:filter_by_lid",
+    "sampling-corpus": "nlpack.preprocessor.sampling_corpus:sampling_corpus",
+    "shuffle": "nlpack.preprocessor.shuffle:shuffle",
+    "length-bucket": "nlpack.preprocessor.length_bucket:length_bucket",
+    "split-corpus": "nlpack.preprocessor.split_corpus:split_corpus",
+    "dedup": "nlpack.preprocessor.dedup:dedup",
+    "build-index": "nlpack.preprocessor.hash_index:build_index",
+    "merge-index": "nlpack.preprocessor.hash_index:merge_index",
+    "filter-by-index": "nlpack.preprocessor.hash_index:filter_by_index",
+    "near-dedup": "nlpack.preprocessor.near_dedup:near_dedup",
+}
+
+sys.modules[__name__].__class__ = cli.LazyCommandPackage
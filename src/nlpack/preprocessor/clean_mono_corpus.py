@@ -4,8 +4,12 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-from nlpack import cli
-from nlpack.tokenizer import Tokenizer
+from nlpack import cli, profiling, utils
+from nlpack.checkpoint import Checkpoint
+from nlpack.preprocessor.filters import RuleStats, report_rule_stats
+from nlpack.progress import Progress
+from nlpack.sharding import ShardWriter
+from nlpack.stages import CleanStage
 
 
 # fmt: off
@@ -20,6 +24,17 @@ from nlpack.tokenizer import Tokenizer
             help="Minimum sentence length.")
 @cli.option("--max-len", "--max", type=int, metavar="N", default=10000,
             help="Maximum sentence length.")
+@cli.option("--max-token-len", type=int, metavar="N", default=None,
+            help="Maximum number of characters in a token.")
+@cli.option("--max-digit-ratio", type=float, metavar="RATIO", default=None,
+            help="Maximum ratio of digits to non-space characters.")
+@cli.option("--blacklist", multiple=True, metavar="REGEX",
+            help="Remove lines matching the regular expression. It can be specify multiple times.")
+@cli.option_num_workers(default=1)
+@cli.option("--buffer-size", "-b", type=int, default=100000, metavar="N",
+            help="The number of lines processed by a worker at once.")
+@cli.option_checkpoint()
+@cli.option_shards()
 # fmt: on
 def clean_mono_corpus(
     input_prefix,
@@ -27,29 +42,87 @@ def clean_mono_corpus(
     src,
     min_len,
     max_len,
+    max_token_len,
+    max_digit_ratio,
+    blacklist,
+    num_workers,
+    buffer_size,
+    checkpoint,
+    checkpoint_interval,
+    num_shards,
+    shard_by,
+    shard_seed,
 ):
-    """Monolingual corpus cleaner."""
+    """Monolingual corpus cleaner.
 
-    space_tokenizer = Tokenizer("space").tokenize_line
+    All filters are evaluated in a single pass, from the cheapest one.
+
+    With `--checkpoint', an interrupted run resumes from the last checkpoint.
+
+    With `--num-shards', the kept sentences are split into shards by their
+    content hash or in turn.
+    """
+
+    stage = CleanStage(
+        [src],
+        min_len=min_len,
+        max_len=max_len,
+        max_token_len=max_token_len,
+        max_digit_ratio=max_digit_ratio,
+        blacklist=blacklist,
+    )
 
     src_input_path = "{}.{}".format(input_prefix, src)
-    src_output_path = "{}.{}".format(output_prefix, src)
-
-    num_keep, total_lines = 0, 0
-    with open(src_input_path, mode="r") as src_in:
-        with open(src_output_path, mode="w") as src_out:
-            for src_line in src_in:
-                total_lines += 1
-                src_len = len(space_tokenizer(src_line))
-                if src_len > max_len or src_len < min_len:
-                    continue
-                src_out.write(src_line)
-                num_keep += 1
+
+    checkpoint = Checkpoint(
+        checkpoint,
+        dict(
+            min_len=min_len,
+            max_len=max_len,
+            max_token_len=max_token_len,
+            max_digit_ratio=max_digit_ratio,
+            blacklist=blacklist,
+            num_shards=num_shards,
+            shard_by=shard_by,
+            shard_seed=shard_seed,
+        ),
+        interval=checkpoint_interval,
+    )
+    counters = checkpoint.counters
+    num_keep, total_lines = counters.get("num_keep", 0), counters.get("total_lines", 0)
+    rule_stats = RuleStats.from_dict(counters.get("rule_stats", {}))
+    [src_in] = checkpoint.open_inputs([src_input_path])
+    writer = ShardWriter(output_prefix, [src], num_shards, shard_by, shard_seed)
+    writer.open(checkpoint)
+    with src_in:
+        progress = Progress("mono-cleaner", [src_in])
+        for columns, (mask, stats) in utils.imap_ordered(
+            stage.filter,
+            utils.buffer_aligned_lines([src_in], buffer_size=buffer_size),
+            num_workers=num_workers,
+        ):
+            rule_stats.merge(stats)
+            total_lines += len(mask)
+            with profiling.timer("write"):
+                writer.write(columns, mask)
+            num_keep += int(mask.sum())
+            progress.update(len(mask), kept=int(mask.sum()))
+            checkpoint.update(
+                columns,
+                total_lines=total_lines,
+                num_keep=num_keep,
+                rule_stats=rule_stats.to_dict(),
+                shard_lines=writer.num_lines,
+            )
+        progress.close()
+    writer.close()
+    checkpoint.finish()
 
     cli.echo(
         "input sentences: {:,}, output sentences: {:,}".format(total_lines, num_keep),
         err=True,
     )
+    report_rule_stats(stage.rule_set, rule_stats)
 
 
 if __name__ == "__main__":
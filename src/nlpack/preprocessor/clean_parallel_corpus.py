@@ -4,10 +4,12 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-import itertools
-
-from nlpack import cli
-from nlpack.tokenizer import Tokenizer
+from nlpack import cli, profiling, utils
+from nlpack.checkpoint import Checkpoint
+from nlpack.preprocessor.filters import RuleStats, report_rule_stats
+from nlpack.progress import Progress
+from nlpack.sharding import ShardWriter
+from nlpack.stages import CleanStage
 
 
 # fmt: off
@@ -26,8 +28,21 @@ from nlpack.tokenizer import Tokenizer
             help="Maximum sentence length.")
 @cli.option("--ratio", type=float, metavar="RATIO", default=9,
             help="Sentence length ratio.")
+@cli.option("--char-ratio", type=float, metavar="RATIO", default=None,
+            help="Character length ratio.")
+@cli.option("--max-token-len", type=int, metavar="N", default=None,
+            help="Maximum number of characters in a token.")
+@cli.option("--max-digit-ratio", type=float, metavar="RATIO", default=None,
+            help="Maximum ratio of digits to non-space characters.")
+@cli.option("--blacklist", multiple=True, metavar="REGEX",
+            help="Remove lines matching the regular expression. It can be specify multiple times.")
 @cli.option("--label-suffix", "-l", multiple=True, metavar="SUFFIX",
             help="Additional label file extention. It can be specify multiple times.")
+@cli.option_num_workers(default=1)
+@cli.option("--buffer-size", "-b", type=int, default=100000, metavar="N",
+            help="The number of lines processed by a worker at once.")
+@cli.option_checkpoint()
+@cli.option_shards()
 # fmt: on
 def clean_parallel_corpus(
     input_prefix,
@@ -37,64 +52,103 @@ def clean_parallel_corpus(
     min_len,
     max_len,
     ratio,
+    char_ratio,
+    max_token_len,
+    max_digit_ratio,
+    blacklist,
     label_suffix,
+    num_workers,
+    buffer_size,
+    checkpoint,
+    checkpoint_interval,
+    num_shards,
+    shard_by,
+    shard_seed,
 ):
-    """Parallel corpus cleaner."""
+    """Parallel corpus cleaner.
+
+    All filters are evaluated in a single pass, from the cheapest one.
 
-    space_tokenizer = Tokenizer("space").tokenize_line
+    If `--num-workers' is greater than 1, chunks of sentence pairs are
+    filtered in worker processes and the kept lines are written in the input
+    order.
 
-    src_input_path = "{}.{}".format(input_prefix, src)
-    tgt_input_path = "{}.{}".format(input_prefix, tgt)
-    src_output_path = "{}.{}".format(output_prefix, src)
-    tgt_output_path = "{}.{}".format(output_prefix, tgt)
+    With `--checkpoint', an interrupted run resumes from the last checkpoint.
 
-    label_inputs, label_outputs = [], []
-    if len(label_suffix) == 0:
-        label_inputs.append(itertools.cycle([None]))
-        label_outputs.append(itertools.cycle([None]))
-    else:
-        for label in label_suffix:
-            label_inputs.append(open("{}.{}".format(input_prefix, label), mode="r"))
-            label_outputs.append(open("{}.{}".format(output_prefix, label), mode="w"))
+    With `--num-shards', the kept sentence pairs are split into shards by
+    their content hash or in turn.
+    """
+
+    suffixes = [src, tgt, *label_suffix]
+    # The label files are not filtered, but follow the kept sentence pairs.
+    stage = CleanStage(
+        suffixes,
+        min_len=min_len,
+        max_len=max_len,
+        ratio=ratio,
+        char_ratio=char_ratio,
+        max_token_len=max_token_len,
+        max_digit_ratio=max_digit_ratio,
+        blacklist=blacklist,
+        suffixes=[src, tgt],
+    )
+
+    checkpoint = Checkpoint(
+        checkpoint,
+        dict(
+            min_len=min_len,
+            max_len=max_len,
+            ratio=ratio,
+            char_ratio=char_ratio,
+            max_token_len=max_token_len,
+            max_digit_ratio=max_digit_ratio,
+            blacklist=blacklist,
+            num_shards=num_shards,
+            shard_by=shard_by,
+            shard_seed=shard_seed,
+        ),
+        interval=checkpoint_interval,
+    )
+    input_files = checkpoint.open_inputs(
+        ["{}.{}".format(input_prefix, s) for s in suffixes]
+    )
+    writer = ShardWriter(output_prefix, suffixes, num_shards, shard_by, shard_seed)
+    writer.open(checkpoint)
 
-    num_keep, total_lines = 0, 0
-    with open(src_input_path, mode="r") as src_in:
-        with open(tgt_input_path, mode="r") as tgt_in:
-            with open(src_output_path, mode="w") as src_out:
-                with open(tgt_output_path, mode="w") as tgt_out:
-                    for src_line, tgt_line, *label_lines in zip(
-                        src_in, tgt_in, *label_inputs
-                    ):
-                        total_lines += 1
-                        src_len = len(space_tokenizer(src_line))
-                        tgt_len = len(space_tokenizer(tgt_line))
-                        if (
-                            src_len > max_len
-                            or tgt_len > max_len
-                            or src_len < min_len
-                            or tgt_len < min_len
-                            or src_len / tgt_len > ratio
-                            or tgt_len / src_len > ratio
-                        ):
-                            continue
-                        src_out.write(src_line)
-                        tgt_out.write(tgt_line)
-                        if len(label_suffix) > 0:
-                            for label_line, label_out in zip(
-                                label_lines, label_outputs
-                            ):
-                                label_out.write(label_line)
-                        num_keep += 1
+    counters = checkpoint.counters
+    num_keep, total_lines = counters.get("num_keep", 0), counters.get("total_lines", 0)
+    rule_stats = RuleStats.from_dict(counters.get("rule_stats", {}))
+    progress = Progress("parallel-cleaner", input_files)
+    for columns, (mask, stats) in utils.imap_ordered(
+        stage.filter,
+        utils.buffer_aligned_lines(input_files, buffer_size=buffer_size),
+        num_workers=num_workers,
+    ):
+        rule_stats.merge(stats)
+        total_lines += len(mask)
+        with profiling.timer("write"):
+            writer.write(columns, mask)
+        num_keep += int(mask.sum())
+        progress.update(len(mask), kept=int(mask.sum()))
+        checkpoint.update(
+            columns,
+            total_lines=total_lines,
+            num_keep=num_keep,
+            rule_stats=rule_stats.to_dict(),
+            shard_lines=writer.num_lines,
+        )
+    progress.close()
 
-    if len(label_suffix) > 0:
-        for label_in, label_out in zip(label_inputs, label_outputs):
-            label_in.close()
-            label_out.close()
+    for f in input_files:
+        f.close()
+    writer.close()
+    checkpoint.finish()
 
     cli.echo(
         "input sentences: {:,}, output sentences: {:,}".format(total_lines, num_keep),
         err=True,
     )
+    report_rule_stats(stage.rule_set, rule_stats)
 
 
 if __name__ == "__main__":
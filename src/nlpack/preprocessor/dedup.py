@@ -4,31 +4,40 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-from typing import List
+import math
+import os
+import resource
+import tempfile
+from functools import partial
+from typing import List, Optional
 
-from nlpack import cli
+import numpy as np
 
+from nlpack import cli, utils
+from nlpack.hashing import collision_probability, hash_line_tuples
+from nlpack.progress import Progress
+from nlpack.sharding import ShardWriter
+from nlpack.stages import DedupStage
+
+# Partitions are sorted in memory, which roughly takes this many times the
+# size of the records.
+PARTITION_MEMORY_FACTOR = 4
+
+
+def record_dtype(hash_bits: int) -> np.dtype:
+    return np.dtype([("key", np.uint64, (hash_bits // 64,)), ("id", np.uint64)])
 
-# fmt: off
-@cli.subcommand("dedup")
-@cli.option("--input-prefix", "-i", type=str, metavar="PREFIX", required=True,
-            help="Input files prefix.")
-@cli.option("--output-prefix", "-o", type=str, metavar="PREFIX", required=True,
-            help="Output files prefix.")
-@cli.option("--suffixes", "-s", multiple=True, metavar="SUFFIXES", required=True,
-            help="File suffixes.")
-# fmt: on
-def dedup(input_prefix: str, output_prefix: str, suffixes: List[str]):
-    """Deduplicate."""
 
+def dedup_on_memory(input_prefix: str, writer: ShardWriter, suffixes: List[str]):
     lines = []
     for suffix in suffixes:
-        with open(input_prefix + "." + suffix, mode="r") as f_in:
+        with utils.open_file(input_prefix + "." + suffix, mode="r") as f_in:
             lines.append(f_in.readlines())
     union_lines = dict.fromkeys(tuple(zip(*lines))).keys()
-    for suffix, lines_f in zip(suffixes, zip(*union_lines)):
-        with open(output_prefix + "." + suffix, mode="w") as f_out:
-            f_out.writelines(lines_f)
+    if len(union_lines) > 0:
+        writer.write(
+            [[line.encode() for line in lines_f] for lines_f in zip(*union_lines)]
+        )
     cli.echo(
         "input sentences: {:,}, output sentences: {:,}".format(
             len(lines[0]), len(union_lines)
@@ -37,5 +46,284 @@ def dedup(input_prefix: str, output_prefix: str, suffixes: List[str]):
     )
 
 
+def dedup_hash(
+    input_prefix: str,
+    writer: ShardWriter,
+    suffixes: List[str],
+    hash_bits: int,
+    buffer_size: int,
+):
+    input_files = [
+        utils.open_file(input_prefix + "." + suffix, mode="rb") for suffix in suffixes
+    ]
+
+    stage = DedupStage(suffixes, hash_bits=hash_bits)
+    hash_set = stage.hash_set
+    total_lines = 0
+    progress = Progress("dedup", input_files)
+    for columns in utils.buffer_aligned_lines(input_files, buffer_size=buffer_size):
+        is_new = stage.mask(columns)
+        writer.write(columns, is_new)
+        total_lines += len(is_new)
+        progress.update(len(is_new), kept=int(is_new.sum()))
+    progress.close()
+
+    for f in input_files:
+        f.close()
+
+    cli.echo(
+        "input sentences: {:,}, output sentences: {:,}".format(
+            total_lines, len(hash_set)
+        ),
+        err=True,
+    )
+    cli.echo(
+        "hash set: {:,} bytes, collision probability <= {:.3g} ({}-bit hashes)".format(
+            hash_set.nbytes, collision_probability(len(hash_set), hash_bits), hash_bits
+        ),
+        err=True,
+    )
+
+
+def estimate_num_lines(path: str, sample_size: int = 1 << 20) -> int:
+    """Estimates the number of lines from the head of a file."""
+    file_size = os.path.getsize(path)
+    with utils.open_file(path, mode="rb") as f:
+        sample = f.read(sample_size)
+        # Compressed files are measured by the compressed bytes read so far.
+        consumed = (
+            os.lseek(f.fileno(), 0, os.SEEK_CUR)
+            if utils.is_compressed(path)
+            else len(sample)
+        )
+    num_lines = max(sample.count(b"\n"), 1)
+    return math.ceil(file_size / consumed * num_lines) if len(sample) > 0 else 0
+
+
+def dedup_partition(
+    path: str, hash_bits: int, flags_path: str, num_lines: int
+) -> int:
+    """Marks the first occurrence of each hash value in a partition.
+
+    Records in a partition are in the line id order, so the first occurrence
+    of a hash value has the smallest line id.
+    """
+    records = np.fromfile(path, dtype=record_dtype(hash_bits))
+    os.remove(path)
+    if len(records) == 0:
+        return 0
+    keys = np.ascontiguousarray(records["key"])
+    _, first = np.unique(
+        keys.view(np.dtype((np.void, keys.itemsize * keys.shape[1]))).ravel(),
+        return_index=True,
+    )
+    # Partitions mark disjoint line ids, so workers never write the same byte.
+    flags = np.memmap(flags_path, dtype=np.uint8, mode="r+", shape=(num_lines,))
+    flags[records["id"][first]] = 1
+    flags.flush()
+    return len(first)
+
+
+def dedup_external(
+    input_prefix: str,
+    writer: ShardWriter,
+    suffixes: List[str],
+    hash_bits: int,
+    buffer_size: int,
+    num_workers: int,
+    memory_budget: int,
+    tmp_space_budget: Optional[int],
+    tmp_dir: Optional[str],
+):
+    dtype = record_dtype(hash_bits)
+    input_paths = [input_prefix + "." + suffix for suffix in suffixes]
+    estimated_lines = estimate_num_lines(input_paths[0])
+    estimated_space = estimated_lines * (dtype.itemsize + 1)
+    if tmp_space_budget is not None and estimated_space > tmp_space_budget:
+        cli.abort(
+            "The estimated temporary space {:,} bytes exceeds the budget.".format(
+                estimated_space
+            )
+        )
+    worker_memory = memory_budget // max(num_workers, 1)
+    num_partitions = max(
+        num_workers,
+        math.ceil(
+            estimated_lines * dtype.itemsize * PARTITION_MEMORY_FACTOR / worker_memory
+        ),
+    )
+
+    with tempfile.TemporaryDirectory(prefix="nlpack-dedup-", dir=tmp_dir) as work_dir:
+        partition_paths = [
+            os.path.join(work_dir, "part{}.bin".format(k)) for k in range(num_partitions)
+        ]
+
+        # 1. Scatters (hash, line id) records into the partitions. If the
+        # partitions exceed the limit of open files, the input is read once
+        # per group of partitions.
+        max_files = max(
+            1, resource.getrlimit(resource.RLIMIT_NOFILE)[0] - 2 * len(suffixes) - 16
+        )
+        num_passes = math.ceil(num_partitions / max_files)
+        for p, lo in enumerate(range(0, num_partitions, max_files)):
+            hi = min(lo + max_files, num_partitions)
+            input_files = [utils.open_file(path, mode="rb") for path in input_paths]
+            partition_files = [open(path, mode="wb") for path in partition_paths[lo:hi]]
+            num_lines = 0
+            progress = Progress(
+                "dedup (1/3 hashing{})".format(
+                    ", pass {}/{}".format(p + 1, num_passes) if num_passes > 1 else ""
+                ),
+                input_files,
+            )
+            for columns in utils.buffer_aligned_lines(
+                input_files, buffer_size=buffer_size
+            ):
+                progress.update(len(columns[0]))
+                records = np.empty(len(columns[0]), dtype=dtype)
+                records["key"] = hash_line_tuples(columns, bits=hash_bits)
+                records["id"] = np.arange(num_lines, num_lines + len(records))
+                num_lines += len(records)
+                if (
+                    tmp_space_budget is not None
+                    and num_lines * (dtype.itemsize + 1) > tmp_space_budget
+                ):
+                    cli.abort("The temporary space exceeds the budget.")
+
+                partitions = records["key"][:, 0] % np.uint64(num_partitions)
+                order = np.argsort(partitions, kind="stable")
+                bounds = np.searchsorted(partitions[order], np.arange(lo, hi + 1))
+                records = records[order]
+                for k, f_part in enumerate(partition_files):
+                    records[bounds[k] : bounds[k + 1]].tofile(f_part)
+            progress.close()
+            for f in input_files:
+                f.close()
+            for f_part in partition_files:
+                f_part.close()
+
+        # 2. Deduplicates each partition independently.
+        flags_path = os.path.join(work_dir, "flags.bin")
+        if num_lines > 0:
+            np.memmap(flags_path, dtype=np.uint8, mode="w+", shape=(num_lines,)).flush()
+        num_keep = 0
+        for _, n in utils.imap_ordered(
+            partial(
+                dedup_partition,
+                hash_bits=hash_bits,
+                flags_path=flags_path,
+                num_lines=num_lines,
+            ),
+            partition_paths,
+            num_workers=num_workers,
+        ):
+            num_keep += n
+
+        # 3. Restores the original order by line id.
+        input_files = [utils.open_file(path, mode="rb") for path in input_paths]
+        if num_lines > 0:
+            flags = np.memmap(flags_path, dtype=np.uint8, mode="r", shape=(num_lines,))
+            offset = 0
+            progress = Progress("dedup (3/3 writing)", input_files)
+            for columns in utils.buffer_aligned_lines(
+                input_files, buffer_size=buffer_size
+            ):
+                keep = flags[offset : offset + len(columns[0])].tolist()
+                offset += len(keep)
+                writer.write(columns, keep)
+                progress.update(len(keep), kept=sum(keep))
+            progress.close()
+            del flags
+        for f in input_files:
+            f.close()
+
+    cli.echo(
+        "input sentences: {:,}, output sentences: {:,}".format(num_lines, num_keep),
+        err=True,
+    )
+    cli.echo(
+        "partitions: {:,}, collision probability <= {:.3g} ({}-bit hashes)".format(
+            num_partitions, collision_probability(num_keep, hash_bits), hash_bits
+        ),
+        err=True,
+    )
+
+
+# fmt: off
+@cli.subcommand("dedup")
+@cli.option("--input-prefix", "-i", type=str, metavar="PREFIX", required=True,
+            help="Input files prefix.")
+@cli.option("--output-prefix", "-o", type=str, metavar="PREFIX", required=True,
+            help="Output files prefix.")
+@cli.option("--suffixes", "-s", multiple=True, metavar="SUFFIXES", required=True,
+            help="File suffixes.")
+@cli.option("--mode", "-m", choice=["memory", "hash", "external"], metavar="MODE", default="memory",
+            help="`memory` keeps all lines on memory. "
+            "`hash` streams the corpus and keeps only the hash of each unique line tuple. "
+            "`external` deduplicates on-disk hash partitions in parallel.")
+@cli.option("--hash-bits", choice=["64", "128"], metavar="BITS", default="64",
+            help="Hash size of the `hash` and `external` modes.")
+@cli.option("--buffer-size", "-b", type=int, default=100000, metavar="N",
+            help="The number of lines hashed at once.")
+@cli.option_num_workers(default=1)
+@cli.option("--memory-budget", type=cli.SIZE, metavar="SIZE", default="4G",
+            help="Memory budget of the `external` mode, e.g., 512M or 4G.")
+@cli.option("--tmp-space-budget", type=cli.SIZE, metavar="SIZE", default=None,
+            help="Temporary disk space budget of the `external` mode.")
+@cli.option("--tmp-dir", type=str, metavar="DIR", default=None,
+            help="Temporary directory of the `external` mode.")
+@cli.option_shards()
+# fmt: on
+def dedup(
+    input_prefix: str,
+    output_prefix: str,
+    suffixes: List[str],
+    mode: str,
+    hash_bits: str,
+    buffer_size: int,
+    num_workers: int,
+    memory_budget: int,
+    tmp_space_budget: Optional[int],
+    tmp_dir: Optional[str],
+    num_shards: int,
+    shard_by: str,
+    shard_seed: int,
+):
+    """Deduplicate.
+
+    The first occurrence of each line tuple is kept in the input order.
+    In the `hash` and `external` modes, distinct tuples are merged only if
+    their hash values collide; the upper bound of the collision probability
+    is reported.
+
+    The `external` mode scatters (hash, line id) records into on-disk
+    partitions under `--tmp-dir', deduplicates the partitions in
+    `--num-workers' processes, and then writes the kept lines by line id.
+
+    With `--num-shards', the kept line tuples are split into shards by their
+    content hash or in turn.
+    """
+
+    writer = ShardWriter(output_prefix, suffixes, num_shards, shard_by, shard_seed)
+    writer.open()
+    if mode == "memory":
+        dedup_on_memory(input_prefix, writer, suffixes)
+    elif mode == "hash":
+        dedup_hash(input_prefix, writer, suffixes, int(hash_bits), buffer_size)
+    elif mode == "external":
+        dedup_external(
+            input_prefix,
+            writer,
+            suffixes,
+            int(hash_bits),
+            buffer_size,
+            num_workers,
+            memory_budget,
+            tmp_space_budget,
+            tmp_dir,
+        )
+    writer.close()
+
+
 if __name__ == "__main__":
     dedup()
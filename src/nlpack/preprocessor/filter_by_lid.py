@@ -4,18 +4,253 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import itertools
+import json
 import os
 import urllib.request
-from typing import List
+from functools import partial
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Sequence
 
+import numpy as np
 from fasttext import load_model
 
-from nlpack import cli
+from nlpack import cli, profiling, utils
+from nlpack.checkpoint import Checkpoint
 from nlpack.locations import cache_dir
+from nlpack.progress import Progress
+from nlpack.sharding import ShardWriter
+from nlpack.stages import LidStage
 
 LID_URL = "https://dl.fbaipublicfiles.com/fasttext/supervised-models/lid.176.bin"
 LID_FILENAME = "lid.176.bin"
 
+# The model is loaded once per process. Workers forked after the parent has
+# loaded it share the model memory copy-on-write.
+_LID_MODEL: Any = None
+_LABEL_IDS: Dict[str, int] = {}
+
+
+def get_lid_model_path() -> str:
+    """Returns the path of the LID model, downloading it if necessary."""
+    fasttext_cache_dir = cache_dir("fasttext")
+    lid_model_path = os.path.join(fasttext_cache_dir, LID_FILENAME)
+    if not os.path.exists(lid_model_path):
+        os.makedirs(fasttext_cache_dir, exist_ok=True)
+        cli.echo(
+            "Download the language identification model from {} to {}".format(
+                LID_URL, lid_model_path
+            ),
+            err=True,
+        )
+        urllib.request.urlretrieve(LID_URL, lid_model_path)
+        cli.echo("Done", err=True)
+    assert os.path.exists(lid_model_path)
+    return lid_model_path
+
+
+def init_lid_model(lid_model_path: str):
+    global _LID_MODEL, _LABEL_IDS
+    if _LID_MODEL is None:
+        _LID_MODEL = load_model(lid_model_path)
+        _LABEL_IDS = {label: i for i, label in enumerate(_LID_MODEL.get_labels())}
+
+
+def predict_languages(
+    lines: Sequence[str], k: int = 1
+) -> List[List[tuple[str, float]]]:
+    """Returns the top-k languages and probabilities of each line by the model
+    loaded by `init_lid_model()`."""
+    if _LID_MODEL is None:
+        raise RuntimeError("The LID model is not loaded.")
+    labels, probs = _LID_MODEL.predict([line.rstrip("\n") for line in lines], k=k)
+    return [
+        [(label[len("__label__") :], float(p)) for label, p in zip(ls, ps)]
+        for ls, ps in zip(labels, probs)
+    ]
+
+
+def decode_lines(lines: Sequence[bytes]) -> List[str]:
+    return [line.decode("utf-8", errors="replace").rstrip() for line in lines]
+
+
+def lid_mask(
+    columns: Sequence[List[bytes]],
+    lang_labels: Sequence[Optional[str]],
+    min_prob: float = 0.0,
+) -> np.ndarray:
+    """Returns `True` for line tuples whose every line is identified as the
+    expected language.
+
+    Lines are predicted in a batch per column, and only the tuples that have
+    passed the previous columns are predicted. The probabilities are rounded
+    to float16 like the saved predictions, so filtering with `--from-predictions'
+    keeps the same lines.
+    """
+    alive = np.arange(len(columns[0]))
+    for lines, lang_label in zip(columns, lang_labels):
+        if lang_label is None or len(alive) == 0:
+            continue
+        labels, probs = _LID_MODEL.predict(decode_lines([lines[i] for i in alive]))
+        top_labels = np.array([label[0] for label in labels])
+        top_probs = np.array([prob[0] for prob in probs], dtype=np.float16)
+        alive = alive[(top_labels == lang_label) & (top_probs >= np.float16(min_prob))]
+
+    mask = np.zeros(len(columns[0]), dtype=bool)
+    mask[alive] = True
+    return mask
+
+
+def predict_top_k(
+    columns: Sequence[List[bytes]], top_k: int
+) -> List[tuple[np.ndarray, np.ndarray]]:
+    """Predicts the top-k labels of every line.
+
+    Returns:
+        List[tuple[np.ndarray, np.ndarray]]: Label ids and float16
+          probabilities of shape `(num_lines, top_k)` for each column.
+    """
+    predictions = []
+    for lines in columns:
+        label_ids = np.zeros((len(lines), top_k), dtype=np.uint16)
+        probs = np.zeros((len(lines), top_k), dtype=np.float16)
+        labels_k, probs_k = _LID_MODEL.predict(decode_lines(lines), k=top_k)
+        for i, (labels, ps) in enumerate(zip(labels_k, probs_k)):
+            label_ids[i, : len(labels)] = [_LABEL_IDS[label] for label in labels]
+            probs[i, : len(ps)] = ps
+        predictions.append((label_ids, probs))
+    return predictions
+
+
+def predictions_mask(
+    predictions: Sequence[tuple[np.ndarray, np.ndarray]],
+    lang_ids: Sequence[Optional[int]],
+    min_prob: float = 0.0,
+) -> np.ndarray:
+    """Computes the keep-mask from top-k predictions without the model."""
+    mask = np.ones(len(predictions[0][0]), dtype=bool)
+    for (label_ids, probs), lang_id in zip(predictions, lang_ids):
+        if lang_id is None:
+            continue
+        mask &= (label_ids[:, 0] == lang_id) & (probs[:, 0] >= np.float16(min_prob))
+    return mask
+
+
+def sidecar_path(sidecar_dir: str, suffix: str, name: str) -> str:
+    return os.path.join(sidecar_dir, "{}.{}".format(suffix, name))
+
+
+class PredictionWriter:
+    """Writes top-k LID predictions to a sidecar directory.
+
+    The directory contains `SUFFIX.labels` (uint16 label ids) and
+    `SUFFIX.probs` (float16 probabilities) of shape `(num_lines, top_k)` for
+    each suffix, and `meta.json`.
+
+    Args:
+        sidecar_dir (str): Sidecar directory.
+        suffixes (Sequence[str]): File suffixes.
+        labels (List[str]): Labels of the model indexed by the label ids.
+        top_k (int): The number of labels per line.
+    """
+
+    def __init__(
+        self, sidecar_dir: str, suffixes: Sequence[str], labels: List[str], top_k: int
+    ):
+        os.makedirs(sidecar_dir, exist_ok=True)
+        self.sidecar_dir = sidecar_dir
+        self.meta: Dict[str, Any] = {
+            "suffixes": list(suffixes),
+            "num_lines": 0,
+            "top_k": top_k,
+            "labels": labels,
+        }
+        self.files = [
+            (
+                open(sidecar_path(sidecar_dir, suffix, "labels"), mode="wb"),
+                open(sidecar_path(sidecar_dir, suffix, "probs"), mode="wb"),
+            )
+            for suffix in suffixes
+        ]
+
+    def write(self, predictions: List[tuple[np.ndarray, np.ndarray]]):
+        for (label_f, prob_f), (label_ids, probs) in zip(self.files, predictions):
+            label_ids.tofile(label_f)
+            probs.tofile(prob_f)
+        self.meta["num_lines"] += len(predictions[0][0])
+
+    def close(self):
+        for label_f, prob_f in self.files:
+            label_f.close()
+            prob_f.close()
+        with open(os.path.join(self.sidecar_dir, "meta.json"), mode="w") as f:
+            json.dump(self.meta, f, indent=2)
+
+
+def read_predictions(
+    sidecar_dir: str, suffixes: Sequence[str], buffer_size: int
+) -> tuple[dict, Generator[List[tuple[np.ndarray, np.ndarray]], None, None]]:
+    """Reads chunks of the predictions saved by `PredictionWriter`.
+
+    Returns:
+        tuple[dict, Generator]: The metadata and the chunks of predictions.
+    """
+    with open(os.path.join(sidecar_dir, "meta.json"), mode="r") as f:
+        meta = json.load(f)
+    for suffix in suffixes:
+        if suffix not in meta["suffixes"]:
+            cli.abort("No predictions of `{}' in {}".format(suffix, sidecar_dir))
+
+    shape = (meta["num_lines"], meta["top_k"])
+
+    def load(suffix: str, name: str, dtype) -> np.ndarray:
+        # An empty file cannot be memory-mapped.
+        if meta["num_lines"] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(
+            sidecar_path(sidecar_dir, suffix, name), dtype=dtype, mode="r", shape=shape
+        )
+
+    arrays = [
+        (load(s, "labels", np.uint16), load(s, "probs", np.float16)) for s in suffixes
+    ]
+
+    def chunks():
+        for begin in range(0, meta["num_lines"], buffer_size):
+            end = begin + buffer_size
+            yield [(label_ids[begin:end], probs[begin:end]) for label_ids, probs in arrays]
+
+    return meta, chunks()
+
+
+def zip_predictions(chunks: Iterable, predictions: Iterable, num_lines: int):
+    """Pairs the chunks of the input with the chunks of the predictions.
+
+    It aborts before yielding a chunk whose number of lines differs from the
+    predictions, so no output is written for mismatched lines.
+    """
+    for columns, result in itertools.zip_longest(chunks, predictions):
+        if columns is None or result is None or len(columns[0]) != len(result[0][0]):
+            cli.abort(
+                "The input is {} than the predictions of {:,} lines.".format(
+                    "longer"
+                    if columns is not None
+                    and (result is None or len(columns[0]) > len(result[0][0]))
+                    else "shorter",
+                    num_lines,
+                )
+            )
+        yield columns, result
+
+
+def lang_label_ids(
+    lang_labels: Sequence[Optional[str]], labels: List[str]
+) -> List[Optional[int]]:
+    label_ids = {label: i for i, label in enumerate(labels)}
+    for label in lang_labels:
+        if label is not None and label not in label_ids:
+            cli.abort("Unknown language: {}".format(label))
+    return [label_ids[label] if label is not None else None for label in lang_labels]
+
 
 # fmt: off
 @cli.subcommand("filter-by-lid")
@@ -27,56 +262,141 @@ LID_FILENAME = "lid.176.bin"
             help="File suffixes.")
 @cli.option("--langs", "-l", multiple=True, metavar="LANGS", required=True,
             help="Languages specified by ISO 639-1. The ignored part is specified by `__`.")
+@cli.option("--min-prob", type=float, metavar="PROB", default=0.0,
+            help="Minimum probability of the identified language.")
+@cli.option("--save-predictions", type=str, metavar="DIR", default=None,
+            help="Save the top-k predictions of all lines to DIR.")
+@cli.option("--top-k", type=int, metavar="K", default=3,
+            help="The number of labels saved by `--save-predictions'.")
+@cli.option("--from-predictions", type=str, metavar="DIR", default=None,
+            help="Filter by the predictions saved in DIR without the model.")
+@cli.option_num_workers(default=1)
+@cli.option("--buffer-size", "-b", type=int, default=10000, metavar="N",
+            help="The number of lines predicted at once.")
+@cli.option_checkpoint()
+@cli.option_shards()
 # fmt: on
 def filter_by_lid(
     input_prefix: str,
     output_prefix: str,
     suffixes: List[str],
     langs: List[str],
+    min_prob: float,
+    save_predictions: Optional[str],
+    top_k: int,
+    from_predictions: Optional[str],
+    num_workers: int,
+    buffer_size: int,
+    checkpoint: Optional[str],
+    checkpoint_interval: float,
+    num_shards: int,
+    shard_by: str,
+    shard_seed: int,
 ):
     """
     Filters by language identificaion.
+
+    Lines are identified in batches. If `--num-workers' is greater than 1,
+    the batches are identified in worker processes sharing the model, and the
+    kept lines are written in the input order.
+
+    With `--save-predictions', the top-k labels and probabilities of every
+    line are saved, so later runs with other `--langs' or `--min-prob' can
+    filter with `--from-predictions' without running the model. The
+    probabilities are compared with `--min-prob' in float16 in both cases,
+    so the same lines are kept.
+
+    With `--checkpoint', an interrupted run resumes from the last checkpoint.
+    It cannot be combined with `--save-predictions' or `--from-predictions'.
+
+    With `--num-shards', the kept line tuples are split into shards by their
+    content hash or in turn.
     """
-    assert len(langs) == len(suffixes)
+    assert save_predictions is None or from_predictions is None
+    if checkpoint is not None and (
+        save_predictions is not None or from_predictions is not None
+    ):
+        cli.abort(
+            "`--checkpoint' cannot be used with `--save-predictions' or "
+            "`--from-predictions'."
+        )
 
-    fasttext_cache_dir = cache_dir("fasttext")
-    lid_model_path = os.path.join(fasttext_cache_dir, LID_FILENAME)
-    if not os.path.exists(lid_model_path):
-        os.makedirs(fasttext_cache_dir, exist_ok=True)
-        cli.echo(
-            "Download the language identification model from {} to {}".format(
-                LID_URL, lid_model_path
-            ),
-            err=True,
+    ckpt = Checkpoint(
+        checkpoint,
+        dict(
+            langs=langs,
+            min_prob=min_prob,
+            num_shards=num_shards,
+            shard_by=shard_by,
+            shard_seed=shard_seed,
+        ),
+        interval=checkpoint_interval,
+    )
+    input_files = ckpt.open_inputs(
+        [input_prefix + "." + suffix for suffix in suffixes]
+    )
+    output_writer = ShardWriter(
+        output_prefix, suffixes, num_shards, shard_by, shard_seed
+    )
+    output_writer.open(ckpt)
+
+    try:
+        stage = LidStage(suffixes, langs, min_prob=min_prob)
+    except ValueError as e:
+        cli.abort(str(e))
+    lang_labels = stage.lang_labels
+    chunks = utils.buffer_aligned_lines(input_files, buffer_size=buffer_size)
+
+    writer = None
+    worker_func: Callable
+    if from_predictions is not None:
+        meta, predictions = read_predictions(from_predictions, suffixes, buffer_size)
+        lang_ids = lang_label_ids(lang_labels, meta["labels"])
+        results = zip_predictions(chunks, predictions, meta["num_lines"])
+    else:
+        stage.setup()
+        if save_predictions is not None:
+            lang_ids = lang_label_ids(lang_labels, _LID_MODEL.get_labels())
+            writer = PredictionWriter(
+                save_predictions, suffixes, _LID_MODEL.get_labels(), top_k
+            )
+            worker_func = partial(predict_top_k, top_k=top_k)
+        else:
+            worker_func = stage.mask
+        results = utils.imap_ordered(
+            worker_func, chunks, num_workers=num_workers, initializer=stage.setup
         )
-        urllib.request.urlretrieve(LID_URL, lid_model_path)
-        cli.echo("Done", err=True)
-    assert os.path.exists(lid_model_path)
-    lid_model = load_model(lid_model_path)
-
-    input_files = [open(input_prefix + "." + suffix, mode="r") for suffix in suffixes]
-    output_files = [open(output_prefix + "." + suffix, mode="w") for suffix in suffixes]
-
-    lang_labels = ["__label__" + lang if lang != "__" else None for lang in langs]
-
-    num_keep, total_lines = 0, 0
-    for each_line in zip(*input_files):
-        total_lines += 1
-        if all(
-            [
-                lid_model.predict(line.rstrip())[0][0] == lang_label
-                for line, lang_label in zip(each_line, lang_labels)
-                if lang_label is not None
-            ]
-        ):
-            for f, line in zip(output_files, each_line):
-                f.write(line)
-            num_keep += 1
+
+    num_keep = ckpt.counters.get("num_keep", 0)
+    total_lines = ckpt.counters.get("total_lines", 0)
+    progress = Progress("filter-by-lid", input_files)
+    for columns, result in results:
+        if save_predictions is None and from_predictions is None:
+            mask = result
+        else:
+            if writer is not None:
+                with profiling.timer("write predictions"):
+                    writer.write(result)
+            mask = predictions_mask(result, lang_ids, min_prob)
+        with profiling.timer("write"):
+            output_writer.write(columns, mask)
+        total_lines += len(mask)
+        num_keep += int(mask.sum())
+        progress.update(len(mask), kept=int(mask.sum()))
+        ckpt.update(
+            columns,
+            total_lines=total_lines,
+            num_keep=num_keep,
+            shard_lines=output_writer.num_lines,
+        )
+    progress.close()
 
     for f in input_files:
         f.close()
-    for f in output_files:
-        f.close()
+    output_writer.close()
+    if writer is not None:
+        writer.close()
+    ckpt.finish()
 
     cli.echo(
         "input sentences: {:,}, output sentences: {:,}".format(total_lines, num_keep),
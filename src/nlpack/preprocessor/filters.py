@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import re
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from nlpack import cli
+from nlpack.tokenizer import count_space_tokens
+
+
+class LineFeatures:
+    """Per-chunk cache of the features shared by several rules.
+
+    Args:
+        columns (Sequence[List[bytes]]): Columns of UTF-8 encoded lines to be
+          filtered.
+    """
+
+    def __init__(self, columns: Sequence[List[bytes]]):
+        self.columns = columns
+        self._lengths: Dict[int, np.ndarray] = {}
+        self._texts: Dict[int, List[str]] = {}
+
+    def lengths(self, column: int) -> np.ndarray:
+        """Returns the number of space-delimited tokens of each line."""
+        if column not in self._lengths:
+            self._lengths[column] = count_space_tokens(self.columns[column])
+        return self._lengths[column]
+
+    def texts(self, column: int) -> List[str]:
+        """Returns the decoded lines."""
+        if column not in self._texts:
+            self._texts[column] = [
+                line.decode("utf-8", errors="replace") for line in self.columns[column]
+            ]
+        return self._texts[column]
+
+
+class FilterRule:
+    """Base class of filtering rules.
+
+    Rules with smaller `cost` are evaluated first, and the later rules are not
+    evaluated for lines that are already rejected.
+    """
+
+    name: str = ""
+    cost: int = 0
+
+    def keep(self, features: LineFeatures, index: int) -> bool:
+        """Returns `True` if the `index`-th line tuple passes this rule."""
+        raise NotImplementedError
+
+    def filter(self, features: LineFeatures, alive: np.ndarray) -> np.ndarray:
+        """Returns the indices in `alive` that pass this rule."""
+        mask = np.fromiter(
+            (self.keep(features, i) for i in alive.tolist()),
+            dtype=bool,
+            count=len(alive),
+        )
+        return alive[mask]
+
+
+class LengthRule(FilterRule):
+    name = "length"
+    cost = 1
+
+    def __init__(self, min_len: int, max_len: int, num_columns: int):
+        self.min_len = min_len
+        self.max_len = max_len
+        self.num_columns = num_columns
+
+    def filter(self, features: LineFeatures, alive: np.ndarray) -> np.ndarray:
+        for c in range(self.num_columns):
+            lengths = features.lengths(c)[alive]
+            alive = alive[(lengths >= self.min_len) & (lengths <= self.max_len)]
+        return alive
+
+
+class RatioRule(FilterRule):
+    name = "ratio"
+    cost = 1
+
+    def __init__(self, ratio: float):
+        self.ratio = ratio
+
+    def filter(self, features: LineFeatures, alive: np.ndarray) -> np.ndarray:
+        src_len = features.lengths(0)[alive]
+        tgt_len = features.lengths(1)[alive]
+        return alive[
+            np.maximum(src_len, tgt_len) <= self.ratio * np.minimum(src_len, tgt_len)
+        ]
+
+
+class CharRatioRule(FilterRule):
+    name = "char-ratio"
+    cost = 2
+
+    def __init__(self, ratio: float):
+        self.ratio = ratio
+
+    def keep(self, features: LineFeatures, index: int) -> bool:
+        src_len = len(features.texts(0)[index].strip())
+        tgt_len = len(features.texts(1)[index].strip())
+        return max(src_len, tgt_len) <= self.ratio * min(src_len, tgt_len)
+
+
+class MaxTokenLengthRule(FilterRule):
+    name = "max-token-len"
+    cost = 2
+
+    def __init__(self, max_token_len: int, num_columns: int):
+        self.max_token_len = max_token_len
+        self.num_columns = num_columns
+
+    def keep(self, features: LineFeatures, index: int) -> bool:
+        for c in range(self.num_columns):
+            tokens = features.texts(c)[index].split()
+            if len(tokens) > 0 and max(map(len, tokens)) > self.max_token_len:
+                return False
+        return True
+
+
+class DigitRatioRule(FilterRule):
+    name = "digit-ratio"
+    cost = 3
+
+    def __init__(self, max_ratio: float, num_columns: int):
+        self.max_ratio = max_ratio
+        self.num_columns = num_columns
+
+    def keep(self, features: LineFeatures, index: int) -> bool:
+        for c in range(self.num_columns):
+            chars = "".join(features.texts(c)[index].split())
+            if len(chars) == 0:
+                continue
+            num_digits = sum(1 for char in chars if char.isdigit())
+            if num_digits > self.max_ratio * len(chars):
+                return False
+        return True
+
+
+class RegexBlacklistRule(FilterRule):
+    name = "blacklist"
+    cost = 4
+
+    def __init__(self, patterns: Sequence[str], num_columns: int):
+        self.pattern = re.compile("|".join("(?:{})".format(p) for p in patterns))
+        self.num_columns = num_columns
+
+    def keep(self, features: LineFeatures, index: int) -> bool:
+        for c in range(self.num_columns):
+            if self.pattern.search(features.texts(c)[index]) is not None:
+                return False
+        return True
+
+
+@dataclass
+class RuleStats:
+    rejected: Counter = field(default_factory=Counter)
+    elapsed: defaultdict = field(default_factory=lambda: defaultdict(float))
+
+    def merge(self, stats: "RuleStats"):
+        self.rejected += stats.rejected
+        for name, sec in stats.elapsed.items():
+            self.elapsed[name] += sec
+
+    def to_dict(self) -> dict:
+        return {"rejected": dict(self.rejected), "elapsed": dict(self.elapsed)}
+
+    @classmethod
+    def from_dict(cls, stats: dict) -> "RuleStats":
+        return cls(
+            Counter(stats.get("rejected", {})),
+            defaultdict(float, stats.get("elapsed", {})),
+        )
+
+
+class RuleSet:
+    """Filtering rules evaluated in a single pass.
+
+    The rules are sorted by their costs, and each line tuple is
+    short-circuited at the first rule that rejects it.
+
+    Args:
+        rules (Sequence[FilterRule]): Filtering rules.
+    """
+
+    def __init__(self, rules: Sequence[FilterRule]):
+        self.rules = sorted(rules, key=lambda rule: rule.cost)
+
+    def __call__(
+        self, columns: Sequence[List[bytes]]
+    ) -> tuple[np.ndarray, RuleStats]:
+        """Filters a chunk of line tuples.
+
+        Args:
+            columns (Sequence[List[bytes]]): Columns of UTF-8 encoded lines.
+
+        Returns:
+            tuple[np.ndarray, RuleStats]: The keep-mask and the rule statistics.
+        """
+        features = LineFeatures(columns)
+        stats = RuleStats()
+        alive = np.arange(len(columns[0]))
+        for rule in self.rules:
+            if len(alive) == 0:
+                break
+            start = time.perf_counter()
+            kept = rule.filter(features, alive)
+            stats.elapsed[rule.name] += time.perf_counter() - start
+            stats.rejected[rule.name] += len(alive) - len(kept)
+            alive = kept
+
+        mask = np.zeros(len(columns[0]), dtype=bool)
+        mask[alive] = True
+        return mask, stats
+
+
+def build_rules(
+    num_columns: int,
+    min_len: int,
+    max_len: int,
+    ratio: Optional[float] = None,
+    char_ratio: Optional[float] = None,
+    max_token_len: Optional[int] = None,
+    max_digit_ratio: Optional[float] = None,
+    blacklist: Sequence[str] = (),
+) -> RuleSet:
+    """Builds a rule set from the command line options of the cleaners.
+
+    Args:
+        num_columns (int): The number of text columns, i.e., 1 for
+          monolingual and 2 for parallel corpora.
+        min_len (int): Minimum sentence length.
+        max_len (int): Maximum sentence length.
+        ratio (float, optional): Maximum sentence length ratio.
+        char_ratio (float, optional): Maximum character length ratio.
+        max_token_len (int, optional): Maximum number of characters in a token.
+        max_digit_ratio (float, optional): Maximum ratio of digits.
+        blacklist (Sequence[str]): Regular expressions that reject lines.
+
+    Returns:
+        RuleSet: The compiled rules.
+    """
+    rules: List[FilterRule] = [LengthRule(min_len, max_len, num_columns)]
+    if ratio is not None:
+        assert num_columns == 2
+        rules.append(RatioRule(ratio))
+    if char_ratio is not None:
+        assert num_columns == 2
+        rules.append(CharRatioRule(char_ratio))
+    if max_token_len is not None:
+        rules.append(MaxTokenLengthRule(max_token_len, num_columns))
+    if max_digit_ratio is not None:
+        rules.append(DigitRatioRule(max_digit_ratio, num_columns))
+    if len(blacklist) > 0:
+        rules.append(RegexBlacklistRule(blacklist, num_columns))
+    return RuleSet(rules)
+
+
+def report_rule_stats(rule_set: RuleSet, stats: RuleStats):
+    for rule in rule_set.rules:
+        cli.echo(
+            "  {}: rejected {:,} ({:.2f} s)".format(
+                rule.name, stats.rejected[rule.name], stats.elapsed[rule.name]
+            ),
+            err=True,
+        )
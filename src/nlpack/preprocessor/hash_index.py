@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+import os
+from functools import partial
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from nlpack import cli, utils
+from nlpack.hashing import hash_line_tuples
+from nlpack.normalizer import Normalizer
+
+# Indexes loaded in each worker.
+_INDEXES: List[np.ndarray] = []
+
+
+def line_keys(lines: Sequence[bytes], normalize: bool = False) -> np.ndarray:
+    """Computes the index keys of lines.
+
+    Surrounding spaces are always ignored. If `normalize` is true, lines are
+    also lowercased and consecutive spaces are collapsed.
+    """
+    if normalize:
+        lines = [
+            Normalizer.space(line.decode("utf-8", errors="replace").strip())
+            .lower()
+            .encode("utf-8")
+            for line in lines
+        ]
+    else:
+        lines = [line.strip() for line in lines]
+    return hash_line_tuples([lines], bits=64)[:, 0]
+
+
+def meta_path(index_path: str) -> str:
+    return index_path + ".json"
+
+
+def save_index(index_path: str, keys: np.ndarray, normalize: bool, sources: List[str]):
+    """Saves sorted unique keys as a `.npy` file and its metadata as JSON."""
+    with open(index_path, mode="wb") as f:
+        np.save(f, keys)
+    with open(meta_path(index_path), mode="w") as f:
+        json.dump(
+            {"num_keys": len(keys), "normalize": normalize, "sources": sources},
+            f,
+            indent=2,
+        )
+
+
+def load_index(index_path: str) -> tuple[np.ndarray, dict]:
+    """Loads an index as a memory-mapped array."""
+    with open(meta_path(index_path), mode="r") as f:
+        meta = json.load(f)
+    return np.load(index_path, mmap_mode="r"), meta
+
+
+def contains(index: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """Returns whether each key is in the sorted index."""
+    if len(index) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    positions = np.searchsorted(index, keys)
+    return index[np.minimum(positions, len(index) - 1)] == keys
+
+
+def init_filter_worker(index_paths: Sequence[str]):
+    global _INDEXES
+    _INDEXES = [load_index(path)[0] for path in index_paths]
+
+
+def filter_mask(
+    columns: Sequence[List[bytes]], check_columns: Sequence[int], normalize: bool
+) -> np.ndarray:
+    """Returns `True` for line tuples whose checked lines are not indexed."""
+    mask = np.ones(len(columns[0]), dtype=bool)
+    for c in check_columns:
+        keys = line_keys(columns[c], normalize=normalize)
+        for index in _INDEXES:
+            mask &= ~contains(index, keys)
+    return mask
+
+
+# fmt: off
+@cli.subcommand("build-index")
+@cli.argument("inputs", nargs=-1, required=True, metavar="FILES...")
+@cli.option("--output", "-o", type=str, metavar="INDEX", required=True,
+            help="Output index path.")
+@cli.option("--normalize", is_flag=True,
+            help="Lowercase lines and collapse spaces before hashing.")
+@cli.option("--buffer-size", "-b", type=int, default=1000000, metavar="N",
+            help="The number of lines hashed at once.")
+# fmt: on
+def build_index(inputs: List[str], output: str, normalize: bool, buffer_size: int):
+    """Build a hash index of lines.
+
+    The index is a sorted array of 64-bit line hashes saved in the `.npy`
+    format, which is memory-mapped by `filter-by-index'. Its settings are
+    saved to `INDEX.json'.
+    """
+
+    chunks = []
+    num_lines = 0
+    for path in inputs:
+        with utils.open_file(path, mode="rb") as f:
+            for (lines,) in utils.buffer_aligned_lines([f], buffer_size=buffer_size):
+                chunks.append(np.unique(line_keys(lines, normalize=normalize)))
+                num_lines += len(lines)
+                if len(chunks) >= 16:
+                    chunks = [np.unique(np.concatenate(chunks))]
+    keys = np.unique(np.concatenate(chunks)) if len(chunks) > 0 else np.empty(0, dtype=np.uint64)
+    save_index(output, keys, normalize, [os.path.abspath(path) for path in inputs])
+    cli.echo(
+        "input lines: {:,}, index keys: {:,}".format(num_lines, len(keys)), err=True
+    )
+
+
+# fmt: off
+@cli.subcommand("merge-index")
+@cli.argument("indexes", nargs=-1, required=True, metavar="INDEXES...")
+@cli.option("--output", "-o", type=str, metavar="INDEX", required=True,
+            help="Output index path.")
+# fmt: on
+def merge_index(indexes: List[str], output: str):
+    """Merge hash indexes."""
+
+    loaded = [load_index(path) for path in indexes]
+    normalize = {meta["normalize"] for _, meta in loaded}
+    if len(normalize) != 1:
+        cli.abort("Indexes built with different normalization cannot be merged.")
+    keys = np.unique(np.concatenate([keys for keys, _ in loaded]))
+    sources = [source for _, meta in loaded for source in meta["sources"]]
+    save_index(output, keys, normalize.pop(), sources)
+    cli.echo("index keys: {:,}".format(len(keys)), err=True)
+
+
+# fmt: off
+@cli.subcommand("filter-by-index")
+@cli.option("--input-prefix", "-i", type=str, metavar="PREFIX", required=True,
+            help="Input files prefix.")
+@cli.option("--output-prefix", "-o", type=str, metavar="PREFIX", required=True,
+            help="Output files prefix.")
+@cli.option("--suffixes", "-s", multiple=True, metavar="SUFFIXES", required=True,
+            help="File suffixes.")
+@cli.option("--index", "-x", "indexes", multiple=True, metavar="INDEX", required=True,
+            help="Index built by `build-index'. It can be specify multiple times.")
+@cli.option("--check-suffix", "-c", multiple=True, metavar="SUFFIX",
+            help="Suffixes checked against the indexes. Defaults to all suffixes.")
+@cli.option_num_workers(default=1)
+@cli.option("--buffer-size", "-b", type=int, default=100000, metavar="N",
+            help="The number of lines processed by a worker at once.")
+# fmt: on
+def filter_by_index(
+    input_prefix: str,
+    output_prefix: str,
+    suffixes: Tuple[str, ...],
+    indexes: Tuple[str, ...],
+    check_suffix: Tuple[str, ...],
+    num_workers: int,
+    buffer_size: int,
+):
+    """Remove line tuples that appear in hash indexes.
+
+    A line tuple is removed if any of its checked lines is in any index,
+    e.g., to decontaminate training data against dev/test sets.
+    """
+
+    if any(s not in suffixes for s in check_suffix):
+        cli.abort("`--check-suffix' must be one of `--suffixes'.")
+    normalize = {load_index(path)[1]["normalize"] for path in indexes}
+    if len(normalize) != 1:
+        cli.abort("Indexes built with different normalization cannot be used together.")
+    check_columns = [suffixes.index(s) for s in check_suffix] or list(range(len(suffixes)))
+
+    input_files = [
+        utils.open_file(input_prefix + "." + suffix, mode="rb") for suffix in suffixes
+    ]
+    output_files = [
+        utils.open_file(output_prefix + "." + suffix, mode="wb") for suffix in suffixes
+    ]
+
+    num_keep, total_lines = 0, 0
+    for columns, mask in utils.imap_ordered(
+        partial(filter_mask, check_columns=check_columns, normalize=normalize.pop()),
+        utils.buffer_aligned_lines(input_files, buffer_size=buffer_size),
+        num_workers=num_workers,
+        initializer=init_filter_worker,
+        initargs=(indexes,),
+    ):
+        for f, lines in zip(output_files, columns):
+            f.writelines(line for line, keep in zip(lines, mask) if keep)
+        total_lines += len(mask)
+        num_keep += int(mask.sum())
+
+    for f in input_files:
+        f.close()
+    for f in output_files:
+        f.close()
+
+    cli.echo(
+        "input sentences: {:,}, output sentences: {:,}".format(total_lines, num_keep),
+        err=True,
+    )
+
+
+if __name__ == "__main__":
+    filter_by_index()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import heapq
+import json
+import os
+import resource
+import tempfile
+from collections import Counter
+from functools import partial
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from nlpack import cli, utils
+from nlpack.tokenizer import count_space_tokens
+
+
+def length_buckets(
+    columns: Sequence[List[bytes]],
+    length_columns: Sequence[int],
+    width: int,
+    boundaries: Optional[np.ndarray],
+) -> np.ndarray:
+    """Assigns line tuples to length buckets.
+
+    The length of a tuple is the maximum number of space-delimited tokens of
+    the lines in `length_columns`. If `boundaries` is given, the `k`-th bucket
+    holds lengths in `[boundaries[k - 1], boundaries[k])`; otherwise, it holds
+    lengths in `[k * width, (k + 1) * width)`.
+
+    Returns:
+        np.ndarray: Bucket IDs of shape `(num_lines,)`.
+    """
+    lengths = np.max([count_space_tokens(columns[c]) for c in length_columns], axis=0)
+    if boundaries is not None:
+        return np.searchsorted(boundaries, lengths, side="right")
+    return lengths // width
+
+
+def bucket_range(
+    bucket: int, width: int, boundaries: Optional[np.ndarray]
+) -> tuple[int, Optional[int]]:
+    """Returns the minimum and maximum lengths of a bucket. The maximum of the
+    last bucket given by `boundaries` is `None`."""
+    if boundaries is None:
+        return bucket * width, (bucket + 1) * width - 1
+    lo = 0 if bucket == 0 else int(boundaries[bucket - 1])
+    hi = int(boundaries[bucket]) - 1 if bucket < len(boundaries) else None
+    return lo, hi
+
+
+# The key of a line tuple in a sorted run: its length and input line id.
+RUN_KEY_DTYPE = np.dtype([("length", np.int64), ("id", np.int64)])
+# Bytes of Python objects per buffered line in addition to the line itself.
+LINE_OVERHEAD = 64
+# The maximum number of runs merged at once.
+MAX_FAN_IN = 64
+
+
+def write_run(path: str, keys: np.ndarray, line_tuples: Sequence[Sequence[bytes]]):
+    """Writes a sorted run: `PATH.keys` has the keys of the tuples, and
+    `PATH.lines` has the lines of each tuple in consecutive lines."""
+    keys.tofile(path + ".keys")
+    with open(path + ".lines", mode="wb") as f:
+        for line_tuple in line_tuples:
+            f.writelines(line_tuple)
+
+
+def read_run(
+    path: str, num_columns: int, block_size: int = 65536
+) -> Iterator[Tuple[int, int, Tuple[bytes, ...]]]:
+    """Yields the `(length, id, line_tuple)` records of a sorted run."""
+    num_records = os.path.getsize(path + ".keys") // RUN_KEY_DTYPE.itemsize
+    with open(path + ".keys", mode="rb") as f_keys, open(
+        path + ".lines", mode="rb"
+    ) as f_lines:
+        for _ in range(0, num_records, block_size):
+            keys = np.fromfile(f_keys, dtype=RUN_KEY_DTYPE, count=block_size)
+            for length, line_id in keys.tolist():
+                line_tuple = tuple(f_lines.readline() for _ in range(num_columns))
+                yield length, line_id, line_tuple
+
+
+def remove_run(path: str):
+    os.remove(path + ".keys")
+    os.remove(path + ".lines")
+
+
+class LengthSorter:
+    """Sorts line tuples by length stably with an external merge sort.
+
+    Tuples are buffered up to `memory_budget` bytes. Each full buffer is
+    sorted and written to `work_dir` as a run, and the runs are merged by a
+    k-way merge of at most `fan_in` runs at a time. Ties are broken by the
+    input order, so the result is the same as a stable in-memory sort.
+
+    Args:
+        work_dir (str): Directory of the runs.
+        num_columns (int): The number of lines of a tuple.
+        memory_budget (int): Bytes of the buffered tuples.
+        fan_in (int): The maximum number of runs merged at once.
+    """
+
+    def __init__(
+        self, work_dir: str, num_columns: int, memory_budget: int, fan_in: int
+    ):
+        self.work_dir = work_dir
+        self.num_columns = num_columns
+        self.memory_budget = memory_budget
+        self.fan_in = max(fan_in, 2)
+        self.runs: List[str] = []
+        self.num_runs = 0
+        self.num_lines = 0
+        self.line_tuples: List[Tuple[bytes, ...]] = []
+        self.lengths: List[np.ndarray] = []
+        self.buffered_bytes = 0
+
+    def new_run_path(self) -> str:
+        self.num_runs += 1
+        return os.path.join(self.work_dir, "run{}".format(self.num_runs))
+
+    def add(self, columns: Sequence[List[bytes]], lengths: np.ndarray):
+        columns = [list(map(utils.ensure_newline, lines)) for lines in columns]
+        self.line_tuples.extend(zip(*columns))
+        self.lengths.append(np.asarray(lengths, dtype=np.int64))
+        self.buffered_bytes += sum(
+            sum(map(len, lines)) + LINE_OVERHEAD * len(lines) for lines in columns
+        )
+        if self.buffered_bytes >= self.memory_budget:
+            self.flush()
+
+    def sorted_buffer(self) -> Tuple[np.ndarray, List[Tuple[bytes, ...]]]:
+        lengths = (
+            np.concatenate(self.lengths) if self.lengths else np.empty(0, np.int64)
+        )
+        order = np.argsort(lengths, kind="stable")
+        keys = np.empty(len(lengths), dtype=RUN_KEY_DTYPE)
+        keys["length"] = lengths[order]
+        keys["id"] = order + self.num_lines
+        line_tuples = [self.line_tuples[i] for i in order.tolist()]
+        self.num_lines += len(lengths)
+        self.line_tuples, self.lengths, self.buffered_bytes = [], [], 0
+        return keys, line_tuples
+
+    def flush(self):
+        """Writes the buffered tuples as a sorted run."""
+        if len(self.line_tuples) == 0:
+            return
+        path = self.new_run_path()
+        write_run(path, *self.sorted_buffer())
+        self.runs.append(path)
+
+    def merge(self, paths: List[str]) -> str:
+        """Merges runs into a new run."""
+        path = self.new_run_path()
+        keys: List[Tuple[int, int]] = []
+        with open(path + ".keys", mode="wb") as f_keys, open(
+            path + ".lines", mode="wb"
+        ) as f_lines:
+            for length, line_id, line_tuple in heapq.merge(
+                *(read_run(p, self.num_columns) for p in paths)
+            ):
+                keys.append((length, line_id))
+                f_lines.writelines(line_tuple)
+                if len(keys) >= 65536:
+                    np.array(keys, dtype=RUN_KEY_DTYPE).tofile(f_keys)
+                    keys = []
+            np.array(keys, dtype=RUN_KEY_DTYPE).tofile(f_keys)
+        for p in paths:
+            remove_run(p)
+        return path
+
+    def write(self, output_files: Sequence[IO]):
+        """Writes all tuples sorted by length, one line per file."""
+        if len(self.runs) == 0:
+            # Everything fits in memory.
+            _, line_tuples = self.sorted_buffer()
+            for f, lines in zip(output_files, zip(*line_tuples)):
+                f.writelines(lines)
+            return
+
+        self.flush()
+        while len(self.runs) > self.fan_in:
+            self.runs = [
+                self.merge(self.runs[i : i + self.fan_in])
+                for i in range(0, len(self.runs), self.fan_in)
+            ]
+        for _, _, line_tuple in heapq.merge(
+            *(read_run(p, self.num_columns) for p in self.runs)
+        ):
+            for f, line in zip(output_files, line_tuple):
+                f.write(line)
+        for p in self.runs:
+            remove_run(p)
+        self.runs = []
+
+
+def length_prefix(prefix: str, lo: int, hi: Optional[int]) -> str:
+    """Returns `PREFIX.lenLO-HI`, or `PREFIX.lenLO-` if `hi` is `None`."""
+    return "{}.len{}-{}".format(prefix, lo, "" if hi is None else hi)
+
+
+class BucketWriter:
+    """Writes line tuples to per-bucket files of aligned suffixes.
+
+    Files are opened when the first tuple of a bucket is written.
+
+    Args:
+        bucket_prefix (Callable[[int], str]): Returns the file prefix of a
+          bucket.
+        suffixes (Sequence[str]): File suffixes.
+        hint (str): Shown when the files exceed the limit of open files.
+    """
+
+    def __init__(
+        self, bucket_prefix: Callable[[int], str], suffixes: Sequence[str], hint: str
+    ):
+        self.bucket_prefix = bucket_prefix
+        self.suffixes = suffixes
+        self.hint = hint
+        self.files: Dict[int, List] = {}
+        self.max_files = resource.getrlimit(resource.RLIMIT_NOFILE)[0] - 2 * len(suffixes) - 16
+
+    def paths(self, bucket: int) -> List[str]:
+        prefix = self.bucket_prefix(bucket)
+        return [prefix + "." + suffix for suffix in self.suffixes]
+
+    def write(self, bucket: int, columns: Sequence[List[bytes]]):
+        if bucket not in self.files:
+            if (len(self.files) + 1) * len(self.suffixes) > self.max_files:
+                cli.abort(
+                    "{:,} bucket files exceed the limit of open files; {}".format(
+                        (len(self.files) + 1) * len(self.suffixes), self.hint
+                    )
+                )
+            self.files[bucket] = [
+                utils.open_file(path, mode="wb") for path in self.paths(bucket)
+            ]
+        for f, lines in zip(self.files[bucket], columns):
+            f.writelines(map(utils.ensure_newline, lines))
+
+    def close(self):
+        for files in self.files.values():
+            for f in files:
+                f.close()
+
+
+# fmt: off
+@cli.subcommand("length-bucket")
+@cli.option("--input-prefix", "-i", type=str, metavar="PREFIX", required=True,
+            help="Input files prefix.")
+@cli.option("--output-prefix", "-o", type=str, metavar="PREFIX", required=True,
+            help="Output files prefix.")
+@cli.option("--suffixes", "-s", multiple=True, metavar="SUFFIXES", required=True,
+            help="File suffixes.")
+@cli.option("--length-suffix", "-l", multiple=True, metavar="SUFFIX",
+            help="Suffixes whose maximum length is the length of a line tuple. "
+            "Defaults to all suffixes.")
+@cli.option("--bucket-width", "-w", type=int, metavar="N", default=8,
+            help="The range of lengths in a bucket.")
+@cli.option("--boundaries", type=str, metavar="N,N,...", default=None,
+            help="Comma separated lengths at which new buckets begin. "
+            "It overrides `--bucket-width'.")
+@cli.option("--sort", is_flag=True,
+            help="Write one file sorted by length instead of bucket files.")
+@cli.option("--manifest", type=str, metavar="FILE", default=None,
+            help="Manifest file. Defaults to `OUTPUT_PREFIX.manifest.json'.")
+@cli.option("--tmp-dir", type=str, metavar="DIR", default=None,
+            help="Temporary directory used by `--sort'.")
+@cli.option("--memory-budget", type=cli.SIZE, metavar="SIZE", default="1G",
+            help="Memory budget of `--sort', e.g., 512M or 4G.")
+@cli.option_num_workers(default=1)
+@cli.option("--buffer-size", "-b", type=int, default=100000, metavar="N",
+            help="The number of lines processed by a worker at once.")
+# fmt: on
+def length_bucket(
+    input_prefix: str,
+    output_prefix: str,
+    suffixes: List[str],
+    length_suffix: List[str],
+    bucket_width: int,
+    boundaries: Optional[str],
+    sort: bool,
+    manifest: Optional[str],
+    tmp_dir: Optional[str],
+    memory_budget: int,
+    num_workers: int,
+    buffer_size: int,
+):
+    """Group line tuples by length.
+
+    Lengths are the numbers of space-delimited tokens, the same as
+    `parallel-cleaner'. Line tuples are written to
+    `OUTPUT_PREFIX.lenMIN-MAX.SUFFIX', or to `OUTPUT_PREFIX.SUFFIX' sorted
+    by length with `--sort'. The input order is kept within each length.
+    The number of lines of each bucket is written to the manifest.
+
+    `--sort' is an external merge sort: runs of up to `--memory-budget' are
+    sorted in memory and written under `--tmp-dir', and then merged by
+    k-way merges of a bounded number of runs.
+    """
+
+    if any(s not in suffixes for s in length_suffix):
+        cli.abort("`--length-suffix' must be one of `--suffixes'.")
+    if bucket_width <= 0:
+        cli.abort("`--bucket-width' must be positive.")
+    length_columns = [suffixes.index(s) for s in length_suffix] or list(
+        range(len(suffixes))
+    )
+    if sort:
+        # Lengths are sorted, and the manifest has one bucket per length.
+        width, bounds = 1, None
+    elif boundaries is not None:
+        bounds = np.array(sorted({int(b) for b in boundaries.split(",")}), dtype=np.int64)
+        width = 0
+    else:
+        width, bounds = bucket_width, None
+
+    input_files = [
+        utils.open_file(input_prefix + "." + suffix, mode="rb") for suffix in suffixes
+    ]
+    chunks = utils.imap_ordered(
+        partial(
+            length_buckets,
+            length_columns=length_columns,
+            width=width,
+            boundaries=bounds,
+        ),
+        utils.buffer_aligned_lines(input_files, buffer_size=buffer_size),
+        num_workers=num_workers,
+    )
+    counts: Counter = Counter()
+    bucket_infos: List[Dict[str, Any]] = []
+    if sort:
+        # A run being merged has two open files.
+        max_files = resource.getrlimit(resource.RLIMIT_NOFILE)[0] - len(suffixes) - 16
+        fan_in = min(MAX_FAN_IN, max_files // 2)
+        with tempfile.TemporaryDirectory(
+            prefix="nlpack-length-", dir=tmp_dir
+        ) as work_dir:
+            sorter = LengthSorter(work_dir, len(suffixes), memory_budget, fan_in)
+            for columns, lengths in chunks:
+                sorter.add(columns, lengths)
+                counts.update(lengths.tolist())
+            output_files = [
+                utils.open_file(output_prefix + "." + suffix, mode="wb")
+                for suffix in suffixes
+            ]
+            sorter.write(output_files)
+            for f in output_files:
+                f.close()
+        begin = 0
+        for length in sorted(counts):
+            bucket_infos.append(
+                {
+                    "min_len": length,
+                    "max_len": length,
+                    "num_lines": counts[length],
+                    "begin": begin,
+                }
+            )
+            begin += counts[length]
+    else:
+        writer = BucketWriter(
+            lambda bucket: length_prefix(
+                output_prefix, *bucket_range(bucket, width, bounds)
+            ),
+            suffixes,
+            "increase `--bucket-width'.",
+        )
+        for columns, buckets in chunks:
+            order = np.argsort(buckets, kind="stable")
+            sorted_buckets = buckets[order]
+            for ids in np.split(order, np.flatnonzero(np.diff(sorted_buckets)) + 1):
+                ids = ids.tolist()
+                writer.write(
+                    int(buckets[ids[0]]), [[lines[i] for i in ids] for lines in columns]
+                )
+                counts[int(buckets[ids[0]])] += len(ids)
+        writer.close()
+        for bucket in sorted(counts):
+            lo, hi = bucket_range(bucket, width, bounds)
+            bucket_infos.append(
+                {
+                    "min_len": lo,
+                    "max_len": hi,
+                    "num_lines": counts[bucket],
+                    "files": writer.paths(bucket),
+                }
+            )
+    for f in input_files:
+        f.close()
+
+    num_lines = sum(counts.values())
+    manifest_path = manifest or output_prefix + ".manifest.json"
+    with open(manifest_path, mode="w") as f:
+        json.dump(
+            {
+                "suffixes": suffixes,
+                "length_suffixes": [suffixes[c] for c in length_columns],
+                "sorted": sort,
+                "num_lines": num_lines,
+                "buckets": bucket_infos,
+            },
+            f,
+            indent=2,
+        )
+
+    cli.echo(
+        "sentences: {:,}, buckets: {:,}".format(num_lines, len(bucket_infos)), err=True
+    )
+
+
+if __name__ == "__main__":
+    length_bucket()
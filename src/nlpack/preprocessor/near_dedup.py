@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import re
+import tempfile
+import unicodedata
+import zlib
+from functools import partial
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from nlpack import cli, utils
+from nlpack.hashing import mix64
+from nlpack.progress import Progress
+
+PUNCT_OR_SPACE = re.compile(r"[\W_]+")
+DIGIT = re.compile(r"\d")
+
+# The maximum number of shingles hashed at once.
+SHINGLE_BLOCK_SIZE = 1 << 15
+# Approximate bytes of a dict entry and its key and value objects, i.e., the
+# memory of a buffered representative in a band of the LSH index.
+BUFFERED_BAND_BYTES = 160
+# The number of keys moved at once when the runs of the LSH index are merged.
+MERGE_CHUNK_SIZE = 1 << 20
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes text so that differences in case, digits, punctuation, and
+    spaces are ignored."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = DIGIT.sub("0", text)
+    return PUNCT_OR_SPACE.sub(" ", text).strip()
+
+
+def shingle_hashes(
+    docs: Sequence[str], shingle: str, ngram: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Hashes the character or token n-grams of documents.
+
+    Documents shorter than `ngram` units are padded, so every document has
+    at least one shingle.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Hash values of all shingles, and the
+          offset of the first shingle of each document.
+    """
+    units = []
+    for doc in docs:
+        if shingle == "char":
+            codes = np.frombuffer(doc.encode("utf-32-le"), dtype=np.uint32)
+        else:
+            codes = np.array(
+                [zlib.crc32(token.encode("utf-8")) for token in doc.split()],
+                dtype=np.uint32,
+            )
+        if len(codes) < ngram:
+            codes = np.concatenate([codes, np.zeros(ngram - len(codes), dtype=np.uint32)])
+        units.append(codes)
+
+    lengths = np.array([len(codes) for codes in units], dtype=np.int64)
+    codes = np.concatenate(units).astype(np.uint64)
+    num_windows = len(codes) - ngram + 1
+    hashes = np.zeros(num_windows, dtype=np.uint64)
+    for k in range(ngram):
+        hashes = hashes * np.uint64(0x100000001B3) + codes[k : k + num_windows]
+
+    # Drops the windows across document boundaries.
+    ends = np.cumsum(lengths)
+    starts = np.arange(num_windows)
+    valid = starts + ngram <= np.repeat(ends, lengths)[:num_windows]
+    offsets = np.concatenate([[0], np.cumsum(lengths - ngram + 1)[:-1]])
+    return mix64(hashes[valid]), offsets
+
+
+def minhash_signatures(
+    columns: Sequence[List[bytes]],
+    num_perm: int,
+    shingle: str,
+    ngram: int,
+    seed: int,
+    normalize: bool,
+) -> np.ndarray:
+    """Computes MinHash signatures of line tuples.
+
+    Each line tuple is treated as a single document.
+
+    Returns:
+        np.ndarray: Signatures of shape `(num_lines, num_perm)`.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+
+    docs = []
+    for lines in zip(*columns):
+        texts = [line.decode("utf-8", errors="replace").strip() for line in lines]
+        if normalize:
+            texts = [normalize_text(text) for text in texts]
+        docs.append("\n".join(texts))
+
+    hashes, offsets = shingle_hashes(docs, shingle, ngram)
+    signatures = np.empty((len(docs), num_perm), dtype=np.uint32)
+    # Processes blocks of documents to bound the size of the hash matrix.
+    block_begin = 0
+    while block_begin < len(docs):
+        block_end = max(
+            block_begin + 1,
+            int(np.searchsorted(offsets, offsets[block_begin] + SHINGLE_BLOCK_SIZE)),
+        )
+        begin = offsets[block_begin]
+        end = offsets[block_end] if block_end < len(docs) else len(hashes)
+        permuted = (
+            (a[:, None] * hashes[None, begin:end] + b[:, None]) >> np.uint64(32)
+        ).astype(np.uint32)
+        signatures[block_begin:block_end] = np.minimum.reduceat(
+            permuted, offsets[block_begin:block_end] - begin, axis=1
+        ).T
+        block_begin = block_end
+    return signatures
+
+
+def optimal_lsh_params(threshold: float, num_perm: int) -> tuple[int, int]:
+    """Finds the number of bands and rows that minimizes the sum of the
+    false positive and false negative probabilities around the threshold."""
+    best, best_error = (1, num_perm), float("inf")
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            s = np.linspace(0.0, threshold, 101)
+            false_positive = np.trapezoid(1 - (1 - s**rows) ** bands, s)
+            s = np.linspace(threshold, 1.0, 101)
+            false_negative = np.trapezoid((1 - s**rows) ** bands, s)
+            error = float(false_positive + false_negative)
+            if error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+def band_keys(signatures: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    """Hashes the rows of each band into 64-bit keys.
+
+    Returns:
+        np.ndarray: Band keys of shape `(num_lines, bands)`.
+    """
+    rows_of_bands = (
+        signatures[:, : bands * rows]
+        .reshape(len(signatures), bands, rows)
+        .astype(np.uint64)
+    )
+    keys = np.zeros((len(signatures), bands), dtype=np.uint64)
+    for r in range(rows):
+        keys = keys * np.uint64(0x100000001B3) + rows_of_bands[:, :, r]
+    return mix64(keys)
+
+
+# A sorted run of the LSH index: the path prefix, keys, and representative ids.
+Run = tuple[str, np.ndarray, np.ndarray]
+
+
+class LSHIndex:
+    """LSH banding index of the representative signatures.
+
+    Each band maps its 64-bit keys to the first representative. New
+    representatives are buffered in memory, and when the buffer is full,
+    their signatures are appended to a file and their band keys are spilled
+    as sorted runs of `(key, id)` arrays. The runs are memory-mapped, looked
+    up by binary search and merged when a run is not larger than twice the
+    next one, so a band has O(log n) runs.
+
+    A representative costs `4 * num_perm + 16 * bands` bytes on disk, and
+    about `4 * num_perm + BUFFERED_BAND_BYTES * bands` bytes in memory while
+    buffered.
+
+    Args:
+        num_perm (int): The number of permutations.
+        bands (int): The number of bands.
+        rows (int): The number of rows in a band.
+        work_dir (str): Directory of the spilled signatures and runs.
+        buffer_size (int): The number of representatives buffered in memory.
+    """
+
+    def __init__(
+        self, num_perm: int, bands: int, rows: int, work_dir: str, buffer_size: int
+    ):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = rows
+        self.work_dir = work_dir
+        self.buffer_size = buffer_size
+        self.buffers: List[Dict[int, int]] = [{} for _ in range(bands)]
+        self.runs: List[List[Run]] = [[] for _ in range(bands)]
+        self.pending = np.empty((min(buffer_size, 1024), num_perm), dtype=np.uint32)
+        self.signatures_path = os.path.join(work_dir, "signatures.bin")
+        self.stored = np.empty((0, num_perm), dtype=np.uint32)
+        self.num_files = 0
+        self.size = 0
+
+    @staticmethod
+    def bytes_per_representative(num_perm: int, bands: int) -> int:
+        """Returns the approximate memory of a buffered representative."""
+        return 4 * num_perm + BUFFERED_BAND_BYTES * bands
+
+    def signature(self, rep: int) -> np.ndarray:
+        if rep < len(self.stored):
+            return self.stored[rep]
+        return self.pending[rep - len(self.stored)]
+
+    def lookup_runs(self, keys: np.ndarray) -> np.ndarray:
+        """Finds the representatives of band keys in the spilled runs.
+
+        Returns:
+            np.ndarray: Representative ids of shape `(num_lines, bands)`, or
+              -1 if a key is not found.
+        """
+        found = np.full(keys.shape, -1, dtype=np.int64)
+        for b, runs in enumerate(self.runs):
+            for _, run_keys, run_ids in runs:
+                idx = np.searchsorted(run_keys, keys[:, b])
+                hit = idx < len(run_keys)
+                hit[hit] = run_keys[idx[hit]] == keys[hit, b]
+                found[hit, b] = run_ids[idx[hit]]
+        return found
+
+    def query(self, signatures: np.ndarray, threshold: float) -> List[bool]:
+        """Returns `True` for each signature that has a similar representative,
+        and registers the others as new representatives in order."""
+        keys = band_keys(signatures, self.bands, self.rows)
+        found = self.lookup_runs(keys)
+        duplicates = []
+        for signature, row_keys, row_found in zip(
+            signatures, keys.tolist(), found.tolist()
+        ):
+            candidates = {rep for rep in row_found if rep >= 0}
+            candidates.update(
+                buffer[key]
+                for buffer, key in zip(self.buffers, row_keys)
+                if key in buffer
+            )
+            if any(
+                np.mean(self.signature(rep) == signature) >= threshold
+                for rep in candidates
+            ):
+                duplicates.append(True)
+                continue
+
+            num_pending = self.size - len(self.stored)
+            if num_pending == len(self.pending):
+                self.pending = np.concatenate(
+                    [self.pending, np.empty_like(self.pending)]
+                )
+            self.pending[num_pending] = signature
+            # Keys found in the runs already have their first representative.
+            for buffer, key, rep in zip(self.buffers, row_keys, row_found):
+                if rep < 0:
+                    buffer.setdefault(key, self.size)
+            self.size += 1
+            duplicates.append(False)
+
+        if self.size - len(self.stored) >= self.buffer_size:
+            self.spill()
+        return duplicates
+
+    def new_path(self) -> str:
+        self.num_files += 1
+        return os.path.join(self.work_dir, "run{}".format(self.num_files))
+
+    def save_run(self, run_keys: np.ndarray, run_ids: np.ndarray) -> Run:
+        path = self.new_path()
+        np.save(path + ".keys.npy", run_keys)
+        np.save(path + ".ids.npy", run_ids)
+        return self.load_run(path)
+
+    def load_run(self, path: str) -> Run:
+        return (
+            path,
+            np.load(path + ".keys.npy", mmap_mode="r"),
+            np.load(path + ".ids.npy", mmap_mode="r"),
+        )
+
+    def merge_runs(self, a: Run, b: Run) -> Run:
+        """Merges two runs chunk by chunk. The position of a key in the
+        merged run is its position in its run plus the number of smaller keys
+        in the other run, as the keys are distinct."""
+        path = self.new_path()
+        num_keys = len(a[1]) + len(b[1])
+        merged_keys = np.lib.format.open_memmap(
+            path + ".keys.npy", mode="w+", dtype=np.uint64, shape=(num_keys,)
+        )
+        merged_ids = np.lib.format.open_memmap(
+            path + ".ids.npy", mode="w+", dtype=np.int64, shape=(num_keys,)
+        )
+        for (_, run_keys, run_ids), (_, other_keys, _) in ((a, b), (b, a)):
+            for begin in range(0, len(run_keys), MERGE_CHUNK_SIZE):
+                chunk = np.asarray(run_keys[begin : begin + MERGE_CHUNK_SIZE])
+                positions = np.arange(begin, begin + len(chunk)) + np.searchsorted(
+                    other_keys, chunk
+                )
+                merged_keys[positions] = chunk
+                merged_ids[positions] = run_ids[begin : begin + len(chunk)]
+        merged_keys.flush()
+        merged_ids.flush()
+        del merged_keys, merged_ids
+        for run_path, *_ in (a, b):
+            os.remove(run_path + ".keys.npy")
+            os.remove(run_path + ".ids.npy")
+        return self.load_run(path)
+
+    def spill(self):
+        """Writes the buffered representatives to the work directory."""
+        num_pending = self.size - len(self.stored)
+        with open(self.signatures_path, mode="ab") as f:
+            self.pending[:num_pending].tofile(f)
+        self.stored = np.memmap(
+            self.signatures_path,
+            dtype=np.uint32,
+            mode="r",
+            shape=(self.size, self.num_perm),
+        )
+
+        for buffer, runs in zip(self.buffers, self.runs):
+            run_keys = np.fromiter(buffer.keys(), dtype=np.uint64, count=len(buffer))
+            run_ids = np.fromiter(buffer.values(), dtype=np.int64, count=len(buffer))
+            order = np.argsort(run_keys)
+            runs.append(self.save_run(run_keys[order], run_ids[order]))
+            buffer.clear()
+            while len(runs) > 1 and len(runs[-2][1]) <= 2 * len(runs[-1][1]):
+                runs.append(self.merge_runs(runs.pop(-2), runs.pop()))
+
+
+# fmt: off
+@cli.subcommand("near-dedup")
+@cli.option("--input-prefix", "-i", type=str, metavar="PREFIX", required=True,
+            help="Input files prefix.")
+@cli.option("--output-prefix", "-o", type=str, metavar="PREFIX", required=True,
+            help="Output files prefix.")
+@cli.option("--suffixes", "-s", multiple=True, metavar="SUFFIXES", required=True,
+            help="File suffixes.")
+@cli.option("--threshold", "-t", type=float, metavar="JACCARD", default=0.8,
+            help="Jaccard similarity threshold of near-duplicates.")
+@cli.option("--num-perm", type=int, metavar="N", default=128,
+            help="The number of MinHash permutations.")
+@cli.option("--shingle", choice=["char", "token"], metavar="UNIT", default="char",
+            help="Shingle unit.")
+@cli.option("--ngram", "-n", type=int, metavar="N", default=5,
+            help="Shingle size.")
+@cli.option("--normalize/--no-normalize", default=True,
+            help="Ignore case, digits, punctuation, and spaces.")
+@cli.option("--seed", type=int, metavar="N", default=0,
+            help="Random seed of the hash functions.")
+@cli.option("--memory-budget", type=cli.SIZE, metavar="SIZE", default="1G",
+            help="Memory of the representatives buffered before they are spilled to disk.")
+@cli.option("--tmp-dir", type=str, metavar="DIR", default=None,
+            help="Temporary directory of the spilled LSH index.")
+@cli.option_num_workers(default=1)
+@cli.option("--buffer-size", "-b", type=int, default=10000, metavar="N",
+            help="The number of lines processed by a worker at once.")
+# fmt: on
+def near_dedup(
+    input_prefix: str,
+    output_prefix: str,
+    suffixes: List[str],
+    threshold: float,
+    num_perm: int,
+    shingle: str,
+    ngram: int,
+    normalize: bool,
+    seed: int,
+    memory_budget: int,
+    tmp_dir: Optional[str],
+    num_workers: int,
+    buffer_size: int,
+):
+    """Remove near-duplicates by MinHash LSH.
+
+    Each line tuple over all `--suffixes' files is a document. A tuple is
+    removed if its estimated Jaccard similarity to an earlier kept tuple is
+    greater than or equal to the threshold, so the first tuple of each
+    cluster is kept as the representative.
+
+    The LSH index keeps the representatives in memory up to
+    `--memory-budget', about 4 * N + 160 * BANDS bytes each for N
+    permutations, and then spills them to `--tmp-dir', where each costs
+    4 * N + 16 * BANDS bytes.
+    """
+
+    bands, rows = optimal_lsh_params(threshold, num_perm)
+    index_buffer_size = max(
+        1, memory_budget // LSHIndex.bytes_per_representative(num_perm, bands)
+    )
+
+    input_files = [
+        utils.open_file(input_prefix + "." + suffix, mode="rb") for suffix in suffixes
+    ]
+    output_files = [
+        utils.open_file(output_prefix + "." + suffix, mode="wb") for suffix in suffixes
+    ]
+
+    num_keep, total_lines = 0, 0
+    progress = Progress("near-dedup", input_files)
+    with tempfile.TemporaryDirectory(
+        prefix="nlpack-near-dedup-", dir=tmp_dir
+    ) as work_dir:
+        index = LSHIndex(num_perm, bands, rows, work_dir, index_buffer_size)
+        for columns, signatures in utils.imap_ordered(
+            partial(
+                minhash_signatures,
+                num_perm=num_perm,
+                shingle=shingle,
+                ngram=ngram,
+                seed=seed,
+                normalize=normalize,
+            ),
+            utils.buffer_aligned_lines(input_files, buffer_size=buffer_size),
+            num_workers=num_workers,
+        ):
+            keep = [not duplicate for duplicate in index.query(signatures, threshold)]
+            for f, lines in zip(output_files, columns):
+                f.writelines(line for line, k in zip(lines, keep) if k)
+            total_lines += len(keep)
+            num_keep += sum(keep)
+            progress.update(len(keep), kept=sum(keep))
+        # Releases the memory maps before the work directory is removed.
+        del index
+    progress.close()
+
+    for f in input_files:
+        f.close()
+    for f in output_files:
+        f.close()
+
+    cli.echo(
+        "input sentences: {:,}, output sentences: {:,}".format(total_lines, num_keep),
+        err=True,
+    )
+    cli.echo("LSH bands: {}, rows: {}".format(bands, rows), err=True)
+
+
+if __name__ == "__main__":
+    near_dedup()
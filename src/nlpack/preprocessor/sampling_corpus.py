@@ -4,39 +4,338 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import itertools
+import math
+import os
 import shutil
 import subprocess
-from io import TextIOWrapper
-from typing import Dict, List, Set
+import tempfile
+from functools import partial
+from typing import IO, Dict, Iterable, List, Optional, Set
 
 import numpy as np
 
-from nlpack import cli
+from nlpack import cli, utils
+from nlpack.line_index import load_line_offsets, read_line_index
+from nlpack.sharding import ShardWriter
+from nlpack.tokenizer import count_space_tokens
 
 
 def count_lines(fname: str) -> int:
-    if shutil.which("wc"):
-        return int(
+    """Counts the lines of a file including an unterminated last line, which
+    `wc -l' does not count."""
+    if shutil.which("wc") and not utils.is_compressed(fname):
+        num_lines = int(
             subprocess.run(["wc", "-l", fname], capture_output=True, text=True)
             .stdout.strip()
             .split(maxsplit=2)[0]
         )
+        with open(fname, mode="rb") as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    num_lines += 1
+        return num_lines
     else:
-        with open(fname, mode="r") as f:
-            return len(f.readlines())
+        with utils.open_file(fname, mode="rb") as f:
+            return sum(1 for _ in f)
 
 
-def sample_on_memory(
-    f_in: TextIOWrapper, f_out: TextIOWrapper, sample_ids: List[int]
-) -> None:
+def input_path(input_prefix: str, suffix: str) -> str:
+    """Returns the input file path. The prefix `-` means the standard input."""
+    if input_prefix == "-":
+        return "-"
+    return input_prefix + "." + suffix
+
+
+def floyd_sample(n: int, k: int, rng: np.random.Generator) -> List[int]:
+    """Samples `k` distinct integers from `[0, n)` in random order.
+
+    Robert Floyd's algorithm draws only `k` random numbers and keeps only the
+    sample, i.e., O(k) time and memory regardless of `n`.
+    """
+    k = min(k, n)
+    draws = (rng.random(k) * np.arange(n - k + 1, n + 1)).astype(np.int64).tolist()
+    samples: Set[int] = set()
+    order: List[int] = []
+    for j, t in zip(range(n - k, n), draws):
+        s = j if t in samples else t
+        samples.add(s)
+        order.append(s)
+    rng.shuffle(order)
+    return order
+
+
+def open_uniform(rng: np.random.Generator) -> float:
+    """Draws a uniform random number from the open interval (0, 1)."""
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+
+def reservoir_sample(iterable: Iterable, k: int, rng: np.random.Generator) -> list:
+    """Samples `k` items from a stream of unknown length in one pass.
+
+    This is Algorithm L (Li, 1994), which skips items between replacements,
+    so the number of random draws is O(k (1 + log(n / k))). The sample is
+    returned in random order.
+    """
+    it = iter(iterable)
+    reservoir = list(itertools.islice(it, k))
+    if len(reservoir) == k and k > 0:
+        w = math.exp(math.log(open_uniform(rng)) / k)
+        while True:
+            skip = math.floor(math.log(open_uniform(rng)) / math.log1p(-w))
+            item = next(itertools.islice(it, skip, None), None)
+            if item is None:
+                break
+            reservoir[int(rng.integers(k))] = item
+            w *= math.exp(math.log(open_uniform(rng)) / k)
+    rng.shuffle(reservoir)
+    return reservoir
+
+
+class StreamingReservoir:
+    """Push-style Algorithm L for when items cannot be pulled from an iterator,
+    e.g., when a stream is split into several reservoirs on the fly.
+
+    Args:
+        k (int): Reservoir size.
+        rng (np.random.Generator): Random number generator.
+    """
+
+    def __init__(self, k: int, rng: np.random.Generator):
+        self.k = k
+        self.rng = rng
+        self.items: list = []
+        self.num_seen = 0
+        self.w = math.exp(math.log(open_uniform(rng)) / k) if k > 0 else 0.0
+        self.next_index = k + self.skip()
+
+    def skip(self) -> int:
+        if self.k == 0:
+            return 0
+        return math.floor(math.log(open_uniform(self.rng)) / math.log1p(-self.w))
+
+    def offer(self, item):
+        if self.num_seen < self.k:
+            self.items.append(item)
+        elif self.num_seen == self.next_index:
+            self.items[int(self.rng.integers(self.k))] = item
+            self.w *= math.exp(math.log(open_uniform(self.rng)) / self.k)
+            self.next_index += 1 + self.skip()
+        self.num_seen += 1
+
+
+def largest_remainder(total: int, weights: np.ndarray) -> np.ndarray:
+    """Splits `total` into integers proportional to `weights`."""
+    quotas = total * weights / weights.sum()
+    counts = np.floor(quotas).astype(np.int64)
+    remainders = np.argsort(-(quotas - counts), kind="stable")
+    counts[remainders[: total - counts.sum()]] += 1
+    return counts
+
+
+def read_manifest(path: str) -> List[tuple[str, float]]:
+    """Reads a manifest of `PREFIX [WEIGHT]` lines. `#` starts a comment."""
+    corpora = []
+    with open(path, mode="r") as f:
+        for line in f:
+            fields = line.split("#", 1)[0].split()
+            if len(fields) == 0:
+                continue
+            corpora.append((fields[0], float(fields[1]) if len(fields) > 1 else 1.0))
+    return corpora
+
+
+def corpus_size(path: str) -> int:
+    """Returns the number of lines from the line index if it is up to date."""
+    offsets = read_line_index(path)
+    return len(offsets) if offsets is not None else count_lines(path)
+
+
+def sample_ids_with_replacement(
+    num_lines: int, size: int, rng: np.random.Generator
+) -> np.ndarray:
+    """Draws sorted sample ids. If `size` exceeds `num_lines`, every line is
+    repeated as evenly as possible."""
+    repeats, rest = divmod(size, num_lines) if num_lines > 0 else (0, 0)
+    ids = np.concatenate(
+        [np.repeat(np.arange(num_lines), repeats), floyd_sample(num_lines, rest, rng)]
+    ).astype(np.int64)
+    ids.sort()
+    return ids
+
+
+def write_sampled_lines(
+    input_files: List, output_files: List, sample_ids: np.ndarray, buffer_size: int
+):
+    """Writes the lines of sorted (possibly repeated) sample ids in one pass."""
+    ids, counts = np.unique(sample_ids, return_counts=True)
+    pos, offset = 0, 0
+    for columns in utils.buffer_aligned_lines(input_files, buffer_size=buffer_size):
+        end = int(np.searchsorted(ids, offset + len(columns[0])))
+        for i, count in zip(ids[pos:end].tolist(), counts[pos:end].tolist()):
+            for f, lines in zip(output_files, columns):
+                f.write(utils.ensure_newline(lines[i - offset]) * count)
+        pos, offset = end, offset + len(columns[0])
+        if pos == len(ids):
+            break
+
+
+def count_length_buckets(
+    input_file: IO[bytes], bucket_width: int, buffer_size: int
+) -> Dict[int, int]:
+    """Counts the lines in each length bucket of `bucket_width` tokens."""
+    counts: Dict[int, int] = {}
+    for (lines,) in utils.buffer_aligned_lines([input_file], buffer_size=buffer_size):
+        buckets, sizes = np.unique(
+            count_space_tokens(lines) // bucket_width, return_counts=True
+        )
+        for bucket, n in zip(buckets.tolist(), sizes.tolist()):
+            counts[bucket] = counts.get(bucket, 0) + n
+    return counts
+
+
+def write_stratified_lines(
+    input_files: List,
+    output_files: List,
+    size: int,
+    bucket_sizes: Dict[int, int],
+    bucket_width: int,
+    rng: np.random.Generator,
+    buffer_size: int,
+):
+    """Samples lines keeping the distribution of the length buckets of the
+    first file.
+
+    `bucket_sizes` is counted by :func:`count_length_buckets` beforehand, so
+    each bucket has a reservoir of exactly its share of `size` lines, i.e.,
+    the memory is O(size) regardless of the number of buckets.
+    """
+    keys = sorted(bucket_sizes)
+    targets = largest_remainder(
+        min(size, sum(bucket_sizes.values())),
+        np.array([bucket_sizes[b] for b in keys], dtype=np.float64),
+    )
+    reservoirs: Dict[int, StreamingReservoir] = {
+        bucket: StreamingReservoir(target, rng)
+        for bucket, target in zip(keys, targets.tolist())
+        if target > 0
+    }
+    for columns in utils.buffer_aligned_lines(input_files, buffer_size=buffer_size):
+        buckets = (count_space_tokens(columns[0]) // bucket_width).tolist()
+        for bucket, line_tuple in zip(buckets, zip(*columns)):
+            if bucket in reservoirs:
+                reservoirs[bucket].offer(line_tuple)
+
+    for bucket in keys:
+        if bucket not in reservoirs:
+            continue
+        items = reservoirs[bucket].items
+        rng.shuffle(items)
+        for line_tuple in items:
+            for f, line in zip(output_files, line_tuple):
+                f.write(utils.ensure_newline(line))
+
+
+def sample_mixture(
+    manifest: str,
+    output_prefix: str,
+    suffixes: List[str],
+    sampling_size: int,
+    temperature: Optional[float],
+    stratify_width: Optional[int],
+    rng: np.random.Generator,
+    buffer_size: int = 100000,
+):
+    """Samples a mixture of corpora and writes it in random interleaved order."""
+    corpora = read_manifest(manifest)
+    sizes = np.array(
+        [corpus_size(prefix + "." + suffixes[0]) for prefix, _ in corpora],
+        dtype=np.float64,
+    )
+    weights = np.array([weight for _, weight in corpora], dtype=np.float64)
+    if temperature is not None:
+        weights = weights * sizes ** (1.0 / temperature)
+    targets = largest_remainder(sampling_size, weights)
+    for (prefix, _), size, target in zip(corpora, sizes, targets):
+        if size == 0 and target > 0:
+            cli.abort(
+                "{} has no lines, but {:,} lines are requested.".format(
+                    prefix, int(target)
+                )
+            )
+
+    with tempfile.TemporaryDirectory(prefix="nlpack-mixture-") as work_dir:
+        # 1. Samples each corpus in one pass into temporary files.
+        for c, ((prefix, _), size, target) in enumerate(zip(corpora, sizes, targets)):
+            input_files = [
+                utils.open_file(prefix + "." + suffix, mode="rb") for suffix in suffixes
+            ]
+            output_files: List[IO] = [
+                open(os.path.join(work_dir, "{}.{}".format(c, suffix)), mode="wb")
+                for suffix in suffixes
+            ]
+            if stratify_width is not None and target <= size:
+                # The first pass counts the buckets to size their reservoirs.
+                with utils.open_file(prefix + "." + suffixes[0], mode="rb") as f:
+                    bucket_sizes = count_length_buckets(f, stratify_width, buffer_size)
+                write_stratified_lines(
+                    input_files,
+                    output_files,
+                    int(target),
+                    bucket_sizes,
+                    stratify_width,
+                    rng,
+                    buffer_size,
+                )
+            else:
+                write_sampled_lines(
+                    input_files,
+                    output_files,
+                    sample_ids_with_replacement(int(size), int(target), rng),
+                    buffer_size,
+                )
+            for f in input_files + output_files:
+                f.close()
+            cli.echo(
+                "{}: {:,} / {:,} sentences".format(prefix, int(target), int(size)),
+                err=True,
+            )
+
+        # 2. Interleaves the samples in random order.
+        order = np.repeat(np.arange(len(corpora), dtype=np.uint16), targets)
+        rng.shuffle(order)
+        sample_files = [
+            [
+                open(os.path.join(work_dir, "{}.{}".format(c, suffix)), mode="rb")
+                for suffix in suffixes
+            ]
+            for c in range(len(corpora))
+        ]
+        output_files = [
+            utils.open_file(output_prefix + "." + suffix, mode="wb")
+            for suffix in suffixes
+        ]
+        for c in order.tolist():
+            for f_in, f_out in zip(sample_files[c], output_files):
+                f_out.write(f_in.readline())
+        for files in sample_files:
+            for f in files:
+                f.close()
+        for f in output_files:
+            f.close()
+
+
+def sample_on_memory(f_in: IO[str], f_out: IO[str], sample_ids: List[int]) -> None:
     lines = f_in.readlines()
     f_out.writelines([lines[i] for i in sample_ids])
 
 
-def sample_hash(
-    f_in: TextIOWrapper, f_out: TextIOWrapper, sample_ids: List[int]
-) -> None:
-    samples: Dict[int, str] = dict.fromkeys(sample_ids)
+def sample_hash(f_in: IO[str], f_out: IO[str], sample_ids: List[int]) -> None:
+    samples: Dict[int, Optional[str]] = dict.fromkeys(sample_ids)
     unseen: Set[int] = set(sample_ids)
     for i, line in enumerate(f_in):
         if i in unseen:
@@ -44,13 +343,84 @@ def sample_hash(
             unseen.remove(i)
             if len(unseen) == 0:
                 break
-    f_out.writelines(samples.values())
+    f_out.writelines(line for line in samples.values() if line is not None)
+
+
+def sample_seek(path: str, offsets: np.ndarray, f_out, sample_ids: List[int]) -> None:
+    """Reads only the sampled lines by seeking to their offsets in order."""
+    samples: Dict[int, bytes] = {}
+    with open(path, mode="rb") as f_in:
+        for i in sorted(sample_ids):
+            f_in.seek(int(offsets[i]))
+            samples[i] = f_in.readline()
+    f_out.writelines(samples[i] for i in sample_ids)
+
+
+def sample_lines(
+    input_prefix: str,
+    output_prefix: str,
+    suffixes: List[str],
+    sampling_size: int,
+    on_memory: bool,
+    reservoir: bool,
+    seek: bool,
+    save_line_index: bool,
+    rng: np.random.Generator,
+):
+    """Samples lines from a corpus by the method given by the flags."""
+    if reservoir:
+        input_files = [
+            utils.open_file(input_path(input_prefix, suffix), mode="r")
+            for suffix in suffixes
+        ]
+        samples = reservoir_sample(zip(*input_files), sampling_size, rng)
+        for f in input_files:
+            f.close()
+        for suffix, lines in zip(suffixes, zip(*samples) if samples else [[]] * len(suffixes)):
+            with utils.open_file(output_prefix + "." + suffix, mode="w") as f_out:
+                f_out.writelines(lines)
+        return
+
+    if seek:
+        paths = [input_prefix + "." + suffix for suffix in suffixes]
+        if any(utils.is_compressed(path) for path in paths):
+            cli.abort("`--seek' does not support compressed files.")
+        offsets = [load_line_offsets(path, save=save_line_index) for path in paths]
+        sample_ids = floyd_sample(min(map(len, offsets)), sampling_size, rng)
+        for suffix, path, offsets_f in zip(suffixes, paths, offsets):
+            with utils.open_file(output_prefix + "." + suffix, mode="wb") as f_out:
+                sample_seek(path, offsets_f, f_out, sample_ids)
+        return
+
+    fname = input_prefix + "." + suffixes[0]
+    num_sentences = count_lines(fname)
+
+    sample_ids = floyd_sample(num_sentences, sampling_size, rng)
+    for suffix in suffixes:
+        with utils.open_file(input_prefix + "." + suffix, mode="r") as f_in:
+            with utils.open_file(output_prefix + "." + suffix, mode="w") as f_out:
+                if on_memory:
+                    sample_on_memory(f_in, f_out, sample_ids)
+                else:
+                    sample_hash(f_in, f_out, sample_ids)
+
+
+def shard_sample(sample_prefix: str, writer: ShardWriter, buffer_size: int = 100000):
+    """Splits sampled files into the shards of `writer`."""
+    input_files = [
+        utils.open_file(sample_prefix + "." + suffix, mode="rb")
+        for suffix in writer.suffixes
+    ]
+    for columns in utils.buffer_aligned_lines(input_files, buffer_size=buffer_size):
+        writer.write(columns)
+    for f in input_files:
+        f.close()
 
 
 # fmt: off
 @cli.subcommand("sampling-corpus")
-@cli.option("--input-prefix", "-i", type=str, metavar="PREFIX", required=True,
-            help="Input files prefix.")
+@cli.option("--input-prefix", "-i", type=str, metavar="PREFIX", default=None,
+            help="Input files prefix. `-` reads a single suffix from the standard input.")
 @cli.option("--output-prefix", "-o", type=str, metavar="PREFIX", required=True,
             help="Output files prefix.")
 @cli.option("--suffixes", "-s", multiple=True, metavar="SUFFIXES", required=True,
@@ -59,8 +429,21 @@ def sample_hash(
             help="Sampling size.")
 @cli.option("--on-memory", "-m", is_flag=True,
             help="Load all data on memory.")
+@cli.option("--reservoir", "-r", is_flag=True,
+            help="Sample in one pass by reservoir sampling without counting lines.")
+@cli.option("--seek", is_flag=True,
+            help="Read only the sampled lines using line-offset indexes (`FILE.offsets.npy`).")
+@cli.option("--save-line-index", is_flag=True,
+            help="Save the line offsets built by `--seek' as `FILE.offsets.npy' for later runs.")
+@cli.option("--manifest", type=str, metavar="FILE", default=None,
+            help="Sample a mixture of the corpora listed as `PREFIX [WEIGHT]` lines in FILE.")
+@cli.option("--temperature", "-T", type=float, metavar="T", default=None,
+            help="Temperature of the mixture sizes, i.e., p \u221d WEIGHT * n^(1/T).")
+@cli.option("--stratify-length", type=int, metavar="WIDTH", default=None,
+            help="Keep the distribution of length buckets of this width in each corpus of the mixture.")
 @cli.option("--seed", type=int, metavar="N", default=0,
             help="Random seed.")
+@cli.option_shards()
 # fmt: on
 def sampling_corpus(
     input_prefix: str,
@@ -68,23 +451,82 @@ def sampling_corpus(
     suffixes: List[str],
     sampling_size: int,
     on_memory: bool = False,
+    reservoir: bool = False,
+    seek: bool = False,
+    save_line_index: bool = False,
+    manifest: Optional[str] = None,
+    temperature: Optional[float] = None,
+    stratify_length: Optional[int] = None,
     seed: int = 0,
+    num_shards: int = 1,
+    shard_by: str = "hash",
+    shard_seed: int = 0,
 ):
-    """Sampling lines from corpus."""
+    """Sampling lines from corpus.
 
-    fname = input_prefix + "." + suffixes[0]
-    num_sentences = count_lines(fname)
+    By default, the number of lines is counted first and the sample ids are
+    drawn by Floyd's algorithm. With `--reservoir', the aligned input files
+    are read only once with O(N) memory for N samples, which also works for
+    the standard input and compressed files.
 
-    np.random.seed(seed)
-    size = min(sampling_size, num_sentences)
-    sample_ids = np.random.permutation(num_sentences)[:size].tolist()
-    for suffix in suffixes:
-        with open(input_prefix + "." + suffix, mode="r") as f_in:
-            with open(output_prefix + "." + suffix, mode="w") as f_out:
-                if on_memory:
-                    sample_on_memory(f_in, f_out, sample_ids)
-                else:
-                    sample_hash(f_in, f_out, sample_ids)
+    With `--seek', the byte offset of each line is loaded from
+    `FILE.offsets.npy' if it is up to date, or built in one pass, and only
+    the sampled lines are read. `--save-line-index' saves the built offsets
+    for later runs. The mixture sampling also counts lines by the index if
+    it exists.
+
+    With `--manifest', N lines are sampled from multiple corpora and written
+    as a single mixture in random interleaved order. Each corpus gets
+    N * p_i lines, where p_i is proportional to its weight, or to
+    WEIGHT * n_i^(1/T) with `--temperature'. A corpus is repeated if its
+    share exceeds its size.
+
+    With `--num-shards', the sample is split into shards by the content hash
+    of each line tuple or in turn.
+    """
+
+    if stratify_length is not None and stratify_length <= 0:
+        cli.abort("`--stratify-length' must be positive.")
+    rng = np.random.default_rng(seed)
+    if manifest is not None:
+        sample = partial(
+            sample_mixture,
+            manifest,
+            suffixes=suffixes,
+            sampling_size=sampling_size,
+            temperature=temperature,
+            stratify_width=stratify_length,
+            rng=rng,
+        )
+    else:
+        if input_prefix is None:
+            cli.abort("Either `--input-prefix' or `--manifest' is required.")
+        if input_prefix == "-" and (not reservoir or len(suffixes) != 1):
+            cli.abort("The standard input requires `--reservoir' and a single suffix.")
+        sample = partial(
+            sample_lines,
+            input_prefix,
+            suffixes=suffixes,
+            sampling_size=sampling_size,
+            on_memory=on_memory,
+            reservoir=reservoir,
+            seek=seek,
+            save_line_index=save_line_index,
+            rng=rng,
+        )
+
+    if num_shards == 1:
+        sample(output_prefix=output_prefix)
+        return
+    # Samples are drawn per suffix by most methods, so they are split into
+    # shards after sampling.
+    writer = ShardWriter(output_prefix, suffixes, num_shards, shard_by, shard_seed)
+    writer.open()
+    with tempfile.TemporaryDirectory(prefix="nlpack-sampling-") as work_dir:
+        sample_prefix = os.path.join(work_dir, "sample")
+        sample(output_prefix=sample_prefix)
+        shard_sample(sample_prefix, writer)
+    writer.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import itertools
+import math
+import os
+import resource
+import tempfile
+from typing import IO, Generator, Iterable, List, Optional
+
+import numpy as np
+
+from nlpack import cli, utils
+
+# Lines on memory take roughly this many times their size in bytes.
+MEMORY_FACTOR = 3
+# Buckets are planned to fill this ratio of the memory budget, so that random
+# variation in their sizes rarely requires them to be scattered again.
+BUCKET_FILL = 0.8
+
+
+def max_open_files(num_suffixes: int) -> int:
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0] - num_suffixes - 16
+
+
+def scatter(
+    chunks: Iterable[List[tuple]], paths: List[str], rng: np.random.Generator
+) -> np.ndarray:
+    """Scatters line tuples into random bucket files. A tuple is stored as
+    consecutive lines in a bucket file.
+
+    Returns:
+        np.ndarray: The number of tuples in each bucket.
+    """
+    files = [open(path, mode="wb") for path in paths]
+    counts = np.zeros(len(paths), dtype=np.int64)
+    for tuples in chunks:
+        buckets = rng.integers(len(paths), size=len(tuples))
+        counts += np.bincount(buckets, minlength=len(paths))
+        for bucket, line_tuple in zip(buckets.tolist(), tuples):
+            files[bucket].writelines(map(utils.ensure_newline, line_tuple))
+    for f in files:
+        f.close()
+    return counts
+
+
+def read_bucket(
+    path: str, num_suffixes: int, buffer_size: int
+) -> Generator[List[tuple], None, None]:
+    """Reads chunks of the line tuples of a bucket file."""
+    with open(path, mode="rb") as f:
+        while True:
+            lines = list(itertools.islice(f, buffer_size * num_suffixes))
+            if len(lines) == 0:
+                return
+            yield list(zip(*[iter(lines)] * num_suffixes))
+
+
+def shuffle_bucket(
+    path: str,
+    num_tuples: int,
+    output_files: List[IO],
+    memory_budget: int,
+    rng: np.random.Generator,
+    buffer_size: int,
+) -> int:
+    """Shuffles a bucket in memory and appends it to the outputs.
+
+    A bucket that does not fit in `memory_budget`, e.g., because its size was
+    estimated from compressed inputs, is scattered again into smaller
+    buckets.
+
+    Returns:
+        int: The number of buckets that are shuffled in memory.
+    """
+    num_suffixes = len(output_files)
+    size = os.path.getsize(path)
+    if size * MEMORY_FACTOR > memory_budget and num_tuples > 1:
+        num_buckets = min(
+            max(2, math.ceil(size * MEMORY_FACTOR / memory_budget)),
+            max_open_files(num_suffixes),
+        )
+        paths = ["{}.{}".format(path, k) for k in range(num_buckets)]
+        counts = scatter(read_bucket(path, num_suffixes, buffer_size), paths, rng)
+        os.remove(path)
+        return sum(
+            shuffle_bucket(
+                sub_path, count, output_files, memory_budget, rng, buffer_size
+            )
+            for sub_path, count in zip(paths, counts.tolist())
+        )
+
+    with open(path, mode="rb") as f:
+        lines = f.readlines()
+    os.remove(path)
+    for i in rng.permutation(len(lines) // num_suffixes).tolist():
+        for j, f_out in enumerate(output_files):
+            f_out.write(lines[i * num_suffixes + j])
+    return 1
+
+
+# fmt: off
+@cli.subcommand("shuffle")
+@cli.option("--input-prefix", "-i", type=str, metavar="PREFIX", required=True,
+            help="Input files prefix.")
+@cli.option("--output-prefix", "-o", type=str, metavar="PREFIX", required=True,
+            help="Output files prefix.")
+@cli.option("--suffixes", "-s", multiple=True, metavar="SUFFIXES", required=True,
+            help="File suffixes.")
+@cli.option("--memory-budget", type=cli.SIZE, metavar="SIZE", default="4G",
+            help="Memory budget, e.g., 512M or 4G.")
+@cli.option("--tmp-dir", type=str, metavar="DIR", default=None,
+            help="Temporary directory.")
+@cli.option("--seed", type=int, metavar="N", default=0,
+            help="Random seed.")
+@cli.option("--buffer-size", "-b", type=int, default=100000, metavar="N",
+            help="The number of lines scattered at once.")
+# fmt: on
+def shuffle(
+    input_prefix: str,
+    output_prefix: str,
+    suffixes: List[str],
+    memory_budget: int,
+    tmp_dir: Optional[str],
+    seed: int,
+    buffer_size: int,
+):
+    """Shuffle aligned files that do not fit in memory.
+
+    Line tuples are scattered into random on-disk buckets small enough for
+    `--memory-budget', and then each bucket is shuffled in memory and
+    appended to the outputs. Every suffix stays aligned.
+
+    The number of buckets is estimated from the input file sizes, which
+    underestimates compressed inputs, so a bucket larger than the budget is
+    scattered again into smaller buckets.
+    """
+
+    rng = np.random.default_rng(seed)
+    input_paths = [input_prefix + "." + suffix for suffix in suffixes]
+    total_bytes = sum(os.path.getsize(path) for path in input_paths)
+    num_buckets = max(
+        1, math.ceil(total_bytes * MEMORY_FACTOR / (memory_budget * BUCKET_FILL))
+    )
+    max_files = max_open_files(len(suffixes))
+    if num_buckets > max_files:
+        cli.abort(
+            "{:,} buckets exceed the limit of open files; increase `--memory-budget'.".format(
+                num_buckets
+            )
+        )
+
+    with tempfile.TemporaryDirectory(prefix="nlpack-shuffle-", dir=tmp_dir) as work_dir:
+        # 1. Scatters line tuples into random buckets.
+        bucket_paths = [
+            os.path.join(work_dir, "bucket{}".format(k)) for k in range(num_buckets)
+        ]
+        input_files = [utils.open_file(path, mode="rb") for path in input_paths]
+        counts = scatter(
+            (
+                list(zip(*columns))
+                for columns in utils.buffer_aligned_lines(
+                    input_files, buffer_size=buffer_size
+                )
+            ),
+            bucket_paths,
+            rng,
+        )
+        for f in input_files:
+            f.close()
+        num_lines = int(counts.sum())
+
+        # 2. Shuffles each bucket in memory.
+        output_files = [
+            utils.open_file(output_prefix + "." + suffix, mode="wb")
+            for suffix in suffixes
+        ]
+        num_shuffled = sum(
+            shuffle_bucket(path, count, output_files, memory_budget, rng, buffer_size)
+            for path, count in zip(bucket_paths, counts.tolist())
+        )
+        for f in output_files:
+            f.close()
+
+    cli.echo(
+        "sentences: {:,}, buckets: {:,}".format(num_lines, num_shuffled), err=True
+    )
+
+
+if __name__ == "__main__":
+    shuffle()
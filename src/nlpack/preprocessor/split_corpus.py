@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from functools import partial
+from typing import Generator, List, Sequence, Union
+
+import numpy as np
+
+from nlpack import cli, utils
+from nlpack.hashing import hash_line_tuples, mix64
+from nlpack.preprocessor.sampling_corpus import count_lines
+
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def parse_split(split: str) -> tuple[str, Union[int, float]]:
+    """Parses `NAME:SIZE`, where `SIZE` is a positive number of lines or a
+    fraction in (0, 1)."""
+    name, sep, size = split.rpartition(":")
+    if not sep or not name:
+        raise ValueError("Invalid split: {}".format(split))
+    try:
+        num_lines = int(size)
+    except ValueError:
+        pass
+    else:
+        if num_lines <= 0:
+            raise ValueError("Invalid split size: {}".format(split))
+        return name, num_lines
+    try:
+        fraction = float(size)
+    except ValueError:
+        raise ValueError("Invalid split size: {}".format(split))
+    if not 0.0 < fraction < 1.0:
+        raise ValueError("Invalid split fraction: {}".format(split))
+    return name, fraction
+
+
+def seed_mask(seed: int) -> np.uint64:
+    return mix64(np.array([seed], dtype=np.uint64) * GOLDEN_GAMMA + GOLDEN_GAMMA)[0]
+
+
+def content_keys(
+    columns: Sequence[List[bytes]], key_columns: Sequence[int], seed: int
+) -> np.ndarray:
+    """Hashes the contents of line tuples. Surrounding spaces are ignored."""
+    lines = [[line.strip() for line in columns[c]] for c in key_columns]
+    return mix64(hash_line_tuples(lines, bits=64)[:, 0] ^ seed_mask(seed))
+
+
+def index_keys(begin: int, num_lines: int, seed: int) -> np.ndarray:
+    """Hashes the line numbers from `begin`."""
+    ids = np.arange(begin + 1, begin + num_lines + 1, dtype=np.uint64)
+    return mix64(ids * GOLDEN_GAMMA ^ seed_mask(seed))
+
+
+def iter_keys(
+    input_paths: Sequence[str],
+    key: str,
+    key_columns: Sequence[int],
+    seed: int,
+    num_workers: int,
+    buffer_size: int,
+) -> Generator[tuple[list, np.ndarray], None, None]:
+    """Yields chunks of line tuples and their hash keys."""
+    input_files = [utils.open_file(path, mode="rb") for path in input_paths]
+    chunks = utils.buffer_aligned_lines(input_files, buffer_size=buffer_size)
+    if key == "content":
+        yield from utils.imap_ordered(
+            partial(content_keys, key_columns=key_columns, seed=seed),
+            chunks,
+            num_workers=num_workers,
+        )
+    else:
+        begin = 0
+        for columns in chunks:
+            yield columns, index_keys(begin, len(columns[0]), seed)
+            begin += len(columns[0])
+    for f in input_files:
+        f.close()
+
+
+# fmt: off
+@cli.subcommand("split-corpus")
+@cli.option("--input-prefix", "-i", type=str, metavar="PREFIX", required=True,
+            help="Input files prefix.")
+@cli.option("--output-prefix", "-o", type=str, metavar="PREFIX", required=True,
+            help="Output files prefix.")
+@cli.option("--suffixes", "-s", multiple=True, metavar="SUFFIXES", required=True,
+            help="File suffixes.")
+@cli.option("--split", "-S", "splits", multiple=True, metavar="NAME:SIZE", required=True,
+            help="Held-out split and its size in lines or as a fraction, "
+            "e.g., `-S dev:2000 -S test:0.01'.")
+@cli.option("--rest", type=str, metavar="NAME", default="train",
+            help="Split that receives the remaining lines.")
+@cli.option("--key", choice=["content", "index"], default="content",
+            help="Hash the contents or the line numbers of line tuples.")
+@cli.option("--key-suffix", "-k", multiple=True, metavar="SUFFIX",
+            help="Suffixes hashed by `--key content'. Defaults to all suffixes.")
+@cli.option("--exact", is_flag=True,
+            help="Make the held-out sizes exact. It is implied by sizes in lines.")
+@cli.option("--seed", type=int, metavar="N", default=0,
+            help="Random seed.")
+@cli.option_num_workers(default=1)
+@cli.option("--buffer-size", "-b", type=int, default=100000, metavar="N",
+            help="The number of lines processed by a worker at once.")
+# fmt: on
+def split_corpus(
+    input_prefix: str,
+    output_prefix: str,
+    suffixes: List[str],
+    splits: List[str],
+    rest: str,
+    key: str,
+    key_suffix: List[str],
+    exact: bool,
+    seed: int,
+    num_workers: int,
+    buffer_size: int,
+):
+    """Split a corpus into held-out sets and the rest by hashing.
+
+    Line tuples are written to `OUTPUT_PREFIX.NAME.SUFFIX'. Each tuple is
+    assigned by a seeded hash of its contents or line number, so the result
+    is deterministic. With the content key, identical tuples never straddle
+    splits.
+
+    Fractional sizes are applied to the hash values in a single pass, so
+    the sizes are approximate. With `--exact' or sizes in lines, the
+    tuples with the smallest hash values are held out in another pass; each
+    held-out set then consists of exactly SIZE distinct tuples, and repeated
+    occurrences of held-out tuples are dropped.
+    """
+
+    try:
+        sizes = dict(parse_split(split) for split in splits)
+    except ValueError as e:
+        cli.abort(str(e))
+    if len(sizes) != len(splits) or rest in sizes:
+        cli.abort("Split names must be unique.")
+    if any(s not in suffixes for s in key_suffix):
+        cli.abort("`--key-suffix' must be one of `--suffixes'.")
+    key_columns = [suffixes.index(s) for s in key_suffix] or list(range(len(suffixes)))
+    names = list(sizes) + [rest]
+    input_paths = [input_prefix + "." + suffix for suffix in suffixes]
+    exact = exact or any(isinstance(size, int) for size in sizes.values())
+    if exact:
+        total_lines = count_lines(input_paths[0])
+        counts = [
+            size if isinstance(size, int) else round(size * total_lines)
+            for size in sizes.values()
+        ]
+        bounds = np.cumsum(counts)
+        if bounds[-1] > total_lines:
+            cli.abort(
+                "The held-out sizes sum to {:,} lines, but the corpus has {:,}.".format(
+                    int(bounds[-1]), total_lines
+                )
+            )
+    else:
+        bounds = np.cumsum(list(sizes.values()))
+        if bounds[-1] >= 1.0:
+            cli.abort("The sum of the split fractions must be less than 1.")
+
+    def iter_chunks():
+        return iter_keys(input_paths, key, key_columns, seed, num_workers, buffer_size)
+
+    if exact:
+        # 1. Finds the smallest distinct hash values, which are held out.
+        held = np.empty(0, dtype=np.uint64)
+        for _, keys in iter_chunks():
+            held = np.unique(np.concatenate([held, keys]))[: bounds[-1]]
+        if len(held) < bounds[-1]:
+            cli.abort(
+                "The held-out sizes sum to {:,} lines, but the corpus has only {:,} "
+                "distinct line tuples.".format(int(bounds[-1]), len(held))
+            )
+        seen = np.zeros(len(held), dtype=bool)
+
+    output_files = [
+        [
+            utils.open_file(output_prefix + "." + name + "." + suffix, mode="wb")
+            for suffix in suffixes
+        ]
+        for name in names
+    ]
+    num_lines = np.zeros(len(names), dtype=np.int64)
+    num_dropped = 0
+    for columns, keys in iter_chunks():
+        if exact:
+            ranks = np.searchsorted(held, keys)
+            if len(held) > 0:
+                is_held = held[np.minimum(ranks, len(held) - 1)] == keys
+            else:
+                is_held = np.zeros(len(keys), dtype=bool)
+            held_ids = np.flatnonzero(is_held)
+            split_ids = np.full(len(keys), len(names) - 1)
+            split_ids[held_ids] = np.searchsorted(bounds, ranks[held_ids], side="right")
+
+            # Keeps only the first occurrence of each held-out tuple.
+            _, first = np.unique(ranks[held_ids], return_index=True)
+            is_first = np.zeros(len(held_ids), dtype=bool)
+            is_first[first] = True
+            is_first &= ~seen[ranks[held_ids]]
+            seen[ranks[held_ids]] = True
+            split_ids[held_ids[~is_first]] = -1
+            num_dropped += int((~is_first).sum())
+        else:
+            uniform = (keys >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+            split_ids = np.searchsorted(bounds, uniform, side="right")
+
+        for s, files in enumerate(output_files):
+            ids = np.flatnonzero(split_ids == s).tolist()
+            if len(ids) == 0:
+                continue
+            for f, lines in zip(files, columns):
+                f.writelines(utils.ensure_newline(lines[i]) for i in ids)
+            num_lines[s] += len(ids)
+
+    for files in output_files:
+        for f in files:
+            f.close()
+
+    cli.echo(
+        ", ".join(
+            "{}: {:,}".format(name, n) for name, n in zip(names, num_lines.tolist())
+        ),
+        err=True,
+    )
+    if num_dropped > 0:
+        cli.echo(
+            "dropped repeated held-out sentences: {:,}".format(num_dropped), err=True
+        )
+
+
+if __name__ == "__main__":
+    split_corpus()
@@ -0,0 +1,262 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import contextlib
+import cProfile
+import json
+import pstats
+import resource
+import sys
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Optional
+
+from nlpack import cli
+
+# The active profiler. `None` means profiling is disabled, and the timer API
+# costs only a global lookup.
+_PROFILER: Optional["Profiler"] = None
+_NULL_TIMER = contextlib.nullcontext()
+
+
+def peak_rss() -> int:
+    """Returns the peak RSS of this process in bytes.
+
+    On Linux, it is `VmHWM` of the process. `ru_maxrss` carries over the
+    high-water mark of the parent through fork and exec, so a command started
+    by a large process would report the memory of the parent.
+    """
+    try:
+        with open("/proc/self/status", mode="r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit
+
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    elapsed: float = 0.0
+    lines: int = 0
+    bytes: int = 0
+
+
+class Timer:
+    """Adds the elapsed time of a `with` block to a stage."""
+
+    __slots__ = ("stats", "start")
+
+    def __init__(self, stats: StageStats):
+        self.stats = stats
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.elapsed += time.perf_counter() - self.start
+        self.stats.calls += 1
+
+
+class RawStats(cProfile.Profile):
+    """Wraps the stats dictionary of a profile so that `pstats` can load it."""
+
+    def __init__(self, stats: dict):
+        # The profiler itself is not initialized because it never runs.
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class Profiler:
+    """Collects the statistics of a run.
+
+    Args:
+        cprofile (bool): Also profile the function calls by cProfile.
+    """
+
+    def __init__(self, cprofile: bool = False):
+        self.stages: Dict[str, StageStats] = defaultdict(StageStats)
+        self.start = time.perf_counter()
+        self.num_workers = 0
+        self.worker_busy = 0.0
+        self.worker_capacity = 0.0
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.worker_stats: Optional[pstats.Stats] = None
+
+    def add_worker_profile(self, stats: dict):
+        if self.worker_stats is None:
+            self.worker_stats = pstats.Stats(RawStats(stats))
+        else:
+            self.worker_stats.add(RawStats(stats))
+
+    def summary(self) -> Dict[str, Any]:
+        wall_time = time.perf_counter() - self.start
+        stages = {}
+        for name, stats in self.stages.items():
+            stages[name] = asdict(stats)
+            if stats.elapsed > 0:
+                stages[name]["lines_per_sec"] = stats.lines / stats.elapsed
+                stages[name]["bytes_per_sec"] = stats.bytes / stats.elapsed
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+        rss_unit = 1 if sys.platform == "darwin" else 1024
+        return {
+            "command": sys.argv[1:],
+            "wall_time": wall_time,
+            "peak_rss": peak_rss(),
+            "peak_rss_children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            * rss_unit,
+            "stages": stages,
+            "workers": {
+                "num_workers": self.num_workers,
+                "busy_time": self.worker_busy,
+                "utilization": self.worker_busy / self.worker_capacity
+                if self.worker_capacity > 0
+                else None,
+            },
+        }
+
+
+def enabled() -> bool:
+    return _PROFILER is not None
+
+
+def enable(cprofile: bool = False):
+    """Starts profiling in the current process."""
+    global _PROFILER
+    _PROFILER = Profiler(cprofile=cprofile)
+    if _PROFILER.cprofile is not None:
+        _PROFILER.cprofile.enable()
+
+
+def disable() -> Optional[Profiler]:
+    """Stops profiling and returns the profiler."""
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    if profiler is not None and profiler.cprofile is not None:
+        profiler.cprofile.disable()
+    return profiler
+
+
+def timer(stage: str):
+    """Returns a context manager that measures the time of a stage.
+
+    Example:
+        >>> with profiling.timer("write"):
+        ...     f.writelines(lines)
+    """
+    if _PROFILER is None:
+        return _NULL_TIMER
+    return Timer(_PROFILER.stages[stage])
+
+
+def add(
+    stage: str, elapsed: float = 0.0, calls: int = 0, lines: int = 0, nbytes: int = 0
+):
+    """Adds the elapsed time, the number of calls, and the processed lines and
+    bytes to a stage."""
+    if _PROFILER is None:
+        return
+    stats = _PROFILER.stages[stage]
+    stats.elapsed += elapsed
+    stats.calls += calls
+    stats.lines += lines
+    stats.bytes += nbytes
+
+
+def add_workers(num_workers: int, busy: float, wall_time: float):
+    """Records the busy time of workers during a parallel map."""
+    if _PROFILER is None:
+        return
+    _PROFILER.num_workers = max(_PROFILER.num_workers, num_workers)
+    _PROFILER.worker_busy += busy
+    _PROFILER.worker_capacity += num_workers * wall_time
+
+
+def cprofile_enabled() -> bool:
+    return _PROFILER is not None and _PROFILER.cprofile is not None
+
+
+def timed_call(func: Callable, cprofile: bool, item: Any) -> tuple[Any, float, Optional[dict]]:
+    """Calls a function in a worker and measures it.
+
+    Returns:
+        tuple[Any, float, Optional[dict]]: The result, the elapsed time, and
+          the cProfile statistics if `cprofile` is true.
+    """
+    start = time.perf_counter()
+    if not cprofile:
+        return func(item), time.perf_counter() - start, None
+    if _PROFILER is not None and _PROFILER.cprofile is not None:
+        # A forked worker inherits the active profiler of the parent.
+        _PROFILER.cprofile.disable()
+    profile = cProfile.Profile()
+    result = profile.runcall(func, item)
+    elapsed = time.perf_counter() - start
+    profile.create_stats()
+    return result, elapsed, profile.stats
+
+
+def add_worker_profile(stats: Optional[dict]):
+    if _PROFILER is not None and stats is not None:
+        _PROFILER.add_worker_profile(stats)
+
+
+def report(
+    profiler: Optional[Profiler],
+    print_summary: bool = True,
+    stats_json: Optional[str] = None,
+    cprofile_path: Optional[str] = None,
+):
+    """Prints and saves the statistics of a profiler. It does nothing if
+    `profiler` is `None`, i.e., profiling was already disabled."""
+    if profiler is None:
+        return
+    summary = profiler.summary()
+    if stats_json is not None:
+        with open(stats_json, mode="w") as f:
+            json.dump(summary, f, indent=2)
+    if cprofile_path is not None:
+        if profiler.cprofile is not None:
+            profiler.cprofile.dump_stats(cprofile_path)
+        if profiler.worker_stats is not None:
+            profiler.worker_stats.dump_stats(cprofile_path + ".workers")
+    if not print_summary:
+        return
+
+    cli.echo(
+        "profile: wall time {:.2f} s, peak RSS {:,.1f} MiB (workers {:,.1f} MiB)".format(
+            summary["wall_time"],
+            summary["peak_rss"] / (1 << 20),
+            summary["peak_rss_children"] / (1 << 20),
+        ),
+        err=True,
+    )
+    for name, stats in summary["stages"].items():
+        line = "  {}: {:.2f} s, {:,} calls".format(name, stats["elapsed"], stats["calls"])
+        if stats["lines"] > 0 and stats["elapsed"] > 0:
+            line += ", {:,} lines ({:,.0f} lines/s)".format(
+                stats["lines"], stats["lines_per_sec"]
+            )
+        if stats["bytes"] > 0 and stats["elapsed"] > 0:
+            line += ", {:,.1f} MiB ({:,.1f} MiB/s)".format(
+                stats["bytes"] / (1 << 20), stats["bytes_per_sec"] / (1 << 20)
+            )
+        cli.echo(line, err=True)
+    workers = summary["workers"]
+    if workers["utilization"] is not None:
+        cli.echo(
+            "  workers: {}, busy {:.2f} s, utilization {:.1%}".format(
+                workers["num_workers"], workers["busy_time"], workers["utilization"]
+            ),
+            err=True,
+        )
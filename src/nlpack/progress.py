@@ -0,0 +1,182 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import datetime
+import os
+import stat
+import sys
+import time
+from typing import IO, Optional, Sequence
+
+from nlpack import cli
+
+# Set to `False` by `nlpack --no-progress`.
+ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def file_size(f: IO) -> Optional[int]:
+    """Returns the size of a regular file, or `None` for pipes and ttys."""
+    try:
+        st = os.fstat(f.fileno())
+    except (OSError, ValueError):
+        return None
+    return st.st_size if stat.S_ISREG(st.st_mode) else None
+
+
+def file_position(f: IO) -> int:
+    """Returns the position of the file descriptor.
+
+    It is read from the OS rather than the file object, so it costs nothing
+    while reading. It is ahead of the consumed lines by the read buffer, and
+    compressed files are measured in compressed bytes.
+    """
+    try:
+        return os.lseek(f.fileno(), 0, os.SEEK_CUR)
+    except (OSError, ValueError):
+        return 0
+
+
+def format_bytes(n: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if n < 1024:
+            return "{:.1f} {}".format(n, unit)
+        n /= 1024
+    return "{:.1f} TiB".format(n)
+
+
+class Progress:
+    """Reports the progress of a long-running command on the standard error.
+
+    On a terminal, a `rich` progress bar shows the bytes read from the input
+    files against their sizes, lines/s, the keep ratio and the ETA.
+    Otherwise, a plain log line is written every `log_interval` seconds.
+    Updates are throttled, so `update()` can be called for every chunk.
+
+    Args:
+        description (str): Shown at the beginning of the display.
+        files (Sequence[IO]): Input files. The ETA is shown only if all of
+          them are regular files.
+        interval (float): Minimum seconds between refreshes of the bar.
+        log_interval (float): Seconds between plain log lines.
+    """
+
+    def __init__(
+        self,
+        description: str,
+        files: Sequence[IO] = (),
+        interval: float = 0.5,
+        log_interval: float = 60.0,
+    ):
+        self.description = description
+        self.files = files
+        sizes = [size for size in map(file_size, files) if size is not None]
+        self.total_bytes = (
+            sum(sizes) if len(files) > 0 and len(sizes) == len(files) else None
+        )
+        self.lines = 0
+        self.kept: Optional[int] = None
+        self.start = time.monotonic()
+        self.enabled = ENABLED
+        self.is_tty = sys.stderr.isatty()
+        self.interval = interval if self.is_tty else log_interval
+        self.next_update = self.start + self.interval
+        self.display = None
+        self.task = None
+
+    def __enter__(self) -> "Progress":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, lines: int, kept: Optional[int] = None):
+        """Adds the processed lines, and the kept lines if the command filters
+        lines."""
+        self.lines += lines
+        if kept is not None:
+            self.kept = (self.kept or 0) + kept
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now < self.next_update:
+            return
+        self.next_update = now + self.interval
+        if self.is_tty:
+            self.refresh()
+        else:
+            cli.echo(self.log_line(now), err=True)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(file_position(f) for f in self.files)
+
+    def fields(self, now: float) -> dict:
+        elapsed = max(now - self.start, 1e-9)
+        return {
+            "rate": "{:,.0f} lines/s".format(self.lines / elapsed),
+            "keep": "kept {:.1%}".format(self.kept / self.lines)
+            if self.kept is not None and self.lines > 0
+            else "",
+        }
+
+    def log_line(self, now: float) -> str:
+        fields = self.fields(now)
+        items = ["{}: {:,} lines".format(self.description, self.lines), fields["rate"]]
+        if self.total_bytes:
+            ratio = min(self.nbytes / self.total_bytes, 1.0)
+            items.append(
+                "{:.1%} of {}".format(ratio, format_bytes(self.total_bytes))
+            )
+            if ratio > 0:
+                remaining = (now - self.start) * (1 - ratio) / ratio
+                items.append(
+                    "ETA {}".format(datetime.timedelta(seconds=round(remaining)))
+                )
+        if fields["keep"]:
+            items.append(fields["keep"])
+        return ", ".join(items)
+
+    def refresh(self):
+        if self.display is None:
+            from rich.console import Console
+            from rich.progress import (
+                BarColumn,
+                DownloadColumn,
+                TextColumn,
+                TimeRemainingColumn,
+            )
+            from rich.progress import Progress as RichProgress
+
+            self.display = RichProgress(
+                TextColumn("{task.description}"),
+                BarColumn(),
+                DownloadColumn(binary_units=True),
+                TextColumn("{task.fields[rate]}"),
+                TextColumn("{task.fields[keep]}"),
+                TimeRemainingColumn(),
+                console=Console(stderr=True),
+                auto_refresh=False,
+                transient=True,
+            )
+            self.display.start()
+            self.task = self.display.add_task(
+                self.description,
+                total=self.total_bytes,
+                **self.fields(time.monotonic()),
+            )
+        self.display.update(
+            self.task, completed=self.nbytes, **self.fields(time.monotonic())
+        )
+        self.display.refresh()
+
+    def close(self):
+        if self.display is not None:
+            self.display.stop()
+            self.display = None
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import asyncio
+import bisect
+import concurrent.futures
+import http.client
+import json
+import os
+import signal
+import socket
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from nlpack import api, cli
+from nlpack.normalizer import NORMALIZATION_TYPES
+
+MAX_BODY_SIZE = 64 << 20
+STATUS_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class LatencyHistogram:
+    """Histogram of latencies on log-spaced buckets in milliseconds."""
+
+    BOUNDS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Returns the upper bound of the bucket that contains the quantile."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumsum = 0
+        for bound, count in zip(self.BOUNDS_MS, self.counts):
+            cumsum += count
+            if cumsum >= rank:
+                return min(float(bound), self.max_ms)
+        return self.max_ms
+
+    def summary(self) -> Dict[str, Any]:
+        labels = ["<={}".format(b) for b in self.BOUNDS_MS] + [
+            ">{}".format(self.BOUNDS_MS[-1])
+        ]
+        return {
+            "count": self.count,
+            "mean": self.total_ms / self.count if self.count > 0 else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max_ms,
+            "buckets": {
+                label: count for label, count in zip(labels, self.counts) if count > 0
+            },
+        }
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.lines = 0
+        self.batches = 0
+        self.batch_lines = 0
+        self.latency = LatencyHistogram()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "lines": self.lines,
+            "batches": self.batches,
+            "mean_batch_lines": self.batch_lines / self.batches if self.batches > 0 else None,
+            "latency_ms": self.latency.summary(),
+        }
+
+
+class MicroBatcher:
+    """Merges concurrent requests into batches.
+
+    A batch is run when it reaches `max_batch_size` lines or `max_latency`
+    seconds have passed since its first request. Requests that arrive while
+    a batch is running are merged into the next batch.
+
+    Args:
+        func (Callable[[List[str]], List]): Returns one result per line.
+        stats (EndpointStats): Statistics of the endpoint.
+        executor (concurrent.futures.Executor): Runs `func` off the event loop.
+        max_batch_size (int): The maximum number of lines of a batch.
+        max_latency (float): Seconds to wait for more requests.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[List[str]], List],
+        stats: EndpointStats,
+        executor: concurrent.futures.Executor,
+        max_batch_size: int,
+        max_latency: float,
+    ):
+        self.func = func
+        self.stats = stats
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def submit(self, lines: List[str]) -> List:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((lines, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            num_lines = len(items[0][0])
+            deadline = loop.time() + self.max_latency
+            while num_lines < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                num_lines += len(item[0])
+
+            batch = [line for lines, _ in items for line in lines]
+            try:
+                results = await loop.run_in_executor(self.executor, self.func, batch)
+            except (Exception, SystemExit) as e:
+                # `cli.abort()` raises SystemExit, which must not stop the loop.
+                error = e if isinstance(e, Exception) else RuntimeError(str(e))
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.stats.batches += 1
+            self.stats.batch_lines += len(batch)
+            begin = 0
+            for lines, future in items:
+                if not future.done():
+                    future.set_result(results[begin : begin + len(lines)])
+                begin += len(lines)
+
+
+def get_lines(payload: Dict[str, Any]) -> List[str]:
+    lines = payload.get("lines")
+    if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+        raise HTTPError(400, "`lines' must be a list of strings.")
+    return lines
+
+
+class Server:
+    """Serves `normalize', `tokenize' and `lid' with warm resources.
+
+    Args:
+        max_batch_size (int): The maximum number of lines of a batch.
+        max_latency (float): Seconds to wait for requests merged into a batch.
+        num_threads (int): The number of threads that run batches.
+        lid_model (str, optional): Path of the fastText LID model. The LID
+          endpoint is disabled if it is `None`.
+    """
+
+    ENDPOINTS = ("/normalize", "/tokenize", "/lid")
+
+    def __init__(
+        self,
+        max_batch_size: int = 256,
+        max_latency: float = 0.005,
+        num_threads: int = 1,
+        lid_model: Optional[str] = None,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.executor = concurrent.futures.ThreadPoolExecutor(num_threads)
+        self.lid_model = lid_model
+        self.batchers: Dict[Tuple, MicroBatcher] = {}
+        self.stats = {endpoint: EndpointStats() for endpoint in self.ENDPOINTS}
+        self.start = time.monotonic()
+
+    def warm_up(self):
+        """Loads the normalizers, the space tokenizer and the LID model."""
+        list(api.normalize(["warm up"], types=["nfkc", "space"]))
+        api.get_tokenizer("space")
+        if self.lid_model is not None:
+            api.identify_language(["warm up"], model=self.lid_model)
+
+    def batch_function(self, endpoint: str, payload: Dict[str, Any]) -> Tuple[Tuple, Callable]:
+        """Returns the key of the batcher and the function run on a batch.
+        Requests with the same key are merged."""
+        if endpoint == "/normalize":
+            types = payload.get("types", ["space"])
+            if isinstance(types, str):
+                types = [types]
+            if not isinstance(types, list) or any(
+                t not in NORMALIZATION_TYPES for t in types
+            ):
+                raise HTTPError(400, "Unknown normalization types: {}".format(types))
+            types = tuple(types)
+            return (endpoint, types), lambda lines: list(api.normalize(lines, types))
+        if endpoint == "/tokenize":
+            type = payload.get("type", "space")
+            lang = payload.get("lang", "en")
+            hyphen_split = bool(payload.get("aggresive_hyphen_split", False))
+            if type not in ("space", "moses"):
+                raise HTTPError(400, "Unknown tokenizer type: {}".format(type))
+            try:
+                tokenizer = api.get_tokenizer(type, lang, hyphen_split)
+            except SystemExit:
+                # Raised by `cli.abort()` if the tokenizer is not installed.
+                raise HTTPError(500, "The {} tokenizer is not available.".format(type))
+            return (endpoint, type, lang, hyphen_split), tokenizer
+        if endpoint == "/lid":
+            if self.lid_model is None:
+                raise HTTPError(404, "The LID endpoint is disabled.")
+            k = payload.get("k", 1)
+            if not isinstance(k, int) or k < 1:
+                raise HTTPError(400, "`k' must be a positive integer.")
+            return (endpoint, k), lambda lines: api.identify_language(
+                lines, k=k, model=self.lid_model
+            )
+        raise HTTPError(404, "Unknown endpoint: {}".format(endpoint))
+
+    async def process(self, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        lines = get_lines(payload)
+        key, func = self.batch_function(endpoint, payload)
+        if key not in self.batchers:
+            self.batchers[key] = MicroBatcher(
+                func,
+                self.stats[endpoint],
+                self.executor,
+                self.max_batch_size,
+                self.max_latency,
+            )
+        results = await self.batchers[key].submit(lines) if len(lines) > 0 else []
+        name = {"/normalize": "lines", "/tokenize": "tokens", "/lid": "predictions"}
+        return {name[endpoint]: results}
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "uptime": time.monotonic() - self.start,
+            "endpoints": {
+                endpoint: stats.summary()
+                for endpoint, stats in self.stats.items()
+                if stats.requests > 0
+            },
+        }
+
+    async def respond(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/stats":
+            return 200, self.summary()
+        if path not in self.ENDPOINTS:
+            raise HTTPError(404, "Unknown endpoint: {}".format(path))
+        if method != "POST":
+            raise HTTPError(405, "Use POST for {}.".format(path))
+
+        stats = self.stats[path]
+        stats.requests += 1
+        start = time.perf_counter()
+        try:
+            try:
+                payload = json.loads(body)
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                raise HTTPError(400, "Invalid JSON: {}".format(e))
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "The request body must be a JSON object.")
+            response = await self.process(path, payload)
+        except Exception:
+            stats.errors += 1
+            raise
+        stats.lines += len(payload["lines"])
+        stats.latency.add(time.perf_counter() - start)
+        return 200, response
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handles HTTP/1.1 requests on a connection until it is closed."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.send(writer, 400, {"error": "Invalid request line."}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (
+                    headers.get("connection", "").lower() != "close"
+                    if version == "HTTP/1.1"
+                    else headers.get("connection", "").lower() == "keep-alive"
+                )
+
+                try:
+                    length = int(headers.get("content-length", "0") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.send(writer, 400, {"error": "Invalid Content-Length."}, False)
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self.send(writer, 413, {"error": "Request too large."}, False)
+                    break
+                body = await reader.readexactly(length) if length > 0 else b""
+                try:
+                    status, response = await self.respond(
+                        method, target.split("?")[0], body
+                    )
+                except HTTPError as e:
+                    status, response = e.status, {"error": str(e)}
+                except (Exception, SystemExit) as e:
+                    status, response = 500, {"error": "{}: {}".format(type(e).__name__, e)}
+                await self.send(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(
+        self, writer: asyncio.StreamWriter, status: int, response: Dict, keep_alive: bool
+    ):
+        body = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            "HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=utf-8\r\n"
+            "Content-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                status,
+                STATUS_REASONS.get(status, ""),
+                len(body),
+                "keep-alive" if keep_alive else "close",
+            ).encode("latin-1")
+            + body
+        )
+        await writer.drain()
+
+    async def serve(self, host: str, port: int, unix_socket: Optional[str] = None):
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle, path=unix_socket)
+            address = "unix:" + unix_socket
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port)
+            address = "http://{}:{}".format(host, server.sockets[0].getsockname()[1])
+        cli.echo("Listening on {}".format(address), err=True)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        async with server:
+            await stop.wait()
+        for batcher in self.batchers.values():
+            batcher.task.cancel()
+        self.executor.shutdown()
+        if unix_socket is not None and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = 60.0):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class Client:
+    """A blocking client of `nlpack serve'.
+
+    Example:
+        >>> client = Client(port=8080)
+        >>> client.normalize(["Ｈｅｌｌｏ　 world"], types=["nfkc", "space"])
+        ['Hello world']
+
+    Args:
+        host (str): Host name.
+        port (int): Port number.
+        unix_socket (str, optional): Path of the Unix socket. It overrides
+          `host` and `port`.
+        timeout (float): Timeout in seconds.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        unix_socket: Optional[str] = None,
+        timeout: float = 60.0,
+    ):
+        self.connection: http.client.HTTPConnection
+        if unix_socket is not None:
+            self.connection = UnixHTTPConnection(unix_socket, timeout=timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict:
+        """Sends a request, and returns the decoded response.
+
+        Raises:
+            RuntimeError: If the server returns an error.
+        """
+        if payload is None:
+            self.connection.request("GET", path)
+        else:
+            self.connection.request(
+                "POST",
+                path,
+                body=json.dumps(payload).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+            )
+        response = self.connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError("{} {}".format(response.status, result.get("error")))
+        return result
+
+    def normalize(self, lines: Sequence[str], types: Sequence[str] = ("space",)) -> List[str]:
+        return self.request("/normalize", {"lines": list(lines), "types": list(types)})[
+            "lines"
+        ]
+
+    def tokenize(
+        self, lines: Sequence[str], type: str = "space", lang: str = "en"
+    ) -> List[List[str]]:
+        return self.request(
+            "/tokenize", {"lines": list(lines), "type": type, "lang": lang}
+        )["tokens"]
+
+    def lid(self, lines: Sequence[str], k: int = 1) -> List[List[Tuple[str, float]]]:
+        predictions = self.request("/lid", {"lines": list(lines), "k": k})["predictions"]
+        return [[(label, prob) for label, prob in pred] for pred in predictions]
+
+    def stats(self) -> Dict[str, Any]:
+        return self.request("/stats")
+
+    def close(self):
+        self.connection.close()
+
+
+def print_summary(summary: Dict[str, Any]):
+    for endpoint, stats in summary["endpoints"].items():
+        latency = stats["latency_ms"]
+        cli.echo(
+            "{}: {:,} requests, {:,} lines, {:,} batches, latency mean {:.2f} ms, "
+            "p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+                endpoint,
+                stats["requests"],
+                stats["lines"],
+                stats["batches"],
+                latency["mean"] or 0.0,
+                latency["p50"] or 0.0,
+                latency["p99"] or 0.0,
+                latency["max"],
+            ),
+            err=True,
+        )
+
+
+# fmt: off
+@cli.subcommand("serve")
+@cli.option("--host", type=str, metavar="HOST", default="127.0.0.1",
+            help="Host name to listen on.")
+@cli.option("--port", "-p", type=int, metavar="PORT", default=8080,
+            help="Port number to listen on. 0 picks a free port.")
+@cli.option("--unix-socket", type=str, metavar="PATH", default=None,
+            help="Listen on a Unix socket instead of TCP.")
+@cli.option("--max-batch-size", type=int, metavar="N", default=256,
+            help="The maximum number of lines of a micro-batch.")
+@cli.option("--max-latency", type=float, metavar="MS", default=5.0,
+            help="Milliseconds to wait for requests merged into a micro-batch.")
+@cli.option("--num-threads", type=int, metavar="N", default=1,
+            help="The number of threads that run micro-batches.")
+@cli.option("--lid/--no-lid", default=True,
+            help="Load the fastText LID model and serve `/lid'.")
+@cli.option("--lid-model", type=str, metavar="FILE", default=None,
+            help="Path of the fastText LID model. Defaults to `lid.176.bin' in the cache.")
+# fmt: on
+def serve(
+    host: str,
+    port: int,
+    unix_socket: Optional[str],
+    max_batch_size: int,
+    max_latency: float,
+    num_threads: int,
+    lid: bool,
+    lid_model: Optional[str],
+):
+    """Serve normalization, tokenization and LID over HTTP.
+
+    The normalizers, tokenizers and the LID model are loaded once and kept
+    warm. Concurrent requests are merged into micro-batches, which wait at
+    most `--max-latency' for more requests.
+
+    \b
+    POST /normalize  {"lines": [...], "types": ["nfkc", "space"]}
+    POST /tokenize   {"lines": [...], "type": "space", "lang": "en"}
+    POST /lid        {"lines": [...], "k": 1}
+    GET  /stats      Request counts and latency histograms per endpoint.
+    GET  /health
+    """
+
+    if lid and lid_model is None:
+        from nlpack.preprocessor.filter_by_lid import get_lid_model_path
+
+        lid_model = get_lid_model_path()
+    server = Server(
+        max_batch_size=max_batch_size,
+        max_latency=max_latency / 1000,
+        num_threads=num_threads,
+        lid_model=lid_model if lid else None,
+    )
+    server.warm_up()
+    asyncio.run(server.serve(host, port, unix_socket=unix_socket))
+    print_summary(server.summary())
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,192 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import concurrent.futures
+import json
+import os
+from typing import IO, List, Optional, Sequence, Union
+
+import numpy as np
+
+from nlpack import utils
+from nlpack.checkpoint import Checkpoint
+from nlpack.hashing import hash_line_tuples, mix64
+
+
+def shard_prefix(prefix: str, shard: int, num_shards: int) -> str:
+    """Returns `PREFIX.shardK`, or `PREFIX` if there is only one shard."""
+    if num_shards == 1:
+        return prefix
+    return "{}.shard{}".format(prefix, shard)
+
+
+def shard_ids(
+    columns: Sequence[List[bytes]],
+    num_shards: int,
+    shard_by: str = "hash",
+    seed: int = 0,
+    begin: int = 0,
+) -> np.ndarray:
+    """Assigns line tuples to shards.
+
+    `hash` assigns a tuple by its content, so identical tuples go to the same
+    shard in any run with the same `seed`. `round-robin` assigns the `i`-th
+    tuple to the shard `(begin + i) % num_shards`.
+
+    Returns:
+        np.ndarray: Shard IDs of shape `(num_lines,)`.
+    """
+    if shard_by == "round-robin":
+        return (begin + np.arange(len(columns[0]))) % num_shards
+    salt = mix64(np.array([seed], dtype=np.uint64))[0]
+    keys = hash_line_tuples(columns, bits=64)[:, 0]
+    return (mix64(keys ^ salt) % np.uint64(num_shards)).astype(np.int64)
+
+
+class ShardWriter:
+    """Writes kept line tuples to `OUTPUT_PREFIX.shardK.SUFFIX` files.
+
+    The files of a shard are aligned over the suffixes. Each chunk is grouped
+    by shard and written with one call per file, and the shards are written
+    by a thread pool. `close()` writes a manifest of the line and byte counts
+    of each shard to `OUTPUT_PREFIX.manifest.json`. With a single shard, the
+    outputs are `OUTPUT_PREFIX.SUFFIX` as usual and no manifest is written.
+
+    Example:
+        >>> writer = ShardWriter(output_prefix, suffixes, num_shards=8)
+        >>> writer.open(checkpoint)
+        >>> for columns, mask in results:
+        ...     writer.write(columns, mask)
+        >>> writer.close()
+
+    Args:
+        output_prefix (str): Output files prefix.
+        suffixes (Sequence[str]): File suffixes.
+        num_shards (int): The number of shards.
+        shard_by (str): `hash` or `round-robin`.
+        seed (int): Seed of the `hash` assignment.
+    """
+
+    def __init__(
+        self,
+        output_prefix: str,
+        suffixes: Sequence[str],
+        num_shards: int = 1,
+        shard_by: str = "hash",
+        seed: int = 0,
+    ):
+        if num_shards < 1:
+            raise ValueError("num_shards must be positive: {}".format(num_shards))
+        self.output_prefix = output_prefix
+        self.suffixes = list(suffixes)
+        self.num_shards = num_shards
+        self.shard_by = shard_by
+        self.seed = seed
+        self.files: List[List[IO]] = []
+        self.num_lines = [0] * num_shards
+        self.executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        num_threads = min(num_shards, os.cpu_count() or 1)
+        if num_threads > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(num_threads)
+
+    def paths(self, shard: int) -> List[str]:
+        prefix = shard_prefix(self.output_prefix, shard, self.num_shards)
+        return [prefix + "." + suffix for suffix in self.suffixes]
+
+    def open(self, checkpoint: Optional[Checkpoint] = None) -> List[IO]:
+        """Opens the output files through `checkpoint` if given, which
+        restores the line counts on resume.
+
+        Returns:
+            List[IO]: All output files in the shard order.
+        """
+        paths = [path for shard in range(self.num_shards) for path in self.paths(shard)]
+        if checkpoint is None:
+            files = [utils.open_file(path, mode="wb") for path in paths]
+        else:
+            files = checkpoint.open_outputs(paths)
+            self.num_lines = list(checkpoint.counters.get("shard_lines", self.num_lines))
+        n = len(self.suffixes)
+        self.files = [files[k * n : (k + 1) * n] for k in range(self.num_shards)]
+        return files
+
+    def write(
+        self,
+        columns: Sequence[List[bytes]],
+        mask: Optional[Union[Sequence, np.ndarray]] = None,
+    ):
+        """Writes the line tuples of aligned columns whose `mask` is true, or
+        all of them if `mask` is `None`."""
+        if self.num_shards == 1:
+            for f, lines in zip(self.files[0], columns):
+                if mask is None:
+                    f.writelines(lines)
+                else:
+                    f.writelines(line for line, keep in zip(lines, mask) if keep)
+            self.num_lines[0] += (
+                len(columns[0]) if mask is None else int(np.count_nonzero(mask))
+            )
+            return
+
+        if mask is not None:
+            ids = np.flatnonzero(np.asarray(mask)).tolist()
+            columns = [[lines[i] for i in ids] for lines in columns]
+        if len(columns[0]) == 0:
+            return
+        shards = shard_ids(
+            columns, self.num_shards, self.shard_by, self.seed, sum(self.num_lines)
+        )
+        order = np.argsort(shards, kind="stable")
+        bounds = np.searchsorted(shards[order], np.arange(self.num_shards + 1))
+        order = order.tolist()
+        groups = []
+        for k in range(self.num_shards):
+            ids = order[bounds[k] : bounds[k + 1]]
+            self.num_lines[k] += len(ids)
+            groups.append([[lines[i] for i in ids] for lines in columns])
+        if self.executor is None:
+            for k, group in enumerate(groups):
+                self.write_shard(k, group)
+        else:
+            list(self.executor.map(self.write_shard, range(self.num_shards), groups))
+
+    def write_shard(self, shard: int, columns: Sequence[List[bytes]]):
+        if len(columns[0]) == 0:
+            return
+        for f, lines in zip(self.files[shard], columns):
+            # Only the last line of an input may lack the newline.
+            f.write(b"".join(lines[:-1]) + utils.ensure_newline(lines[-1]))
+
+    def close(self):
+        for files in self.files:
+            for f in files:
+                f.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.num_shards == 1:
+            return
+
+        shards = [
+            {
+                "shard": k,
+                "num_lines": self.num_lines[k],
+                "files": self.paths(k),
+                "num_bytes": [os.path.getsize(path) for path in self.paths(k)],
+            }
+            for k in range(self.num_shards)
+        ]
+        with open(self.output_prefix + ".manifest.json", mode="w") as f:
+            json.dump(
+                {
+                    "suffixes": self.suffixes,
+                    "num_shards": self.num_shards,
+                    "shard_by": self.shard_by,
+                    "seed": self.seed,
+                    "num_lines": sum(self.num_lines),
+                    "shards": shards,
+                },
+                f,
+                indent=2,
+            )
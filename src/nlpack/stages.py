@@ -0,0 +1,228 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import abc
+from typing import List, Optional, Sequence, Tuple, Type
+
+import numpy as np
+
+from nlpack.hashing import HashSet, hash_line_tuples
+from nlpack.normalizer import NORMALIZATION_TYPES, Normalizer
+from nlpack.preprocessor.filters import RuleStats, build_rules
+from nlpack.tokenizer import Tokenizer
+from nlpack.utils import SentenceBatch
+
+
+def select(batches: List[SentenceBatch], mask: np.ndarray) -> List[SentenceBatch]:
+    """Keeps the line tuples whose mask is `True`."""
+    ids = np.flatnonzero(mask).tolist()
+    return [
+        SentenceBatch([batch.ids[i] for i in ids], [batch.lines[i] for i in ids])
+        for batch in batches
+    ]
+
+
+def encode(batches: Sequence[SentenceBatch]) -> List[List[bytes]]:
+    """Encodes lines to UTF-8, restoring the invalid bytes kept as surrogates."""
+    return [
+        [line.encode("utf-8", errors="surrogateescape") for line in batch.lines]
+        for batch in batches
+    ]
+
+
+class Stage(abc.ABC):
+    """A pipeline stage that transforms or filters aligned batches.
+
+    A stage takes one `SentenceBatch` per suffix; the batches share the same
+    sentence ids. Stateless stages run in worker processes, while stateful
+    stages run in the main process in the input order.
+
+    Args:
+        all_suffixes (Sequence[str]): All file suffixes of the pipeline.
+        suffixes (Sequence[str], optional): Suffixes processed by the stage.
+          Defaults to all suffixes.
+    """
+
+    name = ""
+    stateful = False
+
+    def __init__(
+        self, all_suffixes: Sequence[str], suffixes: Optional[Sequence[str]] = None
+    ):
+        if suffixes is None:
+            suffixes = all_suffixes
+        if any(s not in all_suffixes for s in suffixes):
+            raise ValueError("unknown suffixes: {}".format(list(suffixes)))
+        self.columns = [list(all_suffixes).index(s) for s in suffixes]
+
+    def setup(self):
+        """Loads the resources of the stage. It is called in every process."""
+
+    @abc.abstractmethod
+    def __call__(self, batches: List[SentenceBatch]) -> List[SentenceBatch]:
+        """Processes the batches and returns the kept line tuples."""
+
+
+class FilterStage(Stage):
+    """A stage that keeps line tuples by a mask of their UTF-8 lines.
+
+    The commands call `mask()` on the lines read from files, so they filter
+    the same line tuples as the pipeline and the API.
+    """
+
+    @abc.abstractmethod
+    def mask(self, columns: Sequence[List[bytes]]) -> np.ndarray:
+        """Returns `True` for the kept line tuples. `columns` has the lines of
+        all suffixes."""
+
+    def __call__(self, batches):
+        return select(batches, self.mask(encode(batches)))
+
+
+class NormalizeStage(Stage):
+    name = "normalize"
+
+    def __init__(self, all_suffixes, type: Sequence[str] = ("space",), suffixes=None):
+        super().__init__(all_suffixes, suffixes)
+        self.types = [type] if isinstance(type, str) else list(type)
+        if any(t not in NORMALIZATION_TYPES for t in self.types):
+            raise ValueError("unknown normalization types: {}".format(self.types))
+
+    def __call__(self, batches):
+        normalizers = [getattr(Normalizer, t) for t in self.types]
+        for c in self.columns:
+            lines = batches[c].lines
+            for norm in normalizers:
+                lines = [norm(line) for line in lines]
+            batches[c] = SentenceBatch(batches[c].ids, lines)
+        return batches
+
+
+class TokenizeStage(Stage):
+    name = "tokenize"
+
+    def __init__(
+        self,
+        all_suffixes,
+        type: str = "space",
+        lang: str = "en",
+        aggresive_hyphen_split: bool = False,
+        suffixes=None,
+    ):
+        super().__init__(all_suffixes, suffixes)
+        self.type = type
+        self.lang = lang
+        self.aggresive_hyphen_split = aggresive_hyphen_split
+        self.tokenizer: Optional[Tokenizer] = None
+
+    def setup(self):
+        self.tokenizer = Tokenizer(
+            self.type, lang=self.lang, hyphen_split=self.aggresive_hyphen_split
+        )
+
+    def __call__(self, batches):
+        for c in self.columns:
+            tokens = self.tokenizer(batches[c].lines)
+            batches[c] = SentenceBatch(batches[c].ids, [" ".join(t) for t in tokens])
+        return batches
+
+
+class CleanStage(FilterStage):
+    """Filters line tuples with the rules of `parallel-cleaner` and
+    `mono-cleaner`, and takes the same defaults. The length ratios only apply
+    to a stage on two suffixes, as in `parallel-cleaner`."""
+
+    name = "clean"
+
+    def __init__(
+        self,
+        all_suffixes,
+        min_len: int = 1,
+        max_len: int = 10000,
+        ratio: Optional[float] = 9,
+        char_ratio: Optional[float] = None,
+        max_token_len: Optional[int] = None,
+        max_digit_ratio: Optional[float] = None,
+        blacklist: Sequence[str] = (),
+        suffixes=None,
+    ):
+        super().__init__(all_suffixes, suffixes)
+        if len(self.columns) != 2:
+            if char_ratio is not None:
+                raise ValueError("`char_ratio' needs exactly two suffixes")
+            ratio = None
+        self.rule_set = build_rules(
+            len(self.columns),
+            min_len,
+            max_len,
+            ratio=ratio,
+            char_ratio=char_ratio,
+            max_token_len=max_token_len,
+            max_digit_ratio=max_digit_ratio,
+            blacklist=blacklist,
+        )
+
+    def filter(self, columns: Sequence[List[bytes]]) -> Tuple[np.ndarray, RuleStats]:
+        """Returns the mask and the statistics of the rules."""
+        return self.rule_set([columns[c] for c in self.columns])
+
+    def mask(self, columns):
+        return self.filter(columns)[0]
+
+
+class LidStage(FilterStage):
+    name = "lid"
+
+    def __init__(
+        self,
+        all_suffixes,
+        langs: Sequence[str],
+        min_prob: float = 0.0,
+        model: Optional[str] = None,
+    ):
+        super().__init__(all_suffixes)
+        if len(langs) != len(all_suffixes):
+            raise ValueError("`langs' must be given for every suffix")
+        self.lang_labels = ["__label__" + lang if lang != "__" else None for lang in langs]
+        self.min_prob = min_prob
+        self.model = model
+
+    def setup(self):
+        from nlpack.preprocessor.filter_by_lid import get_lid_model_path, init_lid_model
+
+        if self.model is None:
+            self.model = get_lid_model_path()
+        init_lid_model(self.model)
+
+    def mask(self, columns):
+        from nlpack.preprocessor.filter_by_lid import lid_mask
+
+        return lid_mask(columns, self.lang_labels, self.min_prob)
+
+
+class DedupStage(FilterStage):
+    name = "dedup"
+    stateful = True
+
+    def __init__(self, all_suffixes, hash_bits: int = 64, suffixes=None):
+        super().__init__(all_suffixes, suffixes)
+        if hash_bits not in (64, 128):
+            raise ValueError("`hash_bits' must be 64 or 128")
+        self.hash_bits = hash_bits
+        self.hash_set = HashSet(words=hash_bits // 64)
+
+    def mask(self, columns):
+        keys = hash_line_tuples([columns[c] for c in self.columns], bits=self.hash_bits)
+        return self.hash_set.add(keys)
+
+
+STAGE_CLASSES: List[Type[Stage]] = [
+    NormalizeStage,
+    TokenizeStage,
+    CleanStage,
+    LidStage,
+    DedupStage,
+]
+STAGES = {stage.name: stage for stage in STAGE_CLASSES}
@@ -3,10 +3,214 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-
+import bz2
+import concurrent.futures
+import gzip
+import io
+import itertools
 import json
+import lzma
+import os
+import re
+import sys
+import time
+from collections import deque
 from dataclasses import dataclass
-from typing import Generator, Iterable, Optional
+from functools import partial
+from typing import (
+    IO,
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Optional,
+    Sequence,
+)
+
+from nlpack import profiling
+
+COMPRESSORS: Dict[str, Callable[..., IO]] = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+MAGIC_BYTES = {
+    b"\x1f\x8b": ".gz",
+    b"BZh": ".bz2",
+    b"\xfd7zXZ\x00": ".xz",
+}
+BLOCK_COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {
+    ".gz": partial(gzip.compress, compresslevel=6, mtime=0),
+    ".bz2": partial(bz2.compress, compresslevel=9),
+    ".xz": lzma.compress,
+}
+COMPRESS_BLOCK_SIZE = 4 << 20
+# The number of threads that compress the blocks of an output file. It is
+# set by `nlpack --compress-threads`.
+COMPRESS_THREADS = min(4, os.cpu_count() or 1)
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+SIZE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", re.IGNORECASE)
+
+
+def parse_size(size: str) -> int:
+    """Parses a human readable size such as `512M` or `4G` into bytes."""
+    m = SIZE_PATTERN.match(size)
+    if m is None:
+        raise ValueError("Invalid size: {}".format(size))
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2).upper()])
+
+
+def detect_compression(head: bytes) -> Optional[str]:
+    """Returns the extension of the compression format of the leading bytes."""
+    for magic, ext in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return ext
+    return None
+
+
+def compression_of(path: str) -> Optional[str]:
+    """Returns the compression format of a file by its magic bytes, or by its
+    extension if it cannot be read."""
+    if os.path.isfile(path):
+        with open(path, mode="rb") as f:
+            return detect_compression(f.read(6))
+    ext = os.path.splitext(path)[1]
+    return ext if ext in COMPRESSORS else None
+
+
+def is_compressed(path: str) -> bool:
+    return compression_of(path) is not None
+
+
+class BlockCompressedWriter(io.BufferedIOBase, BinaryIO):
+    """Writes a compressed file by compressing blocks in a thread pool.
+
+    Each block is compressed independently into a gzip member, a bzip2
+    stream, or an xz stream, and they are written in order. Concatenated
+    members are valid files for the standard tools and decompressors. zlib,
+    bz2, and lzma release the GIL while compressing, so the blocks are
+    compressed in parallel.
+
+    Args:
+        fileobj (IO): Binary file the compressed blocks are written to.
+        compress (Callable[[bytes], bytes]): Compresses a block.
+        num_threads (int): The number of compression threads.
+        block_size (int): Uncompressed bytes of a block.
+        closefd (bool): Close `fileobj` when the writer is closed.
+    """
+
+    def __init__(
+        self,
+        fileobj: IO,
+        compress: Callable[[bytes], bytes],
+        num_threads: int,
+        block_size: int = COMPRESS_BLOCK_SIZE,
+        closefd: bool = True,
+    ):
+        self.fileobj = fileobj
+        self.compress = compress
+        self.block_size = block_size
+        self.closefd = closefd
+        self.buffer: list[bytes] = []
+        self.buffer_size = 0
+        self.max_pending = 2 * num_threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(num_threads)
+        self.pending: deque = deque()
+
+    @property
+    def name(self) -> Any:
+        return self.fileobj.name
+
+    def writable(self) -> bool:
+        return True
+
+    def fileno(self) -> int:
+        return self.fileobj.fileno()
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.buffer.append(bytes(data))
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.block_size:
+            self.submit()
+        return len(data)
+
+    def submit(self):
+        if self.buffer_size == 0:
+            return
+        block = b"".join(self.buffer)
+        self.buffer, self.buffer_size = [], 0
+        self.pending.append(self.executor.submit(self.compress, block))
+        while len(self.pending) >= self.max_pending or (
+            len(self.pending) > 0 and self.pending[0].done()
+        ):
+            self.fileobj.write(self.pending.popleft().result())
+
+    def flush(self):
+        """Compresses the buffered data and writes all blocks."""
+        if self.closed:
+            return
+        self.submit()
+        while len(self.pending) > 0:
+            self.fileobj.write(self.pending.popleft().result())
+        self.fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # `IOBase.close()` flushes the blocks before marking it closed.
+            super().close()
+        finally:
+            self.executor.shutdown()
+            if self.closefd:
+                self.fileobj.close()
+
+
+def open_file(path: str, mode: str = "r") -> IO:
+    """Opens a file, a compressed file, or the standard input/output.
+
+    Compressed inputs are detected by their magic bytes, including the
+    standard input, and decompressed while reading. Outputs are compressed
+    by their extensions: `.gz`, `.bz2`, and `.xz`, in blocks compressed by
+    `COMPRESS_THREADS` threads. `-` means the standard input for reading and
+    the standard output for writing; it is not closed when the returned
+    object is closed.
+
+    Args:
+        path (str): File path or `-`.
+        mode (str): Open mode such as `r`, `rb`, `w`, and `wb`.
+
+    Returns:
+        IO: A file object.
+    """
+    if "r" in mode and path == "-":
+        raw = open(sys.stdin.fileno(), mode="rb", closefd=False)
+        ext = detect_compression(raw.peek(6)[:6])
+        if ext is not None:
+            return COMPRESSORS[ext](raw, mode=mode if "b" in mode else mode + "t")
+        return raw if "b" in mode else io.TextIOWrapper(raw)
+    if "r" in mode:
+        ext = compression_of(path)
+        if ext is not None:
+            return COMPRESSORS[ext](path, mode=mode if "b" in mode else mode + "t")
+        return open(path, mode=mode)
+    if path == "-":
+        return open(sys.stdout.fileno(), mode=mode, closefd=False)
+
+    ext = os.path.splitext(path)[1]
+    if ext not in COMPRESSORS:
+        return open(path, mode=mode)
+    if COMPRESS_THREADS <= 1 or "a" in mode:
+        return COMPRESSORS[ext](path, mode=mode if "b" in mode else mode + "t")
+    writer = BlockCompressedWriter(
+        open(path, mode="wb"), BLOCK_COMPRESSORS[ext], COMPRESS_THREADS
+    )
+    return writer if "b" in mode else io.TextIOWrapper(writer)
+
+
+def ensure_newline(line: bytes) -> bytes:
+    return line if line.endswith(b"\n") else line + b"\n"
 
 
 @dataclass
@@ -31,6 +235,7 @@ def buffer_lines(
     if jsonl_key is not None:
         json_decoder = json.JSONDecoder()
 
+    start = time.perf_counter()
     for idx, line in enumerate(lines, start=1):
         if strip:
             line = line.strip()
@@ -40,8 +245,144 @@ def buffer_lines(
         buf.append(line)
         ids.append(idx)
         if len(buf) >= buffer_size:
+            profiling.add("read", time.perf_counter() - start, calls=1, lines=len(buf))
             yield SentenceBatch(ids, buf)
             buf, ids = [], []
+            start = time.perf_counter()
 
     if len(buf) > 0:
+        profiling.add("read", time.perf_counter() - start, calls=1, lines=len(buf))
         yield SentenceBatch(ids, buf)
+
+
+def buffer_aligned_lines(
+    files: Sequence[IO], buffer_size: int = 10000
+) -> Generator[list[list], None, None]:
+    """Reads aligned chunks of lines from multiple files.
+
+    Each chunk is a list of columns, i.e., `chunk[i]` holds the lines of
+    `files[i]`. Like `zip()`, reading stops at the end of the shortest file.
+
+    Args:
+        files (Sequence[IO]): Input files.
+        buffer_size (int): The number of lines in a chunk.
+
+    Yields:
+        list[list]: Columns of lines.
+    """
+    while True:
+        with profiling.timer("read"):
+            columns = [list(itertools.islice(f, buffer_size)) for f in files]
+        num_lines = min(len(column) for column in columns)
+        if profiling.enabled():
+            profiling.add(
+                "read",
+                lines=num_lines,
+                nbytes=sum(len(line) for column in columns for line in column),
+            )
+        if num_lines == 0:
+            return
+        if any(len(column) != num_lines for column in columns):
+            columns = [column[:num_lines] for column in columns]
+        yield columns
+        if num_lines < buffer_size:
+            return
+
+
+def imap_ordered(
+    func: Callable,
+    iterable: Iterable,
+    num_workers: int = 1,
+    max_pending: Optional[int] = None,
+    initializer: Optional[Callable] = None,
+    initargs: tuple = (),
+) -> Generator[tuple[Any, Any], None, None]:
+    """Applies a function to each item in worker processes.
+
+    The results are yielded in the input order. Unlike
+    `ProcessPoolExecutor.map()`, the input is consumed lazily, so at most
+    `max_pending` items are held in memory at once.
+
+    Args:
+        func (Callable): A picklable function applied to each item.
+        iterable (Iterable): Input items.
+        num_workers (int): The number of worker processes. If it is less than
+          or equal to 1, the function is applied in the current process.
+        max_pending (int, optional): The maximum number of submitted items
+          whose results have not been yielded yet. Defaults to
+          `2 * num_workers`.
+        initializer (Callable, optional): Called once in each worker.
+        initargs (tuple): Arguments passed to the initializer.
+
+    Yields:
+        tuple[Any, Any]: A pair of an input item and its result.
+    """
+    if profiling.enabled():
+        return _imap_profiled(
+            func, iterable, num_workers, max_pending, initializer, initargs
+        )
+    return _imap_ordered(func, iterable, num_workers, max_pending, initializer, initargs)
+
+
+def _imap_ordered(
+    func: Callable,
+    iterable: Iterable,
+    num_workers: int,
+    max_pending: Optional[int],
+    initializer: Optional[Callable],
+    initargs: tuple,
+) -> Generator[tuple[Any, Any], None, None]:
+    if num_workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in iterable:
+            yield item, func(item)
+        return
+
+    if max_pending is None:
+        max_pending = 2 * num_workers
+    pending: deque = deque()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=num_workers, initializer=initializer, initargs=initargs
+    ) as executor:
+        for item in iterable:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= max_pending:
+                item, future = pending.popleft()
+                with profiling.timer("wait"):
+                    result = future.result()
+                yield item, result
+        while len(pending) > 0:
+            item, future = pending.popleft()
+            with profiling.timer("wait"):
+                result = future.result()
+            yield item, result
+
+
+def _imap_profiled(
+    func: Callable,
+    iterable: Iterable,
+    num_workers: int,
+    max_pending: Optional[int],
+    initializer: Optional[Callable],
+    initargs: tuple,
+) -> Generator[tuple[Any, Any], None, None]:
+    """`imap_ordered()` that records the compute time of each item, the worker
+    utilization, and the cProfile statistics of the workers."""
+    cprofile = num_workers > 1 and profiling.cprofile_enabled()
+    start = time.perf_counter()
+    busy = 0.0
+    for item, (result, elapsed, stats) in _imap_ordered(
+        partial(profiling.timed_call, func, cprofile),
+        iterable,
+        num_workers,
+        max_pending,
+        initializer,
+        initargs,
+    ):
+        busy += elapsed
+        profiling.add("compute", elapsed, calls=1)
+        profiling.add_worker_profile(stats)
+        yield item, result
+    if num_workers > 1:
+        profiling.add_workers(num_workers, busy, time.perf_counter() - start)
@@ -0,0 +1,94 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from nlpack import api
+from nlpack.preprocessor.clean_mono_corpus import clean_mono_corpus
+from nlpack.preprocessor.clean_parallel_corpus import clean_parallel_corpus
+from nlpack.preprocessor.dedup import dedup
+
+
+def random_rows(num_rows: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    words = ["a", "bb", "ccc", "dddd", "12345", "x" * 30]
+    rows = []
+    for _ in range(num_rows):
+        src, tgt = (
+            " ".join(rng.choice(words, size=int(rng.integers(1, 12))).tolist())
+            for _ in range(2)
+        )
+        rows.append((src, tgt))
+    # Duplicates for `dedup'.
+    return rows + rows[: num_rows // 3]
+
+
+def write_rows(prefix, suffixes, rows):
+    for suffix, lines in zip(suffixes, zip(*rows)):
+        with open("{}.{}".format(prefix, suffix), mode="w") as f:
+            f.writelines(line + "\n" for line in lines)
+
+
+def read_rows(prefix, suffixes):
+    columns = []
+    for suffix in suffixes:
+        with open("{}.{}".format(prefix, suffix)) as f:
+            columns.append(f.read().splitlines())
+    return list(zip(*columns))
+
+
+def invoke(command, args):
+    result = CliRunner().invoke(command, args)
+    assert result.exit_code == 0, result.output
+
+
+@pytest.mark.parametrize(
+    "options, kwargs",
+    [
+        ([], {}),
+        (
+            ["--max-len", "8", "--ratio", "2", "--max-token-len", "10"],
+            dict(max_len=8, ratio=2, max_token_len=10),
+        ),
+        (
+            ["--char-ratio", "1.5", "--max-digit-ratio", "0.3", "--blacklist", "^a "],
+            dict(char_ratio=1.5, max_digit_ratio=0.3, blacklist=["^a "]),
+        ),
+    ],
+)
+def test_parallel_cleaner_matches_api(tmp_path, options, kwargs):
+    rows = random_rows(300)
+    write_rows(tmp_path / "corpus", ["en", "ja"], rows)
+    invoke(
+        clean_parallel_corpus,
+        ["-i", str(tmp_path / "corpus"), "-o", str(tmp_path / "out")]
+        + ["-s", "en", "-t", "ja", *options],
+    )
+    assert read_rows(tmp_path / "out", ["en", "ja"]) == list(api.clean(rows, **kwargs))
+
+
+def test_mono_cleaner_matches_api(tmp_path):
+    lines = [src for src, _ in random_rows(300)]
+    write_rows(tmp_path / "corpus", ["en"], [(line,) for line in lines])
+    invoke(
+        clean_mono_corpus,
+        ["-i", str(tmp_path / "corpus"), "-o", str(tmp_path / "out")]
+        + ["-s", "en", "--max-len", "8", "--max-digit-ratio", "0.3"],
+    )
+    expected = list(api.clean(lines, max_len=8, max_digit_ratio=0.3))
+    assert [line for (line,) in read_rows(tmp_path / "out", ["en"])] == expected
+
+
+def test_dedup_hash_matches_api(tmp_path):
+    rows = random_rows(300)
+    write_rows(tmp_path / "corpus", ["en", "ja"], rows)
+    invoke(
+        dedup,
+        ["-i", str(tmp_path / "corpus"), "-o", str(tmp_path / "out")]
+        + ["-s", "en", "-s", "ja", "-m", "hash"],
+    )
+    assert read_rows(tmp_path / "out", ["en", "ja"]) == list(api.dedup(rows))
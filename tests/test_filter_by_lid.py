@@ -0,0 +1,55 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import importlib
+
+import numpy as np
+
+# The package attribute `filter_by_lid` is the command, not the module.
+lid = importlib.import_module("nlpack.preprocessor.filter_by_lid")
+
+LABELS = ["__label__en", "__label__ja"]
+
+
+class FixedModel:
+    """Predicts the given label and probability of each line."""
+
+    def __init__(self, predictions):
+        self.predictions = predictions
+
+    def predict(self, lines, k=1):
+        labels, probs = [], []
+        for line in lines:
+            label, prob = self.predictions[line]
+            labels.append((label,) + tuple(x for x in LABELS if x != label)[: k - 1])
+            probs.append(np.array([prob] + [0.0] * (k - 1)))
+        return labels, probs
+
+
+def test_direct_and_saved_predictions_keep_the_same_lines(monkeypatch):
+    # The probabilities differ from 0.5002 in float64 but not in float16.
+    predictions = {
+        "a": ("__label__en", 0.5001),
+        "b": ("__label__en", 0.5002),
+        "c": ("__label__en", 0.49),
+        "d": ("__label__ja", 0.9),
+    }
+    monkeypatch.setattr(lid, "_LID_MODEL", FixedModel(predictions))
+    monkeypatch.setattr(lid, "_LABEL_IDS", {x: i for i, x in enumerate(LABELS)})
+    columns = [[line.encode() + b"\n" for line in predictions]]
+
+    direct = lid.lid_mask(columns, ["__label__en"], min_prob=0.5002)
+    saved = lid.predictions_mask(
+        lid.predict_top_k(columns, top_k=2), [0], min_prob=0.5002
+    )
+    assert direct.tolist() == saved.tolist() == [True, True, False, False]
+
+
+def test_read_empty_predictions(tmp_path):
+    writer = lid.PredictionWriter(str(tmp_path), ["en", "ja"], LABELS, top_k=2)
+    writer.close()
+    meta, chunks = lid.read_predictions(str(tmp_path), ["en", "ja"], buffer_size=10)
+    assert meta["num_lines"] == 0
+    assert list(chunks) == []
@@ -0,0 +1,92 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import io
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from nlpack.preprocessor.length_bucket import LengthSorter, length_bucket
+
+
+def random_columns(num_lines: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 6, size=num_lines)
+    src = [
+        " ".join(["s{}".format(i)] * n).encode() + b"\n" for i, n in enumerate(lengths)
+    ]
+    trg = ["t{}\n".format(i).encode() for i in range(num_lines)]
+    return [src, trg], lengths
+
+
+@pytest.mark.parametrize("fan_in", [2, 3, 64])
+@pytest.mark.parametrize("chunk_size", [1, 7, 50])
+@pytest.mark.parametrize("memory_budget", [1, 10**9])
+def test_external_sort_matches_stable_sort(tmp_path, fan_in, chunk_size, memory_budget):
+    # With a budget of 1 byte, every chunk is a run, e.g., 200 runs of a line
+    # are merged through several levels with a fan-in of 2.
+    columns, lengths = random_columns(200)
+    sorter = LengthSorter(str(tmp_path), 2, memory_budget, fan_in)
+    for begin in range(0, 200, chunk_size):
+        sorter.add(
+            [lines[begin : begin + chunk_size] for lines in columns],
+            lengths[begin : begin + chunk_size],
+        )
+    assert (len(sorter.runs) > 0) == (memory_budget == 1)
+    output_files = [io.BytesIO(), io.BytesIO()]
+    sorter.write(output_files)
+
+    order = sorted(range(200), key=lambda i: lengths[i])
+    for f, lines in zip(output_files, columns):
+        assert f.getvalue() == b"".join(lines[i] for i in order)
+    # The runs are removed after merging.
+    assert list(tmp_path.iterdir()) == []
+
+
+def run(tmp_path, *args):
+    return CliRunner().invoke(
+        length_bucket,
+        [
+            "-i",
+            str(tmp_path / "corpus"),
+            "-o",
+            str(tmp_path / "out"),
+            "-s",
+            "en",
+            "-s",
+            "ja",
+            *args,
+        ],
+    )
+
+
+def write_corpus(prefix):
+    columns, _ = random_columns(100)
+    for suffix, lines in zip(("en", "ja"), columns):
+        with open("{}.{}".format(prefix, suffix), mode="wb") as f:
+            f.writelines(lines)
+    return columns
+
+
+def test_sort_with_small_budget(tmp_path):
+    columns = write_corpus(tmp_path / "corpus")
+    result = run(
+        tmp_path, "--sort", "--memory-budget", "1K", "--tmp-dir", str(tmp_path)
+    )
+    assert result.exit_code == 0, result.output
+    order = sorted(range(100), key=lambda i: len(columns[0][i].split()))
+    for suffix, lines in zip(("en", "ja"), columns):
+        with open(tmp_path / "out.{}".format(suffix), mode="rb") as f:
+            assert f.read() == b"".join(lines[i] for i in order)
+
+
+@pytest.mark.parametrize("width", ["0", "-1"])
+def test_non_positive_bucket_width_aborts(tmp_path, width):
+    write_corpus(tmp_path / "corpus")
+    result = run(tmp_path, "--bucket-width", width)
+    assert result.exit_code != 0
+    assert "`--bucket-width' must be positive." in result.output
+    assert not (tmp_path / "out.manifest.json").exists()
@@ -0,0 +1,81 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from nlpack.preprocessor.near_dedup import LSHIndex, near_dedup
+
+
+def write_corpus(path, num_docs: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # Digits are normalized, so the words consist of letters.
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    docs = [
+        " ".join("".join(word) for word in rng.choice(letters, size=(20, 6)).tolist())
+        for _ in range(num_docs)
+    ]
+    lines = []
+    for doc in docs:
+        lines.append(doc)
+        # Near-duplicates differ only in case and punctuation.
+        if rng.random() < 0.3:
+            lines.append(doc.upper() + " !")
+    path.write_text("\n".join(lines) + "\n")
+    return docs
+
+
+def run(tmp_path, name, *args):
+    result = CliRunner().invoke(
+        near_dedup,
+        [
+            "-i",
+            str(tmp_path / "corpus"),
+            "-o",
+            str(tmp_path / name),
+            "-s",
+            "en",
+            "--tmp-dir",
+            str(tmp_path),
+            "--shingle",
+            "token",
+            "-n",
+            "2",
+            *args,
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    return (tmp_path / "{}.en".format(name)).read_text().splitlines()
+
+
+def test_near_duplicates_are_removed(tmp_path):
+    docs = write_corpus(tmp_path / "corpus.en", 200)
+    assert run(tmp_path, "out") == docs
+
+
+@pytest.mark.parametrize("buffer_size", ["1", "7", "64"])
+def test_spilled_index_matches_in_memory_index(tmp_path, buffer_size):
+    write_corpus(tmp_path / "corpus.en", 300)
+    expected = run(tmp_path, "memory")
+    # A budget of a few representatives spills the index many times.
+    budget = LSHIndex.bytes_per_representative(128, 9) * 3
+    spilled = run(
+        tmp_path, "spilled", "--memory-budget", str(budget), "-b", buffer_size
+    )
+    assert spilled == expected
+    # The work directory is removed.
+    assert not any(p.is_dir() for p in tmp_path.iterdir())
+
+
+def test_runs_are_merged_logarithmically(tmp_path):
+    index = LSHIndex(16, 4, 4, str(tmp_path), buffer_size=1)
+    rng = np.random.default_rng(0)
+    signatures = rng.integers(0, 1 << 32, size=(200, 16), dtype=np.uint32)
+    for signature in signatures[:200]:
+        assert index.query(signature[None], 0.8) == [False]
+    # 200 spills leave at most log2(200) + 1 runs in each band.
+    assert all(len(runs) <= 8 for runs in index.runs)
+    assert index.query(signatures[:10], 0.8) == [True] * 10
@@ -0,0 +1,34 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+
+from click.testing import CliRunner
+
+from nlpack.pipeline import pipeline
+
+
+def test_invalid_utf8_is_passed_through(tmp_path):
+    (tmp_path / "corpus.en").write_bytes(b"ok\nbad \xff\xfe byte\nbad \xff\xfe byte\n")
+    (tmp_path / "corpus.ja").write_bytes(b"a\nb\nb\n")
+    spec = tmp_path / "spec.json"
+    spec.write_text(
+        json.dumps(
+            {
+                "input_prefix": str(tmp_path / "corpus"),
+                "output_prefix": str(tmp_path / "out"),
+                "suffixes": ["en", "ja"],
+                "stages": [
+                    {"stage": "normalize", "type": ["nfkc", "space"]},
+                    {"stage": "clean"},
+                    {"stage": "dedup"},
+                ],
+            }
+        )
+    )
+    result = CliRunner().invoke(pipeline, [str(spec)])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "out.en").read_bytes() == b"ok\nbad \xff\xfe byte\n"
+    assert (tmp_path / "out.ja").read_bytes() == b"a\nb\n"
@@ -0,0 +1,72 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from collections import Counter
+
+import pytest
+from click.testing import CliRunner
+
+from nlpack.preprocessor.sampling_corpus import count_lines, sampling_corpus
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [(b"", 0), (b"a\n", 1), (b"a\nb\n", 2), (b"a\nb\nc", 3), (b"\n\n", 2)],
+)
+def test_count_lines(tmp_path, content, expected):
+    path = tmp_path / "corpus.en"
+    path.write_bytes(content)
+    assert count_lines(str(path)) == expected
+
+
+def write_corpus(path, lengths, terminated: bool = True):
+    lines = [" ".join(["w{}".format(i)] * n) for i, n in enumerate(lengths)]
+    path.write_text("\n".join(lines) + ("\n" if terminated else ""))
+    return lines
+
+
+def run_mixture(tmp_path, size: int, *args):
+    manifest = tmp_path / "manifest"
+    manifest.write_text("{}\n".format(tmp_path / "corpus"))
+    return CliRunner().invoke(
+        sampling_corpus,
+        [
+            "--manifest",
+            str(manifest),
+            "-o",
+            str(tmp_path / "out"),
+            "-s",
+            "en",
+            "-n",
+            str(size),
+            *args,
+        ],
+    )
+
+
+@pytest.mark.parametrize("stratify", [[], ["--stratify-length", "2"]])
+def test_mixture_samples_unterminated_last_line(tmp_path, stratify):
+    lines = write_corpus(tmp_path / "corpus.en", [1, 2, 3], terminated=False)
+    result = run_mixture(tmp_path, 3, *stratify)
+    assert result.exit_code == 0, result.output
+    assert sorted((tmp_path / "out.en").read_text().splitlines()) == sorted(lines)
+
+
+def test_stratified_sample_keeps_bucket_distribution(tmp_path):
+    lengths = [1] * 60 + [5] * 30 + [9] * 10
+    lines = write_corpus(tmp_path / "corpus.en", lengths)
+    result = run_mixture(tmp_path, 20, "--stratify-length", "4")
+    assert result.exit_code == 0, result.output
+    samples = (tmp_path / "out.en").read_text().splitlines()
+    assert len(samples) == len(set(samples)) == 20
+    assert set(samples) <= set(lines)
+    assert Counter(len(line.split()) for line in samples) == {1: 12, 5: 6, 9: 2}
+
+
+def test_non_positive_stratify_width_aborts(tmp_path):
+    write_corpus(tmp_path / "corpus.en", [1, 2, 3])
+    result = run_mixture(tmp_path, 2, "--stratify-length", "0")
+    assert result.exit_code != 0
+    assert "`--stratify-length' must be positive." in result.output
@@ -0,0 +1,149 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import asyncio
+import concurrent.futures
+import importlib.util
+import os
+import socket
+import tempfile
+from typing import Any, Callable
+
+import pytest
+
+from nlpack.server import Client, Server
+
+
+def run_with_server(func: Callable[[str], Any], **kwargs) -> Any:
+    """Runs `func(unix_socket)` in a thread while a server is listening."""
+
+    async def main():
+        server = Server(**kwargs)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "nlpack.sock")
+            async with await asyncio.start_unix_server(server.handle, path=path):
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, func, path
+                )
+        for batcher in server.batchers.values():
+            batcher.task.cancel()
+        server.executor.shutdown()
+        return result
+
+    return asyncio.run(main())
+
+
+def send_raw(path: str, request: bytes) -> bytes:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(10)
+        sock.connect(path)
+        sock.sendall(request)
+        response = b""
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                return response
+            response += data
+
+
+def test_normalize_and_tokenize():
+    def func(path):
+        client = Client(unix_socket=path)
+        try:
+            return (
+                client.normalize(["Ｈｅｌｌｏ　 world"], types=["nfkc", "space"]),
+                client.tokenize(["a  b c", ""]),
+                client.normalize([]),
+            )
+        finally:
+            client.close()
+
+    normalized, tokens, empty = run_with_server(func)
+    assert normalized == ["Hello world"]
+    assert tokens == [["a", "b", "c"], []]
+    assert empty == []
+
+
+def test_concurrent_requests_are_batched():
+    num_requests = 4
+
+    def request(path, i):
+        client = Client(unix_socket=path)
+        try:
+            return client.normalize(["Ａ{}".format(i)], types=["nfkc"])
+        finally:
+            client.close()
+
+    def func(path):
+        with concurrent.futures.ThreadPoolExecutor(num_requests) as executor:
+            results = list(
+                executor.map(request, [path] * num_requests, range(num_requests))
+            )
+        client = Client(unix_socket=path)
+        try:
+            return results, client.stats()
+        finally:
+            client.close()
+
+    results, stats = run_with_server(func, max_latency=0.5)
+    assert results == [["A{}".format(i)] for i in range(num_requests)]
+    normalize = stats["endpoints"]["/normalize"]
+    assert normalize["requests"] == num_requests
+    assert normalize["lines"] == num_requests
+    assert normalize["batches"] < num_requests
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"lines": ["a"], "types": ["__class__"]},
+        {"lines": ["a"], "types": ["unknown"]},
+        {"lines": "a"},
+    ],
+)
+def test_normalize_rejects_bad_requests(payload):
+    def func(path):
+        client = Client(unix_socket=path)
+        try:
+            with pytest.raises(RuntimeError, match="^400 "):
+                client.request("/normalize", payload)
+            return client.request("/health")
+        finally:
+            client.close()
+
+    assert run_with_server(func) == {"status": "ok"}
+
+
+@pytest.mark.skipif(
+    importlib.util.find_spec("sacremoses") is not None, reason="sacremoses is installed"
+)
+def test_unavailable_tokenizer_keeps_the_server_alive():
+    def func(path):
+        client = Client(unix_socket=path)
+        try:
+            with pytest.raises(RuntimeError, match="^500 "):
+                client.tokenize(["a"], type="moses")
+            return client.tokenize(["a b"])
+        finally:
+            client.close()
+
+    assert run_with_server(func) == [["a", "b"]]
+
+
+@pytest.mark.parametrize("length", [b"abc", b"-1"])
+def test_invalid_content_length(length):
+    def func(path):
+        response = send_raw(
+            path, b"POST /normalize HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n"
+        )
+        client = Client(unix_socket=path)
+        try:
+            return response, client.request("/health")
+        finally:
+            client.close()
+
+    response, health = run_with_server(func)
+    assert response.startswith(b"HTTP/1.1 400 ")
+    assert health == {"status": "ok"}
@@ -0,0 +1,80 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import gzip
+import re
+
+import pytest
+from click.testing import CliRunner
+
+from nlpack.preprocessor.shuffle import MEMORY_FACTOR, shuffle
+
+
+def write_corpus(prefix, num_lines: int, ext: str = ""):
+    for suffix in ("en", "ja"):
+        path = "{}.{}{}".format(prefix, suffix, ext)
+        with (gzip.open if ext == ".gz" else open)(path, mode="wt") as f:
+            for i in range(num_lines):
+                f.write("{} {} {}\n".format(suffix, i, "x" * (i % 50)))
+
+
+def read_corpus(prefix, ext: str = ""):
+    columns = []
+    for suffix in ("en", "ja"):
+        path = "{}.{}{}".format(prefix, suffix, ext)
+        with (gzip.open if ext == ".gz" else open)(path, mode="rt") as f:
+            columns.append(f.read().splitlines())
+    return list(zip(*columns))
+
+
+def run(tmp_path, ext: str, *args):
+    result = CliRunner().invoke(
+        shuffle,
+        [
+            "-i",
+            str(tmp_path / "corpus"),
+            "-o",
+            str(tmp_path / "out"),
+            "-s",
+            "en" + ext,
+            "-s",
+            "ja" + ext,
+            "--tmp-dir",
+            str(tmp_path),
+            *args,
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    return int(re.search(r"buckets: ([\d,]+)", result.output)[1].replace(",", ""))
+
+
+@pytest.mark.parametrize("ext", ["", ".gz"])
+@pytest.mark.parametrize("budget", ["10M", "20K"])
+def test_shuffle_is_an_aligned_permutation(tmp_path, ext, budget):
+    write_corpus(tmp_path / "corpus", 2000, ext)
+    run(tmp_path, ext, "--memory-budget", budget)
+    expected = read_corpus(tmp_path / "corpus", ext)
+    shuffled = read_corpus(tmp_path / "out", ext)
+    assert shuffled != expected
+    assert sorted(shuffled) == sorted(expected)
+    assert not any(p.is_dir() for p in tmp_path.iterdir())
+
+
+def test_compressed_buckets_are_split_to_fit_the_budget(tmp_path):
+    write_corpus(tmp_path / "corpus", 2000, ".gz")
+    num_bytes = sum(
+        len(line) + 1
+        for lines in read_corpus(tmp_path / "corpus", ".gz")
+        for line in lines
+    )
+    # The compressed size suggests a single bucket.
+    num_buckets = run(tmp_path, ".gz", "--memory-budget", "100K")
+    assert num_buckets >= num_bytes * MEMORY_FACTOR / (100 * 1024)
+
+
+def test_oversized_tuple_is_shuffled(tmp_path):
+    write_corpus(tmp_path / "corpus", 1)
+    run(tmp_path, "", "--memory-budget", "1")
+    assert read_corpus(tmp_path / "out") == read_corpus(tmp_path / "corpus")
@@ -0,0 +1,98 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+from collections import Counter
+
+import pytest
+from click.testing import CliRunner
+
+from nlpack.preprocessor.split_corpus import parse_split, split_corpus
+
+
+def write_corpus(prefix, num_lines: int, repeat: int = 1):
+    for suffix in ("en", "ja"):
+        with open("{}.{}".format(prefix, suffix), mode="w") as f:
+            for i in range(num_lines):
+                for _ in range(repeat):
+                    f.write("{} {}\n".format(suffix, i))
+
+
+def read_split(prefix, name):
+    columns = []
+    for suffix in ("en", "ja"):
+        with open("{}.{}.{}".format(prefix, name, suffix)) as f:
+            columns.append(f.read().splitlines())
+    return list(zip(*columns))
+
+
+def run(tmp_path, *args):
+    return CliRunner().invoke(
+        split_corpus,
+        [
+            "-i",
+            str(tmp_path / "corpus"),
+            "-o",
+            str(tmp_path / "out"),
+            "-s",
+            "en",
+            "-s",
+            "ja",
+        ]
+        + list(args),
+    )
+
+
+def test_exact_sizes(tmp_path):
+    write_corpus(tmp_path / "corpus", 100)
+    result = run(tmp_path, "-S", "dev:10", "-S", "test:5")
+    assert result.exit_code == 0, result.output
+    splits = {
+        name: read_split(tmp_path / "out", name) for name in ("dev", "test", "train")
+    }
+    assert [len(splits[name]) for name in ("dev", "test", "train")] == [10, 5, 85]
+    assert sorted(sum(splits.values(), [])) == sorted(
+        ("en {}".format(i), "ja {}".format(i)) for i in range(100)
+    )
+
+
+@pytest.mark.parametrize("split", ["dev:10", "dev:0.2"])
+def test_repeated_tuples_do_not_straddle(tmp_path, split):
+    write_corpus(tmp_path / "corpus", 50, repeat=3)
+    result = run(tmp_path, "-S", split)
+    assert result.exit_code == 0, result.output
+    dev = read_split(tmp_path / "out", "dev")
+    train = read_split(tmp_path / "out", "train")
+    assert set(dev).isdisjoint(train)
+    if split == "dev:10":
+        # Repeated occurrences of held-out tuples are dropped.
+        assert len(dev) == len(set(dev)) == 10
+        assert len(train) == 40 * 3
+    else:
+        assert set(Counter(train).values()) == {3}
+
+
+@pytest.mark.parametrize(
+    "split", ["dev:-5", "dev:0", "dev:1.0", "dev:0.0", "dev:abc", "dev", ":10"]
+)
+def test_parse_split_rejects_bad_sizes(split):
+    with pytest.raises(ValueError):
+        parse_split(split)
+
+
+@pytest.mark.parametrize(
+    "splits",
+    [
+        ["-S", "dev:-5"],
+        ["-S", "dev:0.6", "-S", "test:0.4"],
+        ["-S", "dev:60", "-S", "test:50"],
+        # Only 50 distinct tuples for 60 held-out lines.
+        ["-S", "dev:60", "--key-suffix", "en"],
+    ],
+)
+def test_bad_splits_abort(tmp_path, splits):
+    write_corpus(tmp_path / "corpus", 50, repeat=2)
+    result = run(tmp_path, *splits)
+    assert result.exit_code != 0
+    assert not (tmp_path / "out.train.en").exists()
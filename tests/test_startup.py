@@ -0,0 +1,87 @@
+# Copyright (c) Hiroyuki Deguchi
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import importlib
+import json
+import subprocess
+import sys
+import time
+
+import pytest
+
+# Budget of `nlpack normalizer --help` and other light commands in seconds, as in the benchmarks.
+STARTUP_BUDGET = 0.5
+
+# Modules that only the heavy commands need.
+HEAVY_MODULES = [
+    "numpy",
+    "fasttext",
+    "lxml",
+    "rich",
+    "sacrebleu",
+    "nlpack.api",
+    "nlpack.hashing",
+    "nlpack.stages",
+]
+
+RUN_HELP = """
+import json, sys
+from nlpack.main import main
+try:
+    main([sys.argv[1], "--help"])
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)), file=sys.stderr)
+"""
+
+LIGHT_COMMANDS = ["normalizer", "tokenizer"]
+
+
+@pytest.mark.parametrize("command", LIGHT_COMMANDS)
+def test_help_imports_no_heavy_modules(command):
+    proc = subprocess.run(
+        [sys.executable, "-c", RUN_HELP, command],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert "Usage:" in proc.stdout
+    modules = set(json.loads(proc.stderr.splitlines()[-1]))
+    assert [m for m in HEAVY_MODULES if m in modules] == []
+
+
+@pytest.mark.parametrize("command", LIGHT_COMMANDS)
+def test_help_startup_time(command):
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "nlpack.main", command, "--help"],
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        best = min(best, time.perf_counter() - start)
+    assert best < STARTUP_BUDGET
+
+
+@pytest.mark.parametrize(
+    "package, name",
+    [
+        ("nlpack.analyzer", "corpus_stats"),
+        ("nlpack.preprocessor", "dedup"),
+        ("nlpack.preprocessor", "build_index"),
+    ],
+)
+@pytest.mark.parametrize("import_submodule_first", [False, True])
+def test_package_attributes_are_commands(package, name, import_submodule_first):
+    # The result must not depend on whether the submodule was imported.
+    code = "from {} import {} as m; print(type(m).__name__)".format(package, name)
+    if import_submodule_first:
+        command = importlib.import_module(package).SUBCOMMANDS[name.replace("_", "-")]
+        code = "import {}; ".format(command.split(":")[0]) + code
+    proc = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert proc.stdout.strip() == "HelpColorsCommand"